@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'salesapp.profiling.RequestProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'sales.urls'
@@ -125,3 +126,94 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# عدد العمليات (processes) المستخدمة لرسم صفحات الطباعة المجمعة بالتوازي
+# 0 أو 1 = رسم الصفحات في نفس العملية بدون توازي
+SALES_PRINT_WORKERS = 0
+
+# مجلد حفظ ملفات مهام الطباعة المجمعة التي يجهزها أمر run_print_jobs
+SALES_PRINT_JOBS_DIR = BASE_DIR / 'print_jobs'
+
+# المهمة الجارية التي لم يتحدث تقدمها لأكثر من هذه المدة (بالثواني) تعتبر عاملاً متوقفاً وتعاد للانتظار
+SALES_PRINT_JOB_STALE_SECONDS = 30 * 60
+
+# كاش صفحات الطباعة على القرص (صفحات كل وصل بعد رسمها، بمفتاح من بيانات الوصل وأقساطه ونسخة القالب)
+# وأقصى حجم له بالـ bytes (0 = إيقاف الكاش)، وعند تجاوزه تحذف الصفحات الأقدم استخداماً
+SALES_PRINT_CACHE_DIR = BASE_DIR / 'print_cache'
+SALES_PRINT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# الطباعة بصيغة PDF (?format=pdf) تحتاج المكتبات الاختيارية uharfbuzz و fonttools و brotli
+# (salesapp.pdf_printing.PDF_REQUIREMENTS)، وبدونها يظهر التحذير salesapp.W001.
+# SALES_PDF_FONTS = {'regular': '...', 'bold': '...'} لاستخدام خطوط غير Cairo من static/fonts
+
+# قياس أداء الطلبات (salesapp.profiling): نسبة الطلبات التي يتم قياسها (0 = إيقاف، 1 = كل الطلبات).
+# متوقف افتراضياً؛ يفعل مؤقتاً عند تتبع بطء (مثلاً 0.1)، وسجل الطلبات البطيئة يظهر لحسابات الإدارة (staff) فقط
+SALES_PROFILING_SAMPLE_RATE = 0
+
+# عدد أبطأ استعلامات SQL التي يتم حفظها لكل طلب مقاس
+SALES_PROFILING_TOP_QUERIES = 5
+
+# الطلب المقاس الذي يتجاوز هذا الزمن (بالمللي ثانية) يتم تسجيله في سجل الطلبات البطيئة
+SALES_SLOW_REQUEST_MS = 1000
+
+# ملف سجل الطلبات البطيئة (سطر JSON لكل طلب، ويتم تدويره عند امتلائه)
+SALES_SLOW_REQUEST_LOG = BASE_DIR / 'slow_requests.log'
+
+# الكاش: default للأعداد الكلية، و filter_options لقوائم فلاتر صفحة الأقساط.
+# LocMemCache خاص بكل عملية (process)؛ عند التشغيل بأكثر من عملية استخدم
+# 'django.core.cache.backends.filebased.FileBasedCache' مع LOCATION مشترك حتى يصل الإلغاء لكل العمليات.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'salesapp-default',
+    },
+    'filter_options': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'salesapp-filter-options',
+    },
+}
+
+# اسم الكاش المستخدم لقوائم الفلاتر، ومدة صلاحيتها (بالثواني) كاحتياط للتعديلات التي لا تمر على salesapp.stats
+SALES_FILTER_OPTIONS_CACHE = 'filter_options'
+SALES_FILTER_OPTIONS_TIMEOUT = 3600
+
+# مدة حفظ الأعداد الكلية لصفحات البحث والأقساط في الكاش (بالثواني)
+SALES_COUNT_CACHE_SECONDS = 60
+
+# اقتراحات البحث أثناء الكتابة: عدد النتائج المحفوظة داخل العملية ومدة صلاحيتها (بالثواني)
+SALES_SUGGEST_CACHE_SIZE = 512
+SALES_SUGGEST_CACHE_SECONDS = 60
+
+# الإدخال الجماعي للوصلات (JSON): أقصى عدد وصلات في الطلب، وعدد الوصلات في كل transaction
+SALES_INGEST_MAX_RECEIPTS = 5000
+SALES_INGEST_BATCH_SIZE = 200
+
+# توكنات الإدخال الجماعي: {توكن: رقم الفرع المسموح له}، ويرسل في header ‏Authorization: Bearer <توكن>.
+# بدون توكنات (القاموس فارغ) يرفض الإدخال الجماعي كل الطلبات
+SALES_INGEST_API_TOKENS = {}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message_only': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_requests_file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SALES_SLOW_REQUEST_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message_only',
+        },
+    },
+    'loggers': {
+        'salesapp.slow_requests': {
+            'handlers': ['slow_requests_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SalesappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'salesapp'
+
+    def ready(self):
+        # تسجيل signals فهرس بحث العملاء، وفحص مكتبات الطباعة بصيغة PDF
+        from . import checks, search_index  # noqa: F401
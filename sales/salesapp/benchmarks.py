@@ -0,0 +1,234 @@
+# salesapp/benchmarks.py
+"""
+قياس أداء الشاشات الأكثر استخداماً عبر Django test client:
+زمن التنفيذ، عدد استعلامات قاعدة البيانات، وأقصى استهلاك للذاكرة، مع المقارنة بملف baseline.
+يتم تشغيله بأمر benchmark_views (على قاعدة بيانات اختبار مؤقتة).
+"""
+import io
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import Branch, InstallmentPayment, InventoryItem, Receipt, Salesperson
+from .print_cache import DEFAULT_MAX_BYTES as DEFAULT_PRINT_CACHE_MAX_BYTES
+from .printing import iter_batch_page_contexts
+from .views import printable_receipts
+
+BASELINE_PATH = os.path.join(settings.BASE_DIR, 'salesapp', 'benchmark_baseline.json')
+
+# حجم البيانات الافتراضي (نفس القيم تعطي نفس البيانات بسبب seed و end_month الثابتين)
+DEFAULT_DATASET = {
+    'branches': 2, 'salespersons': 5, 'products': 20, 'receipts': 2000,
+    'months': 14, 'end_month': '2025-09', 'seed': 42,
+}
+
+# فرق الزمن الأقل من هذا (بالمللي ثانية) يعتبر تذبذباً في القياس وليس تراجعاً
+WALL_NOISE_FLOOR_MS = 5
+
+# فلاتر بحث الوصلات التي يتم تجربة كل تركيباتها
+SEARCH_FILTERS = ('salesperson', 'year', 'month', 'receipt_from', 'receipt_to', 'customer')
+
+
+def seed_dataset(**dataset):
+    """ينشئ بيانات الاختبار بـ populate_data --fast (يمسح البيانات الموجودة)."""
+    options = {**DEFAULT_DATASET, **dataset}
+    args = ['--fast'] + [f"--{name.replace('_', '-')}={value}" for name, value in options.items()]
+    call_command('populate_data', *args, stdout=io.StringIO())
+    return options
+
+
+def _consume(response):
+    # الاستجابات المتدفقة (الطباعة المجمعة) يجب قراءتها بالكامل حتى يتم قياس العمل الفعلي
+    if getattr(response, 'streaming', False):
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def measure(func, repeat=3):
+    """
+    ينفذ func عدة مرات: الزمن من التشغيلات العادية (الوسيط)،
+    وعدد الاستعلامات والذاكرة من تشغيل إضافي تحت tracemalloc (لأنه يبطئ التنفيذ).
+    إذا رجعت func عدد صفحات يتم حساب الزمن لكل صفحة أيضاً.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            pages = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {
+        'wall_ms': round(statistics.median(timings), 2),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+    # الحالات التي ترجع عدد صفحات: التكلفة لكل صفحة (ميكرو ثانية)
+    if pages:
+        result['pages'] = pages
+        result['us_per_page'] = round(result['wall_ms'] * 1000 / pages, 1)
+    return result
+
+
+def _get(client, url_name, params=None, args=None):
+    def request():
+        response = client.get(reverse(url_name, args=args), params or {})
+        if response.status_code != 200:
+            raise AssertionError(f"{url_name} {params or ''} returned HTTP {response.status_code}")
+        _consume(response)
+    return request
+
+
+def build_cases(client, branch, cache_dir):
+    """قائمة (اسم الحالة, دالة تنفذ طلباً واحداً) لفرع معين. cache_dir: مجلد مؤقت لكاش الطباعة."""
+    receipts = Receipt.objects.filter(branch=branch)
+    sample = receipts.filter(is_cash_sale=False).order_by('receipt_number').first()
+    salesperson = Salesperson.objects.filter(branch=branch).order_by('id').first()
+    numbers = sorted(receipts.values_list('receipt_number', flat=True))
+    filter_values = {
+        'salesperson': salesperson.id if salesperson else '',
+        'year': sample.sale_year if sample else '', 'month': sample.sale_month if sample else '',
+        'receipt_from': numbers[len(numbers) // 4] if numbers else '',
+        'receipt_to': numbers[len(numbers) * 3 // 4] if numbers else '',
+        'customer': (sample.customer_name.split()[0] if sample and sample.customer_name else ''),
+    }
+
+    cases = [('dashboard', _get(client, 'dashboard', {'year': filter_values['year'], 'month': filter_values['month']}))]
+    for size in range(len(SEARCH_FILTERS) + 1):
+        for combination in itertools.combinations(SEARCH_FILTERS, size):
+            name = f"search_receipts[{'+'.join(combination) or 'none'}]"
+            cases.append((name, _get(client, 'search_receipts', {key: filter_values[key] for key in combination})))
+    for view_mode in ('assignment', 'confirmation'):
+        cases.append((f'manage_installments[{view_mode}]', _get(client, 'manage_installments', {'view': view_mode})))
+    if sample is not None:
+        cases.append(('print_receipt', _get(client, 'print_receipt', args=[sample.id])))
+        cases.append(('print_receipt[pdf]', _get(client, 'print_receipt', {'format': 'pdf'}, args=[sample.id])))
+        # الطباعة المجمعة لمندوب واحد في شهر واحد (حجم يشبه الاستخدام اليومي)
+        batch_filters = {
+            'salesperson': filter_values['salesperson'], 'year': filter_values['year'], 'month': filter_values['month'],
+        }
+        cases.append(('print_batch_receipts', _get(client, 'print_batch_receipts', batch_filters)))
+        cases.append(('print_batch_receipts[pdf]', _get(client, 'print_batch_receipts', {**batch_filters, 'format': 'pdf'})))
+        # إعادة طباعة نفس الدفعة: كل الصفحات من كاش الطباعة (أول تشغيل يملأ الكاش)
+        cases.append(('print_batch_receipts[cached]', _with_print_cache(
+            _get(client, 'print_batch_receipts', batch_filters), cache_dir,
+        )))
+    # كشف خط سير المحصل الأكثر أقساطاً غير مدفوعة في شهر واحد
+    busiest = InstallmentPayment.objects.filter(
+        receipt__branch=branch, is_paid=False, collector__isnull=False,
+    ).values('collector', month=TruncMonth('payment_date')).annotate(count=Count('id')).order_by('-count', 'collector').first()
+    if busiest is not None:
+        for output_format in ('csv', 'xlsx', 'pdf'):
+            cases.append((f'collector_route_sheet[{output_format}]', _get(client, 'collector_route_sheet', {
+                'collector_id': busiest['collector'], 'month': busiest['month'].strftime('%Y-%m'), 'format': output_format,
+            })))
+    cases.append(('add_receipt[POST]', _add_receipt_post(client, branch, salesperson)))
+    cases.append(('print_page_contexts', _page_contexts(receipts)))
+    return cases
+
+
+def _with_print_cache(func, cache_dir):
+    # باقي الحالات تقيس الرسم بدون كاش الطباعة (run_benchmarks)
+    def request():
+        with override_settings(SALES_PRINT_CACHE_DIR=cache_dir, SALES_PRINT_CACHE_MAX_BYTES=DEFAULT_PRINT_CACHE_MAX_BYTES):
+            func()
+    return request
+
+
+def _page_contexts(receipts, count=200):
+    """تنسيق بيانات صفحات الطباعة وحده (بدون قاعدة البيانات أو رسم القالب)، لقياس التكلفة لكل صفحة."""
+    loaded = list(printable_receipts(receipts.select_related('salesperson').order_by('receipt_number'))[:count])
+
+    def build():
+        return sum(1 for _ in iter_batch_page_contexts(loaded))
+    return build
+
+
+def _add_receipt_post(client, branch, salesperson):
+    product = InventoryItem.objects.filter(branch=branch).order_by('-quantity').first()
+    # كمية كبيرة حتى لا ينفذ المخزون أثناء التكرار
+    InventoryItem.objects.filter(pk=product.pk).update(quantity=1000000)
+    data = {
+        'salesperson_id': salesperson.id, 'sale_year': 2025, 'sale_month': 9,
+        'customer_name': 'عميل قياس الأداء', 'down_payment': 100, 'installment_system': '100*12',
+        'sale_items_json': json.dumps([{'id': product.id, 'quantity': 1, 'price': 1300, 'name': product.name}]),
+    }
+
+    def request():
+        response = client.post(reverse('add_receipt'), data)
+        if response.status_code != 302:
+            raise AssertionError(f"add_receipt POST did not save (HTTP {response.status_code})")
+    return request
+
+
+def run_benchmarks(repeat=3, only=None):
+    """يقيس كل الحالات على أكبر فرع في قاعدة البيانات الحالية. يرجع {اسم الحالة: النتائج}."""
+    branch = Branch.objects.annotate(receipts_count=Count('receipt')).order_by('-receipts_count', 'id').first()
+    if branch is None:
+        raise ValueError("لا توجد بيانات لقياس الأداء (استخدم seed_dataset أولاً).")
+    client = Client()
+    client.get(reverse('set_branch', args=[branch.id]))
+
+    results = {}
+    # إيقاف عينات salesapp.profiling حتى لا تؤثر على الأزمنة المقاسة، وإيقاف كاش الطباعة حتى تقيس حالات الطباعة الرسم نفسه
+    with override_settings(SALES_PROFILING_SAMPLE_RATE=0, SALES_PRINT_CACHE_MAX_BYTES=0), \
+            tempfile.TemporaryDirectory(prefix='print_cache_') as cache_dir:
+        for name, func in build_cases(client, branch, cache_dir):
+            if only and only not in name:
+                continue
+            results[name] = measure(func, repeat=repeat)
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(results, dataset, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'dataset': dataset, 'results': results}, file, ensure_ascii=False, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare_with_baseline(results, baseline, tolerance=0.5):
+    """
+    يرجع قائمة التراجعات مقارنة بالـ baseline:
+    أي زيادة في عدد الاستعلامات، أو زيادة في الزمن/الذاكرة أكبر من tolerance (0.5 = 50%).
+    الزمن يعتمد على الجهاز، لذلك المقارنة المهمة في المراجعة هي عدد الاستعلامات.
+    """
+    regressions = []
+    baseline_results = (baseline or {}).get('results', {})
+    for name, current in results.items():
+        previous = baseline_results.get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{name}: الاستعلامات {previous['queries']} -> {current['queries']}")
+        for metric in ('wall_ms', 'peak_kb'):
+            if metric == 'wall_ms' and current[metric] - previous[metric] < WALL_NOISE_FLOOR_MS:
+                continue
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+    return regressions
@@ -0,0 +1,34 @@
+# salesapp/bulk_insert.py
+"""
+إضافة الأقساط بأعداد كبيرة (الاستيراد وتوليد بيانات الاختبار).
+الأقساط هي أكبر جدول (عشرات لكل وصل)، فتضاف بـ executemany مباشرة
+بدلاً من إنشاء كائن Model لكل قسط كما يفعل bulk_create.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from .models import InstallmentPayment
+
+INSTALLMENT_COLUMNS = ('receipt', 'payment_date', 'amount', 'is_paid', 'collector')
+
+
+def _insert_sql(connection):
+    quote = connection.ops.quote_name
+    columns = [InstallmentPayment._meta.get_field(name).column for name in INSTALLMENT_COLUMNS]
+    return (
+        f"INSERT INTO {quote(InstallmentPayment._meta.db_table)} ({', '.join(quote(c) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+
+
+def insert_installments(rows, using=DEFAULT_DB_ALIAS):
+    """rows: [(receipt_id, payment_date, amount, is_paid, collector_id)]. يرجع عدد الأقساط المضافة."""
+    connection = connections[using]
+    adapt_date = connection.ops.adapt_datefield_value
+    params = [
+        (receipt_id, adapt_date(payment_date), amount, is_paid, collector_id)
+        for receipt_id, payment_date, amount, is_paid, collector_id in rows
+    ]
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(_insert_sql(connection), params)
+    return len(params)
@@ -0,0 +1,18 @@
+# salesapp/checks.py
+"""فحوصات النظام (manage.py check وعند تشغيل السيرفر)."""
+from django.core.checks import Warning, register
+
+from .pdf_printing import missing_pdf_requirements
+
+
+@register()
+def pdf_printing_requirements(app_configs, **kwargs):
+    """الطباعة بصيغة PDF تحتاج مكتبات اختيارية (PDF_REQUIREMENTS): تحذير بدلاً من خطأ عند أول طباعة."""
+    missing = missing_pdf_requirements()
+    if not missing:
+        return []
+    return [Warning(
+        f"الطباعة بصيغة PDF غير متاحة: المكتبات {', '.join(missing)} غير مثبتة.",
+        hint=f"pip install {' '.join(missing)}",
+        id='salesapp.W001',
+    )]
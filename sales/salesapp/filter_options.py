@@ -0,0 +1,64 @@
+# salesapp/filter_options.py
+"""
+قوائم خيارات الفلاتر في صفحة الأقساط (المناطق، أشهر الدفع، أشهر البيع) محفوظة في الكاش لكل فرع.
+حسابها يحتاج DISTINCT على كل وصلات وأقساط الفرع، لذلك يتم حسابها مرة واحدة
+ويتم إلغاؤها عند إضافة وصلات/أقساط (من salesapp.stats) أو بعد SALES_FILTER_OPTIONS_TIMEOUT.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.functions import TruncMonth
+
+from .models import Branch, InstallmentPayment, Receipt
+
+
+def _cache():
+    return caches[getattr(settings, 'SALES_FILTER_OPTIONS_CACHE', 'default')]
+
+
+def _key(branch_id):
+    return f'salesapp:filter_options:{branch_id}'
+
+
+def build_filter_options(branch_id):
+    areas = list(
+        Receipt.objects.filter(branch_id=branch_id).exclude(area__exact='')
+        .values_list('area', flat=True).distinct().order_by('area')
+    )
+
+    payment_months = InstallmentPayment.objects.filter(
+        receipt__branch_id=branch_id
+    ).annotate(
+        month_year=TruncMonth('payment_date')
+    ).values_list('month_year', flat=True).distinct().order_by('-month_year')
+
+    sale_months = Receipt.objects.filter(branch_id=branch_id).values(
+        'sale_year', 'sale_month'
+    ).distinct().order_by('-sale_year', '-sale_month')
+
+    return {
+        'areas': areas,
+        'payment_months': [d.strftime('%Y-%m') for d in payment_months if d is not None],
+        # يتم دمج السنة والشهر مع إضافة صفر في بداية الشهر إذا لزم الأمر
+        'sale_months': [
+            f"{p['sale_year']}-{p['sale_month']:02d}"
+            for p in sale_months if p['sale_year'] and p['sale_month']
+        ],
+    }
+
+
+def get_filter_options(branch):
+    """{'areas': [...], 'payment_months': ['2025-09', ...], 'sale_months': [...]} للفرع."""
+    cache = _cache()
+    options = cache.get(_key(branch.pk))
+    if options is None:
+        options = build_filter_options(branch.pk)
+        cache.set(_key(branch.pk), options, getattr(settings, 'SALES_FILTER_OPTIONS_TIMEOUT', 3600))
+    return options
+
+
+def invalidate_filter_options(branch_id=None):
+    """branch_id=None = كل الفروع (بعد الاستيراد أو إعادة البناء)."""
+    if branch_id is None:
+        _cache().delete_many([_key(pk) for pk in Branch.objects.values_list('pk', flat=True)])
+    else:
+        _cache().delete(_key(branch_id))
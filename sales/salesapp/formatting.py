@@ -0,0 +1,65 @@
+# salesapp/formatting.py
+"""
+تنسيق الأرقام العربية لصفحات الطباعة.
+- الأرقام الهندية (٠١٢...) بجدول str.translate محسوب مرة واحدة.
+- المبلغ بالحروف (num2words) في lru_cache: مبالغ الأقساط تتكرر كثيراً (250، 300، ...).
+- format_fields تنسق بيانات الصفحة كلها مرة واحدة.
+"""
+from datetime import date
+from functools import lru_cache
+
+from num2words import num2words
+
+_ARABIC_DIGITS = str.maketrans({
+    '0': '٠', '1': '١', '2': '٢', '3': '٣', '4': '٤',
+    '5': '٥', '6': '٦', '7': '٧', '8': '٨', '9': '٩',
+    '.': '٫',  # الفاصلة العشرية
+})
+
+WORDS_CACHE_SIZE = 4096
+DATES_CACHE_SIZE = 2048
+
+
+def ed2ad(value):
+    """Converts English digits to Arabic-Indic digits (value: str or number)."""
+    return str(value).translate(_ARABIC_DIGITS)
+
+
+@lru_cache(maxsize=WORDS_CACHE_SIZE)
+def _words(number):
+    try:
+        return num2words(number, lang='ar')
+    except Exception:
+        return ""
+
+
+def amount_to_words_ar(number):
+    """المبلغ بالحروف العربية ("" إذا لم يكن رقماً)."""
+    try:
+        return _words(int(number))
+    except (TypeError, ValueError):
+        return ""
+
+
+@lru_cache(maxsize=DATES_CACHE_SIZE)
+def format_date(value):
+    """تاريخ بصيغة dd/mm/yyyy بالأرقام الهندية."""
+    return ed2ad(value.strftime(r"%d/%m/%Y"))
+
+
+def format_value(value):
+    """قيمة واحدة بالأرقام الهندية (التواريخ بصيغة dd/mm/yyyy)."""
+    if isinstance(value, date):
+        return format_date(value)
+    return str(value).translate(_ARABIC_DIGITS)
+
+
+def format_fields(values, words=None):
+    """
+    ينسق بيانات صفحة كاملة مرة واحدة: كل القيم بالأرقام الهندية،
+    و words (اسم الحقل: المبلغ) للحقول التي تكتب بالحروف.
+    """
+    formatted = {key: format_value(value) for key, value in values.items()}
+    for key, amount in (words or {}).items():
+        formatted[key] = amount_to_words_ar(amount)
+    return formatted
@@ -0,0 +1,240 @@
+# salesapp/ingestion.py
+"""
+الإدخال الجماعي للوصلات (يوم كامل من الوصلات الورقية للفرع في طلب واحد).
+كل وصل له نفس بيانات شاشة add_receipt، وبنوده بنفس شكل sale_items_json: [{id, quantity, price, name}].
+الوصلات تحفظ على دفعات (SALES_INGEST_BATCH_SIZE) وكل دفعة في transaction واحد:
+قفل كل أصنافها باستعلام واحد، حجز أرقامها مرة واحدة، ثم bulk_create للوصلات والبنود و executemany للأقساط.
+الوصل غير الصحيح لا يوقف باقي الدفعة، ونتيجة كل وصل ترجع في نفس ترتيب الطلب.
+المفتاح (Idempotency-Key) يجعل إعادة إرسال نفس الطلب آمنة: الوصلات التي تم حفظها لا تتكرر.
+كل طلب يحتاج توكن من SALES_INGEST_API_TOKENS، والتوكن يسمح بفرع واحد فقط.
+"""
+import hashlib
+import hmac
+import json
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+
+from .bulk_insert import insert_installments
+from .inventory import InsufficientStockError, apply_stock_changes, lock_items, take_stock
+from .models import InventoryItem, Receipt, ReceiptIngestion, ReceiptNumberSequence, SaleItem, Salesperson
+from .schedule import installment_schedule, parse_installment_system
+from .search_index import index_receipts
+from .stats import record_new_receipts
+
+STATUS_CREATED = 'created'
+STATUS_ERROR = 'error'
+
+MAX_KEY_LENGTH = ReceiptIngestion._meta.get_field('key').max_length
+
+
+class IngestionError(ValueError):
+    """خطأ في الطلب نفسه (وليس في وصل واحد منه)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def token_branch_id(authorization):
+    """رقم الفرع المسموح لقيمة header ‏Authorization (Bearer <توكن>)، أو None إذا كان التوكن غير معروف."""
+    scheme, _, token = (authorization or '').partition(' ')
+    token = token.strip()
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    branch_id = None
+    # المقارنة بزمن ثابت، ومع كل التوكنات حتى لا يكشف الزمن أي توكن قريب من الصحيح
+    for configured, configured_branch_id in getattr(settings, 'SALES_INGEST_API_TOKENS', {}).items():
+        if hmac.compare_digest(str(configured).encode('utf-8'), token.encode('utf-8')):
+            branch_id = configured_branch_id
+    return branch_id
+
+
+def payload_hash(receipts):
+    return hashlib.sha256(
+        json.dumps(receipts, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def _int(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f"قيمة '{field}' غير صحيحة.")
+    try:
+        number = int(str(value).strip()) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"قيمة '{field}' غير صحيحة.")
+    if number != value and not isinstance(value, str):
+        raise ValueError(f"قيمة '{field}' يجب أن تكون عدداً صحيحاً.")
+    if number < 0:
+        raise ValueError(f"قيمة '{field}' لا يمكن أن تكون سالبة.")
+    return number
+
+
+def clean_receipt(data, salespersons):
+    """
+    يتحقق من وصل واحد بنفس قواعد add_receipt (بدون المخزون) ويرجع dict بالقيم النهائية.
+    salespersons: {id: Salesperson} لمندوبي الفرع. يرفع ValueError برسالة الخطأ.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("بيانات الوصل يجب أن تكون object.")
+    is_cash_sale = data.get('is_cash_sale') in (True, 1, 'on', 'true', '1')
+    customer_name = str(data.get('customer_name') or '').strip()
+    installment_system = str(data.get('installment_system') or '').strip()
+    sale_items = data.get('sale_items')
+    if sale_items is None and isinstance(data.get('sale_items_json'), str):
+        # نفس حقل شاشة الإضافة (نص JSON)
+        try: sale_items = json.loads(data['sale_items_json'])
+        except json.JSONDecodeError: raise ValueError("خطأ في بيانات المنتجات.")
+
+    if not data.get('salesperson_id') or not data.get('sale_year') or not data.get('sale_month'):
+        raise ValueError("يرجى ملء المندوب والتاريخ.")
+    if not isinstance(sale_items, list) or not sale_items:
+        raise ValueError("يجب إضافة منتج واحد على الأقل.")
+    if not is_cash_sale and not customer_name:
+        raise ValueError("اسم العميل إجباري للتقسيط.")
+    if not is_cash_sale and not installment_system:
+        raise ValueError("يجب وصف نظام القسط للتقسيط.")
+
+    salesperson = salespersons.get(_int(data['salesperson_id'], 'salesperson_id'))
+    if salesperson is None:
+        raise ValueError("المندوب غير موجود في هذا الفرع.")
+    sale_year = _int(data['sale_year'], 'sale_year'); sale_month = _int(data['sale_month'], 'sale_month')
+    try:
+        date(sale_year, sale_month, 1)
+    except ValueError:
+        raise ValueError("سنة أو شهر البيع غير صحيح.")
+
+    items = []
+    for item_data in sale_items:
+        if not isinstance(item_data, dict) or not item_data.get('id') or not item_data.get('quantity') or item_data.get('price') is None:
+            raise ValueError("بيانات منتج غير مكتملة.")
+        items.append({
+            'id': _int(item_data['id'], 'id'), 'quantity': _int(item_data['quantity'], 'quantity'),
+            'price': _int(item_data['price'], 'price'), 'name': str(item_data.get('name') or '').strip(),
+        })
+    total_amount = sum(item['quantity'] * item['price'] for item in items)
+
+    installment_amounts = []
+    down_payment = total_amount
+    if not is_cash_sale:
+        down_payment = _int(data.get('down_payment') or 0, 'down_payment')
+        installment_amounts = parse_installment_system(installment_system)
+        if not installment_amounts:
+            raise ValueError("لم يتم العثور على أقساط صحيحة.")
+        if sum(installment_amounts) + down_payment != total_amount:
+            raise ValueError(f"الإجمالي ({total_amount}) لا يساوي المقدم ({down_payment}) + الأقساط ({sum(installment_amounts)}).")
+
+    return {
+        'salesperson': salesperson, 'sale_year': sale_year, 'sale_month': sale_month, 'is_cash_sale': is_cash_sale,
+        'customer_name': customer_name, 'phone_number': str(data.get('phone_number') or '').strip(),
+        'address': str(data.get('address') or '').strip(), 'area': str(data.get('area') or '').strip(),
+        'items': items, 'total_amount': total_amount, 'down_payment': down_payment,
+        'installment_system': installment_system if not is_cash_sale else '',
+        'installment_dates': installment_schedule(sale_year, sale_month, installment_amounts),
+    }
+
+
+def _save_batch(branch, batch, salespersons):
+    """batch: [(index, data)]. يحفظ الوصلات الصحيحة ويرجع نتيجة كل وصل. يستدعى داخل transaction.atomic()."""
+    results = {}
+    cleaned = []
+    for index, data in batch:
+        try:
+            cleaned.append((index, clean_receipt(data, salespersons)))
+        except ValueError as e:
+            results[index] = {'index': index, 'status': STATUS_ERROR, 'error': str(e)}
+
+    # كل أصناف الدفعة في قفل واحد، ثم الخصم في الذاكرة بالترتيب (وصل بدون مخزون كاف يرفض وحده)
+    stock = lock_items(branch, {item['id'] for _, receipt in cleaned for item in receipt['items']})
+    stock_changes = Counter()
+    accepted = []
+    for index, receipt in cleaned:
+        try:
+            stock_changes.update(take_stock(stock, [(item['id'], item['quantity']) for item in receipt['items']]))
+        except (InventoryItem.DoesNotExist, InsufficientStockError) as e:
+            results[index] = {'index': index, 'status': STATUS_ERROR, 'error': str(e)}
+            continue
+        accepted.append((index, receipt))
+
+    if accepted:
+        apply_stock_changes(stock_changes)
+        numbers = ReceiptNumberSequence.allocate(len(accepted))
+        receipts = Receipt.objects.bulk_create([
+            Receipt(
+                receipt_number=number, branch=branch, salesperson=receipt['salesperson'],
+                sale_year=receipt['sale_year'], sale_month=receipt['sale_month'], is_cash_sale=receipt['is_cash_sale'],
+                customer_name=receipt['customer_name'], phone_number=receipt['phone_number'],
+                address=receipt['address'], area=receipt['area'],
+                products_text=" + ".join(
+                    f"{item['quantity']} x {item['name'] or stock[item['id']].name}" for item in receipt['items']
+                ),
+                total_amount=receipt['total_amount'], down_payment=receipt['down_payment'],
+                installment_system=receipt['installment_system'],
+            )
+            for number, (_, receipt) in zip(numbers, accepted)
+        ])
+        SaleItem.objects.bulk_create([
+            SaleItem(receipt=saved, inventory_item=stock[item['id']], quantity=item['quantity'], unit_price=item['price'])
+            for saved, (_, receipt) in zip(receipts, accepted) for item in receipt['items']
+        ])
+        insert_installments(
+            (saved.pk, payment_date, amount, False, None)
+            for saved, (_, receipt) in zip(receipts, accepted) for payment_date, amount in receipt['installment_dates']
+        )
+        record_new_receipts([
+            (saved, [
+                {'amount': amount, 'is_paid': False, 'payment_date': payment_date, 'collector_id': None}
+                for payment_date, amount in receipt['installment_dates']
+            ])
+            for saved, (_, receipt) in zip(receipts, accepted)
+        ])
+        # bulk_create لا يرسل post_save، فيتم تحديث فهرس البحث هنا
+        index_receipts(receipts)
+        for saved, (index, _) in zip(receipts, accepted):
+            results[index] = {
+                'index': index, 'status': STATUS_CREATED, 'receipt_id': saved.pk, 'receipt_number': saved.receipt_number,
+            }
+    return [results[index] for index, _ in batch]
+
+
+def ingest_receipts(branch, key, receipts, batch_size=None):
+    """
+    يحفظ receipts (قائمة وصلات) لفرع branch تحت المفتاح key. يرجع (ReceiptIngestion، هل هو طلب مكرر).
+    يرفع IngestionError إذا كان الطلب نفسه غير صالح أو المفتاح مستخدماً مع بيانات أخرى (status=409).
+    """
+    key = (key or '').strip()
+    if not key:
+        raise IngestionError("مفتاح الطلب (Idempotency-Key) إجباري.")
+    if len(key) > MAX_KEY_LENGTH:
+        raise IngestionError(f"مفتاح الطلب أطول من {MAX_KEY_LENGTH} حرف.")
+    if not isinstance(receipts, list) or not receipts:
+        raise IngestionError("يجب إرسال قائمة وصلات (receipts) بها وصل واحد على الأقل.")
+    max_receipts = getattr(settings, 'SALES_INGEST_MAX_RECEIPTS', 5000)
+    if len(receipts) > max_receipts:
+        raise IngestionError(f"أقصى عدد وصلات في الطلب الواحد {max_receipts}.", status=413)
+    batch_size = batch_size or getattr(settings, 'SALES_INGEST_BATCH_SIZE', 200)
+
+    digest = payload_hash(receipts)
+    ingestion, created = ReceiptIngestion.objects.get_or_create(
+        key=key, defaults={'branch': branch, 'payload_hash': digest, 'receipts_count': len(receipts)},
+    )
+    if ingestion.branch_id != branch.pk or ingestion.payload_hash != digest:
+        raise IngestionError("مفتاح الطلب مستخدم مسبقاً مع بيانات مختلفة.", status=409)
+    if ingestion.is_complete:
+        return ingestion, True
+    replayed = not created
+
+    salespersons = {person.pk: person for person in Salesperson.objects.filter(branch=branch)}
+    for start in range(0, len(receipts), batch_size):
+        with transaction.atomic():
+            # قفل صف الطلب: طلبان بنفس المفتاح في نفس الوقت لا يحفظان نفس الدفعة مرتين
+            ingestion = ReceiptIngestion.objects.select_for_update().get(pk=ingestion.pk)
+            done = len(ingestion.results)
+            if done >= start + batch_size:
+                continue
+            batch = [(index, receipts[index]) for index in range(max(start, done), min(start + batch_size, len(receipts)))]
+            ingestion.results = ingestion.results + _save_batch(branch, batch, salespersons)
+            ingestion.save(update_fields=['results', 'updated_at'])
+    return ingestion, replayed
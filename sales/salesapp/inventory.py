@@ -0,0 +1,76 @@
+# salesapp/inventory.py
+"""
+حجز المخزون للوصلات: قفل كل الأصناف المطلوبة باستعلام واحد (مرتب بالـ id حتى تأخذ كل العمليات
+الأقفال بنفس الترتيب وبدون deadlock)، التحقق من الكميات في الذاكرة، ثم خصم الكل بـ UPDATE واحد.
+يجب استدعاء هذه الدوال داخل transaction.atomic().
+"""
+from collections import Counter
+
+from django.db.models import Case, F, When
+
+from .models import InventoryItem
+
+
+class InsufficientStockError(ValueError):
+    pass
+
+
+def lock_items(branch, product_ids):
+    """{id: InventoryItem} للأصناف المطلوبة من مخزن الفرع، مقفولة (select_for_update) باستعلام واحد."""
+    items = (
+        InventoryItem.objects.select_for_update()
+        .filter(branch=branch, pk__in=set(product_ids)).order_by('pk')
+    )
+    return {item.pk: item for item in items}
+
+
+def apply_stock_changes(changes):
+    """changes: {id: فرق الكمية (+ إرجاع، - خصم)}. كل الأصناف في UPDATE واحد."""
+    changes = {pk: delta for pk, delta in changes.items() if delta}
+    if not changes:
+        return 0
+    return InventoryItem.objects.filter(pk__in=changes).update(quantity=Case(
+        *[When(pk=pk, then=F('quantity') + delta) for pk, delta in changes.items()],
+        default=F('quantity'), output_field=InventoryItem._meta.get_field('quantity'),
+    ))
+
+
+def _count_quantities(quantities):
+    counts = Counter()
+    # dict أو قائمة (id, كمية)؛ نفس الصنف في أكثر من سطر يتم جمعه
+    for pk, quantity in (quantities.items() if hasattr(quantities, 'items') else quantities):
+        counts[int(pk)] += int(quantity)
+    return counts
+
+
+def take_stock(items, quantities, released=None):
+    """
+    يتحقق من الكميات على أصناف مقفولة مسبقاً (نتيجة lock_items) ويخصمها منها في الذاكرة فقط.
+    يرجع {id: فرق الكمية} لتمريره إلى apply_stock_changes. عند الخطأ لا يتغير أي صنف.
+    """
+    requested = _count_quantities(quantities)
+    returned = _count_quantities(released or {})
+    missing = set(requested) - set(items)
+    if missing:
+        raise InventoryItem.DoesNotExist(f"الصنف رقم {min(missing)} غير موجود في مخزن الفرع.")
+
+    changes = {pk: returned[pk] - requested[pk] for pk in set(requested) | set(returned) if pk in items}
+    for pk, change in changes.items():
+        if items[pk].quantity + change < 0:
+            raise InsufficientStockError(f"مخزون '{items[pk].name}' غير كاف ({items[pk].quantity} متاح).")
+    for pk, change in changes.items():
+        items[pk].quantity += change
+    return changes
+
+
+def reserve_stock(branch, quantities, released=None):
+    """
+    يخصم quantities ({id: كمية} أو [(id, كمية)]) من مخزن الفرع ويرجع {id: InventoryItem} بالكميات بعد الخصم.
+    released: كميات ترجع للمخزن في نفس العملية (مثلاً أصناف الوصل القديمة عند التعديل)،
+    والتحقق يتم على الصافي فقط. يرفع InventoryItem.DoesNotExist أو InsufficientStockError.
+    """
+    requested = _count_quantities(quantities)
+    returned = _count_quantities(released or {})
+    items = lock_items(branch, set(requested) | set(returned))
+    apply_stock_changes(take_stock(items, requested, returned))
+    return items
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from salesapp.benchmarks import (
+    BASELINE_PATH, DEFAULT_DATASET, seed_dataset, run_benchmarks,
+    load_baseline, save_baseline, compare_with_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the hot views (wall time, query count, peak memory) on a seeded test database and compares them with the stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--receipts', type=int, default=DEFAULT_DATASET['receipts'], help='Receipts per branch in the seeded dataset.')
+        parser.add_argument('--branches', type=int, default=DEFAULT_DATASET['branches'], help='Branches in the seeded dataset.')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (the median is reported).')
+        parser.add_argument('--only', help='Only run cases whose name contains this text.')
+        parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON file.')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown / memory growth ratio before reporting a regression.')
+
+    def handle(self, *args, **options):
+        # قاعدة بيانات اختبار مؤقتة حتى لا يتم مسح بيانات العمل الحقيقية
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write("تجهيز بيانات قياس الأداء...")
+            dataset = seed_dataset(receipts=options['receipts'], branches=options['branches'])
+            self.stdout.write("جاري القياس...")
+            results = run_benchmarks(repeat=options['repeat'], only=options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        baseline = load_baseline(options['baseline'])
+        if baseline and baseline.get('dataset') != dataset:
+            self.stdout.write(self.style.WARNING("  - حجم البيانات مختلف عن الـ baseline، المقارنة غير دقيقة."))
+        baseline_results = (baseline or {}).get('results', {})
+
+        self.stdout.write(f"\n{'الحالة':<55} {'ms':>10} {'queries':>8} {'peak KB':>10}   baseline (ms / queries)")
+        for name, result in results.items():
+            previous = baseline_results.get(name)
+            previous_text = f"{previous['wall_ms']} / {previous['queries']}" if previous else '-'
+            per_page_text = f"   [{result['us_per_page']} µs/page × {result['pages']}]" if 'us_per_page' in result else ''
+            self.stdout.write(f"{name:<55} {result['wall_ms']:>10} {result['queries']:>8} {result['peak_kb']:>10}   {previous_text}{per_page_text}")
+
+        if options['update_baseline']:
+            save_baseline(results, dataset, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"\nتم حفظ الـ baseline في {options['baseline']}"))
+            return
+
+        regressions = compare_with_baseline(results, baseline, options['tolerance'])
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f"  تراجع: {regression}"))
+            raise CommandError(f"{len(regressions)} تراجع في الأداء مقارنة بالـ baseline.")
+        self.stdout.write(self.style.SUCCESS("\nلا توجد تراجعات مقارنة بالـ baseline."))
@@ -1,47 +1,357 @@
+import collections
 import csv
-import re
+import json
+import multiprocessing
 import datetime
-from dateutil.relativedelta import relativedelta
-from datetime import date
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
 from django.core.management.base import BaseCommand
 from django.db import transaction, IntegrityError
-from salesapp.models import Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment
-from django.db.models import ProtectedError, F, Max
+from salesapp.models import Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment, ReceiptNumberSequence, PrintJob, ReceiptIngestion
+from salesapp.stats import rebuild_branch_month_stats
+from salesapp.search_index import rebuild_search_index
+from salesapp.bulk_insert import insert_installments
+from salesapp.schedule import installment_schedule, InstallmentSystemError
+from django.db.models import ProtectedError, F, Max, Q
 
 # -------------------------------------------------------------------
-# (1) دالة تحليل الأقساط
+# (1) محرك الاستيراد المجمع (دفعات بدلاً من صف بصف)
+# (تحليل نظام القسط وتواريخ الأقساط من محرك الأقساط الموحد salesapp.schedule)
 # -------------------------------------------------------------------
-def parse_installment_string(ps_string):
+DUMMY_PRODUCT_NAME = "منتج مستورد (النظام القديم)"
+REJECTS_EXTRA_FIELDS = ['line', 'reason']
+
+
+class RowRejected(Exception):
+    pass
+
+
+def parse_csv_row(row):
     """
-    تحليل نص نظام القسط (مثل "10*100 + 2*200")
-    وتحويله إلى قائمة بالمبالغ الشهرية.
+    يحول صف CSV إلى بيانات الوصل (بدون أي استعلامات على قاعدة البيانات).
+    يرمي RowRejected مع السبب إذا كان الصف غير صالح.
     """
-    if not ps_string: return []
+    area_name = (row.get('Area') or '').strip()
+    employee_name = (row.get('EmployeeName') or '').strip()
+    receipt_id_str = (row.get('ID') or '').strip()
+    price_str = (row.get('Price') or '').strip()
+    retainer_str = (row.get('Retainer') or '0').strip()
+
+    if not area_name or not employee_name or not receipt_id_str or not price_str:
+        raise RowRejected("بيانات ناقصة (الفرع أو الموظف أو رقم الوصل أو السعر).")
+
+    try: price = int(price_str)
+    except ValueError: price = 0
+    try: retainer = int(retainer_str)
+    except ValueError: retainer = 0
+    try: receipt_id = int(receipt_id_str)
+    except ValueError: raise RowRejected(f"رقم الوصل '{receipt_id_str}' ليس رقماً.")
+
+    # الصف الناقص (أعمدة أقل من العنوان) يعطي None بدلاً من النص
+    selling_date_str = (row.get('SellingDate') or '').strip()
     try:
-        ps_list1 = re.split("\+", ps_string.strip())
-        ps_list = []
-        for m_part in ps_list1:
-            m = m_part.strip();
-            if not m: raise ValueError("يوجد جزء فارغ (علامة + زائدة؟)")
-            parts = m.split("*")
-            if len(parts) < 2:
-                 if len(parts) == 1 and parts[0].isdigit():
-                     count = 1; amount_str = parts[0].strip()
-                 else: raise ValueError(f"الصيغة '{m_part}' خاطئة.")
+        selling_date = datetime.datetime.strptime(selling_date_str, "%d/%m/%Y").date()
+    except ValueError:
+        raise RowRejected(f"تاريخ البيع '{selling_date_str}' غير صحيح.")
+
+    installment_system = (row.get('InstSystem') or '').strip()
+    is_cash = (not installment_system) or (installment_system.lower() == 'كاش')
+
+    installment_dates_amounts = []
+    if not is_cash:
+        # (كما في الاستيراد القديم) نظام قسط غير مفهوم = وصل بدون أقساط
+        try:
+            installment_dates_amounts = installment_schedule(selling_date.year, selling_date.month, installment_system)
+        except InstallmentSystemError:
+            pass
+
+    return {
+        'id': receipt_id, 'branch_name': area_name, 'employee_name': employee_name,
+        'customer_name': row.get('CName') or '', 'products_text': (row.get('Products') or '').strip(),
+        'phone_number': row.get('PhoneNum') or '', 'address': row.get('CAddress') or '', 'area': row.get('Zone') or '',
+        'total_amount': price, 'down_payment': retainer if not is_cash else price,
+        'installment_system': installment_system,
+        'sale_year': selling_date.year, 'sale_month': selling_date.month, 'is_cash_sale': is_cash,
+        'installments': installment_dates_amounts,
+    }
+
+
+def parse_rows(numbered_rows):
+    """يحلل مجموعة صفوف [(رقم السطر, الصف)] ويرجع [(رقم السطر, الصف, البيانات أو None, سبب الرفض)]."""
+    parsed = []
+    for line_num, row in numbered_rows:
+        try:
+            parsed.append((line_num, row, parse_csv_row(row), None))
+        except RowRejected as e:
+            parsed.append((line_num, row, None, str(e)))
+    return parsed
+
+
+def read_header(csv_file_path):
+    """يرجع (أسماء الأعمدة, موضع أول صف بيانات بالبايت)."""
+    with open(csv_file_path, 'rb') as file:
+        header_line = file.readline()
+    fieldnames = next(csv.reader([header_line.decode('utf-8-sig').rstrip('\r\n')]))
+    return fieldnames, len(header_line)
+
+
+def split_byte_ranges(csv_file_path, start_offset, start_line, rows_per_range):
+    """
+    يقسم الملف (من start_offset) إلى نطاقات بالبايت كل منها rows_per_range سطر كامل.
+    يرجع [(بداية, نهاية, رقم أول سطر)]. يفترض أن الحقول لا تحتوي على سطر جديد (مثل ملف النظام القديم).
+    """
+    ranges = []
+    with open(csv_file_path, 'rb') as file:
+        file.seek(start_offset)
+        range_start = offset = start_offset
+        range_line = line_num = start_line
+        for line in file:
+            offset += len(line)
+            line_num += 1
+            if line_num - range_line == rows_per_range:
+                ranges.append((range_start, offset, range_line))
+                range_start, range_line = offset, line_num
+        if offset > range_start:
+            ranges.append((range_start, offset, range_line))
+    return ranges
+
+
+def parse_byte_range(csv_file_path, fieldnames, start, end, first_line):
+    """يقرأ ويحلل نطاقاً واحداً من الملف (يعمل داخل عمليات الـ pool)."""
+    with open(csv_file_path, 'rb') as file:
+        file.seek(start)
+        lines = file.read(end - start).decode('utf-8').split('\n')
+    numbered_rows = []
+    for index, line in enumerate(lines):
+        line = line.rstrip('\r')
+        if not line:
+            continue
+        values = next(csv.reader([line]))
+        row = dict(zip(fieldnames, values))
+        # نفس القيمة التي يعطيها parse_csv_row للخلية الفارغة (الصف الناقص يرفض بسببه وليس بخطأ)
+        for name in fieldnames[len(values):]:
+            row[name] = ''
+        numbered_rows.append((first_line + index, row))
+    return parse_rows(numbered_rows)
+
+
+class BulkReceiptImporter:
+    """
+    يستورد ملف CSV على دفعات: الفروع والموظفين والمنتج الافتراضي يتم جلبها/إنشاؤها مرة لكل دفعة،
+    والوصلات وبنود البيع والأقساط تضاف بـ bulk_create داخل transaction واحد للدفعة.
+    الصفوف المرفوضة تكتب في ملف جانبي (نفس أعمدة الملف + رقم السطر + السبب).
+    """
+
+    def __init__(self, chunk_size=1000, rejects_file=None, log=None):
+        self.chunk_size = chunk_size
+        self.log = log or (lambda message: None)
+        self.rejects_writer = None
+        self.rejects_file = rejects_file
+        self.rejects_header_written = False
+        self.branches = {}          # name -> Branch
+        self.salespersons = {}      # (name, branch_id) -> Salesperson
+        self.dummy_products = {}    # branch_id -> InventoryItem
+        self.created_receipts = 0
+        self.created_installments = 0
+        self.rejected_rows = 0
+
+    # --- الصفوف المرفوضة ---
+    def reject(self, line_num, row, reason):
+        self.rejected_rows += 1
+        if self.rejects_file is None:
+            return
+        if self.rejects_writer is None:
+            fieldnames = list(row.keys()) + REJECTS_EXTRA_FIELDS
+            self.rejects_writer = csv.DictWriter(self.rejects_file, fieldnames=fieldnames, extrasaction='ignore')
+            if not self.rejects_header_written:
+                self.rejects_writer.writeheader()
+        self.rejects_writer.writerow({**row, 'line': line_num, 'reason': reason})
+
+    # --- جلب/إنشاء الفروع والموظفين والمنتج الافتراضي على دفعات ---
+    def resolve_branches(self, names):
+        missing = set(names) - self.branches.keys()
+        if not missing:
+            return
+        Branch.objects.bulk_create([Branch(name=name) for name in missing], ignore_conflicts=True)
+        for branch in Branch.objects.filter(name__in=missing):
+            self.branches[branch.name] = branch
+
+        branch_ids = [self.branches[name].id for name in missing]
+        InventoryItem.objects.bulk_create([
+            InventoryItem(name=DUMMY_PRODUCT_NAME, branch_id=branch_id, quantity=9999, purchase_price=0, salesperson_commission_amount=0)
+            for branch_id in branch_ids
+        ], ignore_conflicts=True)
+        for item in InventoryItem.objects.filter(name=DUMMY_PRODUCT_NAME, branch_id__in=branch_ids):
+            self.dummy_products[item.branch_id] = item
+
+    def resolve_salespersons(self, keys):
+        missing = set(keys) - self.salespersons.keys()
+        if not missing:
+            return
+        Salesperson.objects.bulk_create([Salesperson(name=name, branch_id=branch_id) for name, branch_id in missing], ignore_conflicts=True)
+        names = {name for name, _ in missing}
+        branch_ids = {branch_id for _, branch_id in missing}
+        for sp in Salesperson.objects.filter(name__in=names, branch_id__in=branch_ids):
+            self.salespersons[(sp.name, sp.branch_id)] = sp
+
+    # --- الاستيراد ---
+    def import_file(self, csv_file_path, workers=1, checkpoint=None):
+        """
+        يستورد الملف على نطاقات بالبايت. التحليل يتم بالتوازي إذا workers > 1،
+        لكن الكتابة في قاعدة البيانات تتم هنا فقط وبترتيب الملف (أرقام الوصلات = ID القديم).
+        checkpoint: ImportCheckpoint يتم تحديثه بعد كل دفعة حتى يمكن استكمال الاستيراد بعد توقفه.
+        """
+        fieldnames, data_offset = read_header(csv_file_path)
+        start_offset, start_line = data_offset, 2
+        if checkpoint is not None and checkpoint.next_offset:
+            start_offset, start_line = checkpoint.next_offset, checkpoint.next_line
+            self.created_receipts = checkpoint.created_receipts
+            self.created_installments = checkpoint.created_installments
+            self.rejected_rows = checkpoint.rejected_rows
+
+        ranges = split_byte_ranges(csv_file_path, start_offset, start_line, self.chunk_size)
+        tasks = [(csv_file_path, fieldnames, start, end, first_line) for start, end, first_line in ranges]
+        for (start, end, first_line), parsed in zip(ranges, self.iter_parsed(tasks, workers)):
+            self.import_chunk(parsed)
+            if checkpoint is not None:
+                checkpoint.save(next_offset=end, next_line=first_line + self.chunk_size,
+                                created_receipts=self.created_receipts,
+                                created_installments=self.created_installments,
+                                rejected_rows=self.rejected_rows)
+            self.log(f"  ... تمت معالجة {end * 100 // max(ranges[-1][1], 1)}% ({self.created_receipts} وصل، {self.rejected_rows} مرفوض)...")
+
+    def iter_parsed(self, tasks, workers):
+        """يرجع نتائج تحليل النطاقات بنفس ترتيبها في الملف."""
+        if workers <= 1:
+            for task in tasks:
+                yield parse_byte_range(*task)
+            return
+        # spawn (وليس fork) حتى يعمل على Windows أيضاً؛ كل عملية تجهز Django مرة واحدة
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as executor:
+            pending = collections.deque()
+            tasks = iter(tasks)
+            # عدد محدود من النطاقات تحت التحليل حتى لا تتراكم النتائج في الذاكرة إذا كانت الكتابة أبطأ
+            for task in itertools.islice(tasks, workers * 2):
+                pending.append(executor.submit(parse_byte_range, *task))
+            while pending:
+                parsed = pending.popleft().result()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(executor.submit(parse_byte_range, *task))
+                yield parsed
+
+    def import_chunk(self, parsed_rows):
+        parsed = []
+        seen_ids = set()
+        for line_num, row, data, reason in parsed_rows:
+            if data is None:
+                self.reject(line_num, row, reason); continue
+            if data['id'] in seen_ids:
+                self.reject(line_num, row, f"رقم الوصل {data['id']} مكرر في الملف."); continue
+            seen_ids.add(data['id'])
+            parsed.append((line_num, row, data))
+
+        existing_ids = set(Receipt.objects.filter(
+            Q(id__in=seen_ids) | Q(receipt_number__in=seen_ids)
+        ).values_list('receipt_number', flat=True))
+        accepted = []
+        for line_num, row, data in parsed:
+            if data['id'] in existing_ids:
+                self.reject(line_num, row, f"رقم الوصل {data['id']} موجود مسبقاً.")
             else:
-                part1 = parts[0].strip(); part2 = parts[1].strip()
-                if not part1.isdigit() or not part2.isdigit(): raise ValueError(f"الأرقام غير صحيحة في '{m_part}'.")
-                num1 = int(part1); num2 = int(part2)
-                if num2 < 20 and num1 >= 20: count = num2; amount_str = part1
-                elif num1 < 20 and num2 >= 20: count = num1; amount_str = part2
-                else: count = num1; amount_str = part2
-            if not amount_str: raise ValueError(f"المبلغ فارغ في '{m_part}'.")
-            if not amount_str.isdigit(): raise ValueError(f"المبلغ '{amount_str}' ليس رقماً.")
-            amount = int(amount_str)
-            for _ in range(count): ps_list.append(amount)
-        return ps_list
-    except ValueError as e: return f"خطأ في تحليل نظام القسط: {e}"
-    except Exception as e: return f"خطأ غير متوقع في تحليل نظام القسط: {e}"
+                accepted.append((line_num, row, data))
+        if not accepted:
+            return
+
+        self.resolve_branches({data['branch_name'] for _, _, data in accepted})
+        self.resolve_salespersons({
+            (data['employee_name'], self.branches[data['branch_name']].id) for _, _, data in accepted
+        })
+
+        try:
+            with transaction.atomic():
+                self.insert_rows([data for _, _, data in accepted])
+        except IntegrityError:
+            # خطأ في صف واحد يلغي الدفعة كلها، فنعيدها صفاً صفاً لمعرفة الصف المسؤول
+            for line_num, row, data in accepted:
+                try:
+                    with transaction.atomic():
+                        self.insert_rows([data])
+                except IntegrityError as e:
+                    self.reject(line_num, row, f"خطأ في قاعدة البيانات: {e}")
+
+    def insert_rows(self, rows):
+        receipts = []; sale_items = []; installments = []
+        for data in rows:
+            branch = self.branches[data['branch_name']]
+            receipts.append(Receipt(
+                id=data['id'],  # استخدام الـ ID القديم
+                receipt_number=data['id'],
+                branch=branch,
+                salesperson=self.salespersons[(data['employee_name'], branch.id)],
+                customer_name=data['customer_name'], products_text=data['products_text'],
+                phone_number=data['phone_number'], address=data['address'], area=data['area'],
+                total_amount=data['total_amount'], down_payment=data['down_payment'],
+                installment_system=data['installment_system'],
+                sale_year=data['sale_year'], sale_month=data['sale_month'], is_cash_sale=data['is_cash_sale'],
+            ))
+            sale_items.append(SaleItem(
+                receipt_id=data['id'], inventory_item=self.dummy_products[branch.id],
+                quantity=1, unit_price=data['total_amount'],
+            ))
+            installments.extend(
+                (data['id'], payment_date, amount, False, None)
+                for payment_date, amount in data['installments']
+            )
+        Receipt.objects.bulk_create(receipts)
+        SaleItem.objects.bulk_create(sale_items)
+        insert_installments(installments)
+        self.created_receipts += len(receipts)
+        self.created_installments += len(installments)
+
+
+class ImportCheckpoint:
+    """
+    ملف JSON يحفظ موضع آخر دفعة تم حفظها في قاعدة البيانات (بالبايت ورقم السطر) مع العدادات.
+    يتم ربطه بحجم وتاريخ تعديل ملف CSV حتى لا يتم الاستكمال على ملف مختلف.
+    """
+    FIELDS = ('next_offset', 'next_line', 'created_receipts', 'created_installments', 'rejected_rows')
+
+    def __init__(self, path, csv_file_path):
+        self.path = path
+        stat = os.stat(csv_file_path)
+        self.source = {'file': os.path.abspath(csv_file_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def load(self):
+        """يحمل نقطة الاستكمال. يرجع False إذا لم توجد أو كانت لملف آخر."""
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if data.get('source') != self.source:
+            return False
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field, 0))
+        return True
+
+    def save(self, **values):
+        for field, value in values.items():
+            setattr(self, field, value)
+        data = {'source': self.source, **{field: getattr(self, field) for field in self.FIELDS}}
+        # الكتابة في ملف مؤقت ثم استبداله حتى لا يبقى ملف نصف مكتوب عند التوقف المفاجئ
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 # -------------------------------------------------------------------
@@ -50,154 +360,72 @@ def parse_installment_string(ps_string):
 class Command(BaseCommand):
     help = 'Imports data from the old Cheks.csv file into the new database structure.'
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.SUCCESS("بدء عملية استيراد البيانات من Cheks.csv..."))
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='Cheks.csv', help='CSV file to import (default: Cheks.csv next to manage.py).')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows inserted per transaction.')
+        parser.add_argument('--rejects', default='Cheks_rejects.csv', help='Side file that receives the rejected rows with the reason.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to parse the CSV (the database writes stay in one process).')
+        parser.add_argument('--checkpoint', default='Cheks_import.checkpoint.json', help='File that records the last committed chunk.')
+        parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint instead of wiping the data and starting over.')
 
-        # --- مسح البيانات القديمة (لبدء صفحة نظيفة) ---
-        self.stdout.write("  - مسح البيانات القديمة من قاعدة البيانات...")
-        try:
-            # الترتيب مهم بسبب الحماية
-            InstallmentPayment.objects.all().delete()
-            SaleItem.objects.all().delete()
-            Receipt.objects.all().delete()
-            InventoryItem.objects.all().delete()
-            Salesperson.objects.all().delete()
-            Branch.objects.all().delete()
-            self.stdout.write(self.style.SUCCESS("  - تم مسح البيانات القديمة بنجاح."))
-        except ProtectedError as e:
-             self.stdout.write(self.style.ERROR(f"خطأ أثناء مسح البيانات: {e}"))
-             return
+    def handle(self, *args, **options):
+        csv_file_path = options['file']
+        self.stdout.write(self.style.SUCCESS(f"بدء عملية استيراد البيانات من {csv_file_path}..."))
+        if not os.path.exists(csv_file_path):
+            self.stdout.write(self.style.ERROR(f"خطأ: لم يتم العثور على الملف '{csv_file_path}'. يرجى وضعه بجوار 'manage.py'."))
+            return
+
+        checkpoint = ImportCheckpoint(options['checkpoint'], csv_file_path)
+        resuming = options['resume'] and checkpoint.load()
+        if options['resume'] and not resuming:
+            self.stdout.write(self.style.WARNING("  - لا توجد نقطة استكمال صالحة لهذا الملف، سيتم الاستيراد من البداية."))
 
-        # (!!!) تأكد من أن ملف Cheks.csv موجود في نفس المجلد الذي تشغل منه الأمر
-        csv_file_path = 'Cheks.csv' 
-        
-        created_receipts = 0
-        created_installments = 0
-        skipped_rows = 0
-        branches_cache = {}
-        salespersons_cache = {}
-        dummy_products_cache = {}
+        if resuming:
+            self.stdout.write(f"  - استكمال الاستيراد من السطر {checkpoint.next_line} ({checkpoint.created_receipts} وصل تم استيرادها سابقاً).")
+        else:
+            # --- مسح البيانات القديمة (لبدء صفحة نظيفة) ---
+            self.stdout.write("  - مسح البيانات القديمة من قاعدة البيانات...")
+            try:
+                # الترتيب مهم بسبب الحماية، والمسح كله في transaction واحد حتى لا تبقى البيانات نصف ممسوحة عند الخطأ
+                with transaction.atomic():
+                    PrintJob.objects.all().delete()
+                    ReceiptIngestion.objects.all().delete()
+                    InstallmentPayment.objects.all().delete()
+                    SaleItem.objects.all().delete()
+                    Receipt.objects.all().delete()
+                    InventoryItem.objects.all().delete()
+                    Salesperson.objects.all().delete()
+                    Branch.objects.all().delete()
+                self.stdout.write(self.style.SUCCESS("  - تم مسح البيانات القديمة بنجاح."))
+            except ProtectedError as e:
+                 self.stdout.write(self.style.ERROR(f"خطأ أثناء مسح البيانات: {e}"))
+                 return
 
         try:
-            with open(csv_file_path, mode='r', encoding='utf-8-sig') as file:
-                reader = csv.DictReader(file)
-                
-                for row in reader:
-                    try:
-                        with transaction.atomic(): # معاملة واحدة لكل صف
-                            # 1. تنظيف البيانات
-                            area_name = row.get('Area', '').strip()
-                            employee_name = row.get('EmployeeName', '').strip()
-                            receipt_id_str = row.get('ID', '').strip()
-                            price_str = row.get('Price', '0').strip()
-                            retainer_str = row.get('Retainer', '0').strip()
-                            products_text_data = row.get('Products', '').strip() # (جديد)
-
-                            if not area_name or not employee_name or not receipt_id_str or not price_str:
-                                skipped_rows += 1
-                                continue
-                                
-                            try: price = int(price_str)
-                            except ValueError: price = 0
-                            
-                            try: retainer = int(retainer_str)
-                            except ValueError: retainer = 0
-                            
-                            try: receipt_id_int = int(receipt_id_str)
-                            except ValueError: skipped_rows += 1; continue
-                            
-                            # 2. جلب أو إنشاء الفرع
-                            if area_name not in branches_cache:
-                                branch, _ = Branch.objects.get_or_create(name=area_name)
-                                branches_cache[area_name] = branch
-                            branch = branches_cache[area_name]
-
-                            # 3. جلب أو إنشاء الموظف
-                            if (employee_name, branch.id) not in salespersons_cache:
-                                sp, _ = Salesperson.objects.get_or_create(name=employee_name, branch=branch)
-                                salespersons_cache[(employee_name, branch.id)] = sp
-                            salesperson = salespersons_cache[(employee_name, branch.id)]
-
-                            # 4. جلب أو إنشاء المنتج الافتراضي
-                            if branch.id not in dummy_products_cache:
-                                dummy, _ = InventoryItem.objects.get_or_create(
-                                    name="منتج مستورد (النظام القديم)", branch=branch,
-                                    defaults={'quantity': 9999, 'purchase_price': 0, 'salesperson_commission_amount': 0}
-                                )
-                                dummy_products_cache[branch.id] = dummy
-                            dummy_product = dummy_products_cache[branch.id]
-                            
-                            # 5. تحليل التاريخ
-                            try:
-                                selling_date_obj = datetime.datetime.strptime(row.get('SellingDate', ''), "%d/%m/%Y").date()
-                                sale_year = selling_date_obj.year
-                                sale_month = selling_date_obj.month
-                                first_payment_start_date = selling_date_obj.replace(day=15)
-                            except ValueError:
-                                skipped_rows += 1; continue
-                                
-                            # 6. إنشاء الوصل
-                            installment_system = row.get('InstSystem', '').strip()
-                            is_cash = (not installment_system) or (installment_system.lower() == 'كاش')
-                            
-                            receipt = Receipt.objects.create(
-                                id=receipt_id_int, # استخدام الـ ID القديم
-                                receipt_number=receipt_id_int, # (تم التعديل) استخدام رقم صحيح
-                                branch=branch,
-                                salesperson=salesperson,
-                                customer_name=row.get('CName', ''),
-                                products_text=products_text_data, # (جديد) حفظ نص المنتجات
-                                phone_number=row.get('PhoneNum', ''),
-                                address=row.get('CAddress', ''),
-                                area=row.get('Zone', ''),
-                                total_amount=price,
-                                down_payment=retainer if not is_cash else price,
-                                installment_system=installment_system,
-                                sale_year=sale_year,
-                                sale_month=sale_month,
-                                is_cash_sale=is_cash
-                            )
-                            created_receipts += 1
-                            
-                            # 7. إنشاء بند المبيعات
-                            SaleItem.objects.create(
-                                receipt=receipt, inventory_item=dummy_product,
-                                quantity=1, unit_price=price
-                            )
-                            
-                            # 8. إنشاء الأقساط
-                            if not is_cash:
-                                installment_amounts = parse_installment_string(installment_system)
-                                if isinstance(installment_amounts, list) and installment_amounts:
-                                    installments_to_create = []
-                                    for i, amount in enumerate(installment_amounts):
-                                        if amount > 0:
-                                            payment_due_date = first_payment_start_date + relativedelta(months=i + 1)
-                                            installments_to_create.append(InstallmentPayment(
-                                                receipt=receipt, payment_date=payment_due_date, amount=amount
-                                            ))
-                                    if installments_to_create:
-                                        InstallmentPayment.objects.bulk_create(installments_to_create)
-                                        created_installments += len(installments_to_create)
-
-                    except IntegrityError as e:
-                         skipped_rows += 1
-                    except Exception as e:
-                         self.stdout.write(self.style.ERROR(f"  - فشل معالجة الصف {receipt_id_str}: {e}"))
-                         skipped_rows += 1
-                
-                if reader.line_num % 100 == 0:
-                     self.stdout.write(f"  ... تمت معالجة {reader.line_num} صف...")
-                     
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f"خطأ: لم يتم العثور على الملف '{csv_file_path}'. يرجى وضعه بجوار 'manage.py'."))
-            return
+            # عند الاستكمال تضاف الصفوف المرفوضة الجديدة إلى نفس الملف
+            with open(options['rejects'], mode='a' if resuming else 'w', encoding='utf-8-sig', newline='') as rejects_file:
+                importer = BulkReceiptImporter(chunk_size=options['chunk_size'], rejects_file=rejects_file, log=self.stdout.write)
+                importer.rejects_header_written = resuming and rejects_file.tell() > 0
+                importer.import_file(csv_file_path, workers=options['workers'], checkpoint=checkpoint)
+            if not importer.rejected_rows:
+                os.remove(options['rejects'])
         except Exception as e:
-             self.stdout.write(self.style.ERROR(f"حدث خطأ فادح أثناء قراءة الملف: {e}"))
+             self.stdout.write(self.style.ERROR(f"حدث خطأ فادح أثناء الاستيراد: {e}"))
+             self.stdout.write(self.style.WARNING(f"  - يمكن الاستكمال من آخر دفعة محفوظة بإضافة --resume"))
              return
+        checkpoint.remove()
+
+        # الوصلات المستوردة تحتفظ بأرقامها القديمة، فيجب رفع العداد فوقها
+        max_number = Receipt.objects.aggregate(Max('receipt_number'))['receipt_number__max'] or 0
+        ReceiptNumberSequence.advance_to(max_number)
+        # ملخصات الداشبورد وفهرس البحث لا يتحدثان مع الاستيراد المباشر، فيعاد بناؤهما مرة واحدة
+        rebuild_branch_month_stats()
+        rebuild_search_index()
 
         self.stdout.write(self.style.SUCCESS("="*30))
         self.stdout.write(self.style.SUCCESS(f"اكتمل الاستيراد بنجاح!"))
-        self.stdout.write(f"  - تم إنشاء {created_receipts} وصل جديد.")
-        self.stdout.write(f"  - تم إنشاء {created_installments} قسط جديد.")
-        self.stdout.write(f"  - تم تخطي {skipped_rows} صف (بسبب أخطاء أو تكرار).")
\ No newline at end of file
+        self.stdout.write(f"  - تم إنشاء {importer.created_receipts} وصل جديد.")
+        self.stdout.write(f"  - تم إنشاء {importer.created_installments} قسط جديد.")
+        self.stdout.write(f"  - تم تخطي {importer.rejected_rows} صف (بسبب أخطاء أو تكرار).")
+        if importer.rejected_rows:
+            self.stdout.write(self.style.WARNING(f"  - الصفوف المرفوضة وأسبابها في: {options['rejects']}"))
@@ -0,0 +1,103 @@
+import re
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from salesapp.models import Branch, Receipt, InstallmentPayment
+
+# الشاشات التي تتأثر بحجم جداول الوصلات والأقساط، مع فلاتر تمثل الاستخدام اليومي
+HOT_VIEWS = [
+    ('dashboard', {}),
+    ('search_receipts', {}),
+    ('search_receipts', {'year': '{year}', 'month': '{month}'}),
+    ('manage_installments', {}),
+    ('manage_installments', {'search_payment_month': '{year}-{month:02d}'}),
+]
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on every SQL query issued by the hot views (dashboard, receipt search, installments) and reports which indexes they use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', type=int, help='Branch id to run the views for (default: the branch with the most receipts).')
+        parser.add_argument('--analyze', action='store_true', help='Refresh the planner statistics (ANALYZE) before explaining.')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full plan of every query, not only the summary line.')
+
+    def handle(self, *args, **options):
+        branch = self.get_branch(options.get('branch'))
+        sample = Receipt.objects.filter(branch=branch).order_by('-sale_year', '-sale_month').values('sale_year', 'sale_month').first()
+        period = {'year': sample['sale_year'], 'month': sample['sale_month']} if sample else {'year': 2025, 'month': 1}
+
+        app_indexes = {index.name for model in (Receipt, InstallmentPayment) for index in model._meta.indexes}
+        used_indexes = set()
+
+        if options['analyze'] and connection.vendor in ('sqlite', 'postgresql'):
+            # بدون إحصائيات حديثة قد يختار المخطط index أقل مناسبة
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(f"تحليل الاستعلامات لفرع: {branch.name} (الفترة {period['month']}/{period['year']})")
+        # عميل الاختبار يرسل الطلبات باسم testserver (بدون setup_test_environment حتى يعمل الأمر داخل الاختبارات أيضاً)
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            client = Client()
+            client.get(reverse('set_branch', args=[branch.id]))
+            for url_name, params in HOT_VIEWS:
+                query = {key: value.format(**period) for key, value in params.items()}
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get(reverse(url_name), query)
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {url_name} {query or ''} (HTTP {response.status_code}, {len(captured)} استعلام)"))
+                for sql in self.select_queries(captured):
+                    plan = self.explain(sql)
+                    indexes = set(re.findall(r'\b(\w+_idx|\w+_id_\w+|sqlite_autoindex_\w+)\b', plan))
+                    used_indexes |= indexes & app_indexes
+                    full_scan = self.is_full_scan(plan)
+                    style = self.style.WARNING if full_scan else self.style.SUCCESS
+                    summary = ', '.join(sorted(indexes)) or 'بدون index'
+                    self.stdout.write(style(f"  - {'SCAN ' if full_scan else ''}[{summary}] {sql[:110]}..."))
+                    if options['verbose_plans']:
+                        self.stdout.write('      ' + plan.replace('\n', '\n      '))
+
+        self.stdout.write("\n" + "=" * 30)
+        for name in sorted(app_indexes):
+            if name in used_indexes:
+                self.stdout.write(self.style.SUCCESS(f"  مستخدم: {name}"))
+            else:
+                self.stdout.write(self.style.WARNING(f"  غير مستخدم في هذه البيانات: {name}"))
+
+    def get_branch(self, branch_id):
+        if branch_id:
+            try: return Branch.objects.get(pk=branch_id)
+            except Branch.DoesNotExist: raise CommandError(f"الفرع رقم {branch_id} غير موجود.")
+        branch = Branch.objects.order_by('-receipt__id').first()
+        if branch is None:
+            raise CommandError("لا توجد فروع في قاعدة البيانات.")
+        return branch
+
+    def select_queries(self, captured):
+        seen = set()
+        for query in captured.captured_queries:
+            sql = query['sql']
+            # استعلامات الجلسة والفرع لا تهمنا هنا
+            if not sql.lstrip().upper().startswith('SELECT') or 'django_session' in sql or sql in seen:
+                continue
+            seen.add(sql)
+            yield sql
+
+    def explain(self, sql):
+        prefix = connection.ops.explain_query_prefix()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}")
+            rows = cursor.fetchall()
+        # SQLite: (id, parent, notused, detail) / PostgreSQL و MySQL: سطر أو أعمدة لكل خطوة
+        return '\n'.join(str(row[-1]) if connection.vendor == 'sqlite' else ' | '.join(map(str, row)) for row in rows)
+
+    def is_full_scan(self, plan):
+        for line in plan.splitlines():
+            line = line.strip()
+            if connection.vendor == 'sqlite' and line.startswith('SCAN') and 'USING' not in line:
+                return True
+            if 'Seq Scan' in line or "type': 'ALL'" in line or '| ALL |' in line:
+                return True
+        return False
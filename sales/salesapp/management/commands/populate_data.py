@@ -1,12 +1,17 @@
 import random
 import datetime
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction, IntegrityError
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 from django.db.models import F, Max, ProtectedError
 
-from salesapp.models import Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment
+from salesapp.models import Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment, ReceiptNumberSequence, PrintJob, ReceiptIngestion
+from salesapp.stats import rebuild_branch_month_stats
+from salesapp.search_index import rebuild_search_index
+from salesapp.bulk_insert import insert_installments
+from salesapp.inventory import apply_stock_changes, lock_items
+from salesapp.schedule import installment_schedule
 import re
 from datetime import date
 
@@ -24,36 +29,101 @@ PRODUCTS = [
     ("سماعة بلوتوث", 50, 200), ("باور بانك", 80, 250)
 ]
 
+def build_installment_plan(rng, receipt_total):
+    """
+    يختار مقدم ونظام قسط عشوائي لوصل تقسيط.
+    يرجع (المقدم, نص نظام القسط, قائمة مبالغ الأقساط). rng هو random أو random.Random(seed).
+    """
+    down_payment = 0
+    installment_system_str = ""
+    installment_amounts = []
+    if rng.random() < 0.80: down_payment = rng.choice([50, 100])
+    down_payment = min(down_payment, receipt_total)
+    remaining_amount = receipt_total - down_payment
+    if rng.random() < 0.90: num_months = 12
+    else:
+        possible_months = list(range(6, 19)); possible_months.remove(12)
+        num_months = rng.choice(possible_months) if possible_months else 12
+
+    if num_months > 0 and remaining_amount > 0:
+         base_monthly = remaining_amount // num_months
+         monthly_amount = max(10, (base_monthly // 10) * 10)
+         last_amount = remaining_amount - (monthly_amount * (num_months - 1))
+         if last_amount <=0 and num_months > 1:
+             monthly_amount = max(10, ((remaining_amount // (num_months -1)) // 10) * 10)
+             last_amount = remaining_amount - (monthly_amount * (num_months - 1))
+         if last_amount <= 0: monthly_amount = 0; last_amount = remaining_amount
+
+         if monthly_amount == last_amount or num_months == 1:
+             installment_system_str = f"{num_months}*{monthly_amount}"
+             installment_amounts = [monthly_amount] * num_months
+         elif monthly_amount == 0 and last_amount > 0:
+              installment_system_str = f"1*{last_amount}"; installment_amounts = [last_amount]; num_months = 1
+         elif last_amount > 0 :
+             installment_system_str = f"{num_months-1}*{monthly_amount}+1*{last_amount}"
+             installment_amounts = [monthly_amount] * (num_months - 1) + [last_amount]
+         else:
+              installment_system_str = f"{num_months}*{monthly_amount}"; installment_amounts = [monthly_amount] * num_months
+    elif remaining_amount <= 0: installment_system_str = "تم الدفع بالكامل"; num_months = 0
+    return down_payment, installment_system_str, installment_amounts
+
+
 class Command(BaseCommand):
     help = 'Populates the database with a large amount of fake sales data (2500 receipts per branch).'
 
-    last_receipt_number = 0
+    # أرقام الوصلات تحجز من العداد على دفعات بدلاً من البحث عن أكبر رقم
+    RECEIPT_NUMBER_BLOCK = 500
+    reserved_receipt_numbers = iter(())
 
     def get_next_receipt_number(self):
-        if self.last_receipt_number == 0:
-            max_num_dict = Receipt.objects.aggregate(Max('receipt_number'))
-            max_num = max_num_dict.get('receipt_number__max')
-            try: self.last_receipt_number = int(max_num) if max_num and max_num.isdigit() else 0
-            except (ValueError, TypeError): self.last_receipt_number = 0
-        self.last_receipt_number += 1
-        return str(self.last_receipt_number)
-
-    def handle(self, *args, **kwargs):
-        self.stdout.write("بدء عملية إضافة البيانات المزيفة (كمية كبيرة)...")
-
+        next_number = next(self.reserved_receipt_numbers, None)
+        if next_number is None:
+            self.reserved_receipt_numbers = iter(ReceiptNumberSequence.allocate(self.RECEIPT_NUMBER_BLOCK))
+            next_number = next(self.reserved_receipt_numbers)
+        return next_number
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fast', action='store_true',
+                            help='Scalable generator: configurable sizes, in-memory stock tracking and large bulk inserts.')
+        parser.add_argument('--branches', type=int, default=2, help='(--fast) Number of branches.')
+        parser.add_argument('--salespersons', type=int, default=5, help='(--fast) Salespersons per branch.')
+        parser.add_argument('--products', type=int, default=20, help='(--fast) Products per branch.')
+        parser.add_argument('--receipts', type=int, default=2500, help='(--fast) Receipts per branch.')
+        parser.add_argument('--months', type=int, default=14, help='(--fast) Sales are spread over this many months.')
+        parser.add_argument('--end-month', help='(--fast) Last sale month as YYYY-MM (default: current month). Fix it for reproducible data.')
+        parser.add_argument('--paid-ratio', type=float, default=0.5, help='(--fast) Share of past-due installments marked as collected.')
+        parser.add_argument('--assigned-ratio', type=float, default=0.3, help='(--fast) Share of the other unpaid installments assigned to a collector.')
+        parser.add_argument('--seed', type=int, help='(--fast) Random seed; the same seed and options give the same data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='(--fast) Receipts written per transaction.')
+
+    def wipe_data(self):
         self.stdout.write("مسح البيانات القديمة...")
         try:
-            InstallmentPayment.objects.all().delete()
-            SaleItem.objects.all().delete()
-            Receipt.objects.all().delete()
-            InventoryItem.objects.all().delete()
-            Salesperson.objects.all().delete()
-            Branch.objects.all().delete()
+            # المسح كله في transaction واحد حتى لا تبقى البيانات نصف ممسوحة عند الخطأ
+            with transaction.atomic():
+                PrintJob.objects.all().delete()
+                ReceiptIngestion.objects.all().delete()
+                InstallmentPayment.objects.all().delete()
+                SaleItem.objects.all().delete()
+                Receipt.objects.all().delete()
+                InventoryItem.objects.all().delete()
+                Salesperson.objects.all().delete()
+                Branch.objects.all().delete()
             self.stdout.write("تم مسح البيانات القديمة.")
+            return True
         except ProtectedError as e:
              self.stdout.write(self.style.ERROR(f"خطأ أثناء مسح البيانات: {e}"))
              self.stdout.write(self.style.WARNING("قد تحتاج لحذف ملف db.sqlite3 يدوياً."))
-             return
+             return False
+
+    def handle(self, *args, **options):
+        if options['fast']:
+            return self.handle_fast(options)
+
+        self.stdout.write("بدء عملية إضافة البيانات المزيفة (كمية كبيرة)...")
+
+        if not self.wipe_data():
+            return
 
         # --- 1. إنشاء الفروع ---
         branches = []
@@ -124,7 +194,7 @@ class Command(BaseCommand):
         self.stdout.write("بدء إنشاء الوصلات (سيستغرق وقتاً طويلاً)...")
         receipts_created_total = 0
         current_date = timezone.now().date()
-        self.last_receipt_number = 0
+        self.reserved_receipt_numbers = iter(())
 
         # --- (تم التعديل) حلقة الفروع ---
         for branch in branches:
@@ -175,15 +245,14 @@ class Command(BaseCommand):
                         items_added_count = 0
                         product_pks_to_update = {}
 
+                        # قفل كل أصناف الوصل باستعلام واحد (بدلاً من select_for_update لكل صنف)
+                        locked_items = lock_items(branch, [product_item.pk for product_item in possible_items])
                         for product_item in possible_items:
                             quantity_to_sell = random.randint(1, 2)
-                            # قراءة المخزون الحالي بدقة داخل الـ transaction
-                            try:
-                                # قفل السجل للقراءة والكتابة
-                                current_product_instance = InventoryItem.objects.select_for_update().get(pk=product_item.pk)
-                                current_stock = current_product_instance.quantity
-                            except InventoryItem.DoesNotExist:
+                            current_product_instance = locked_items.get(product_item.pk)
+                            if current_product_instance is None:
                                 continue # المنتج تم حذفه في عملية متزامنة نادرة
+                            current_stock = current_product_instance.quantity
 
                             already_allocated = product_pks_to_update.get(product_item.pk, 0)
 
@@ -207,34 +276,7 @@ class Command(BaseCommand):
                         installment_amounts = []
 
                         if not is_cash:
-                            if random.random() < 0.80: down_payment = random.choice([50, 100])
-                            down_payment = min(down_payment, receipt_total)
-                            remaining_amount = receipt_total - down_payment
-                            if random.random() < 0.90: num_months = 12
-                            else:
-                                possible_months = list(range(6, 19)); possible_months.remove(12)
-                                num_months = random.choice(possible_months) if possible_months else 12
-
-                            if num_months > 0 and remaining_amount > 0:
-                                 base_monthly = remaining_amount // num_months
-                                 monthly_amount = max(10, (base_monthly // 10) * 10)
-                                 last_amount = remaining_amount - (monthly_amount * (num_months - 1))
-                                 if last_amount <=0 and num_months > 1:
-                                     monthly_amount = max(10, ((remaining_amount // (num_months -1)) // 10) * 10)
-                                     last_amount = remaining_amount - (monthly_amount * (num_months - 1))
-                                 if last_amount <= 0: monthly_amount = 0; last_amount = remaining_amount
-
-                                 if monthly_amount == last_amount or num_months == 1:
-                                     installment_system_str = f"{num_months}*{monthly_amount}"
-                                     installment_amounts = [monthly_amount] * num_months
-                                 elif monthly_amount == 0 and last_amount > 0:
-                                      installment_system_str = f"1*{last_amount}"; installment_amounts = [last_amount]; num_months = 1
-                                 elif last_amount > 0 :
-                                     installment_system_str = f"{num_months-1}*{monthly_amount}+1*{last_amount}"
-                                     installment_amounts = [monthly_amount] * (num_months - 1) + [last_amount]
-                                 else:
-                                      installment_system_str = f"{num_months}*{monthly_amount}"; installment_amounts = [monthly_amount] * num_months
-                            elif remaining_amount <= 0: installment_system_str = "تم الدفع بالكامل"; num_months = 0
+                            down_payment, installment_system_str, installment_amounts = build_installment_plan(random, receipt_total)
 
                         receipt_num_str = self.get_next_receipt_number()
                         receipt = Receipt.objects.create(
@@ -250,16 +292,13 @@ class Command(BaseCommand):
                              items_to_save_db.append(SaleItem(receipt=receipt, inventory_item=product_item, quantity=quantity_sold, unit_price=price_sold))
                         SaleItem.objects.bulk_create(items_to_save_db)
 
-                        for pk, quantity_to_deduct in product_pks_to_update.items():
-                             InventoryItem.objects.filter(pk=pk).update(quantity=F('quantity') - quantity_to_deduct)
+                        apply_stock_changes({pk: -quantity for pk, quantity in product_pks_to_update.items()})
 
                         if not is_cash and installment_amounts:
-                            installments_to_create = []
-                            start_date = date(target_year, target_month, 15)
-                            for month_offset, amount in enumerate(installment_amounts):
-                                 if amount > 0:
-                                    payment_due_date = start_date + relativedelta(months=month_offset + 1)
-                                    installments_to_create.append(InstallmentPayment(receipt=receipt, payment_date=payment_due_date, amount=amount))
+                            installments_to_create = [
+                                InstallmentPayment(receipt=receipt, payment_date=payment_due_date, amount=amount)
+                                for payment_due_date, amount in installment_schedule(target_year, target_month, installment_amounts)
+                            ]
                             if installments_to_create:
                                 InstallmentPayment.objects.bulk_create(installments_to_create)
 
@@ -282,4 +321,161 @@ class Command(BaseCommand):
             if 'e' in locals() and isinstance(locals().get('e'), Exception): break # إيقاف الحلقة الخارجية أيضاً
         # نهاية حلقة الفروع
 
-        self.stdout.write(self.style.SUCCESS(f"اكتملت العملية! تم إنشاء {receipts_created_total} وصل إجمالاً."))
\ No newline at end of file
+        # البيانات تمت إضافتها مباشرة، فيعاد بناء ملخصات الداشبورد وفهرس البحث مرة واحدة في النهاية
+        self.stdout.write("إعادة بناء ملخصات الداشبورد...")
+        rebuild_branch_month_stats()
+        rebuild_search_index()
+
+        self.stdout.write(self.style.SUCCESS(f"اكتملت العملية! تم إنشاء {receipts_created_total} وصل إجمالاً."))
+
+    # =======================================
+    # (جديد) التوليد السريع (--fast) لبيانات اختبار الأداء
+    # =======================================
+    def handle_fast(self, options):
+        """
+        نفس شكل البيانات السابقة لكن بأحجام قابلة للضبط: المخزون يتابع في الذاكرة،
+        والوصلات وبنودها وأقساطها تضاف بدفعات كبيرة (بدون select_for_update لكل وصل).
+        """
+        rng = random.Random(options['seed'])
+        if options['end_month']:
+            try:
+                end_year, end_month = map(int, options['end_month'].split('-'))
+                end_date = date(end_year, end_month, 1)
+            except ValueError:
+                raise CommandError("صيغة --end-month يجب أن تكون YYYY-MM.")
+        else:
+            end_date = timezone.now().date().replace(day=1)
+        today = timezone.now().date()
+
+        self.stdout.write(
+            f"بدء التوليد السريع: {options['branches']} فرع × {options['receipts']} وصل "
+            f"(seed={options['seed']})..."
+        )
+        if not self.wipe_data():
+            return
+
+        # --- 1. الفروع والموظفين والمنتجات ---
+        branch_names = [f"فرع {CITIES[i % len(CITIES)]}" + (f" {i // len(CITIES) + 1}" if i >= len(CITIES) else '')
+                        for i in range(options['branches'])]
+        Branch.objects.bulk_create([Branch(name=name) for name in branch_names])
+        branches = list(Branch.objects.filter(name__in=branch_names).order_by('id'))
+
+        all_names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+        salespersons = []
+        products = []
+        for branch in branches:
+            names = rng.sample(all_names, k=min(options['salespersons'], len(all_names)))
+            names += [f"{rng.choice(all_names)} {n}" for n in range(len(names), options['salespersons'])]
+            salespersons += [Salesperson(name=name, branch=branch) for name in names]
+            for n in range(options['products']):
+                prod_name, min_price, max_price = PRODUCTS[n % len(PRODUCTS)]
+                products.append(InventoryItem(
+                    name=prod_name if n < len(PRODUCTS) else f"{prod_name} {n // len(PRODUCTS) + 1}", branch=branch,
+                    quantity=rng.randint(150, 500),
+                    purchase_price=rng.randint(min_price // 2, max_price // 2),
+                    salesperson_commission_amount=rng.randint(10, 50),
+                ))
+        Salesperson.objects.bulk_create(salespersons, batch_size=1000)
+        InventoryItem.objects.bulk_create(products, batch_size=1000)
+        salespersons_by_branch = {branch.id: [] for branch in branches}
+        for person in Salesperson.objects.filter(branch__in=branches).order_by('id'):
+            salespersons_by_branch[person.branch_id].append(person.id)
+        stock_by_branch = {branch.id: {} for branch in branches}  # branch_id -> {product_id: الكمية المتاحة}
+        product_names = {}
+        for item in InventoryItem.objects.filter(branch__in=branches).order_by('id'):
+            stock_by_branch[item.branch_id][item.id] = item.quantity
+            product_names[item.id] = item.name
+        self.stdout.write(f"تم إنشاء {len(branches)} فرع، {len(salespersons)} موظف، {len(products)} منتج.")
+
+        # --- 2. الوصلات (أرقامها محجوزة مرة واحدة من العداد) ---
+        total_receipts = options['receipts'] * len(branches)
+        receipt_numbers = iter(ReceiptNumberSequence.allocate(total_receipts)) if total_receipts else iter(())
+        receipts_created = 0
+        installments_created = 0
+        for branch in branches:
+            stock = stock_by_branch[branch.id]
+            branch_salespersons = salespersons_by_branch[branch.id]
+            if not branch_salespersons or not stock:
+                self.stdout.write(self.style.WARNING(f"    * تخطي الفرع {branch.name} لعدم وجود موظفين أو منتجات."))
+                continue
+            remaining = options['receipts']
+            while remaining > 0:
+                batch = min(remaining, options['batch_size'])
+                created, installments_count = self.create_fast_batch(
+                    rng, branch, batch, receipt_numbers, stock, product_names, branch_salespersons, end_date, today, options
+                )
+                receipts_created += created
+                installments_created += installments_count
+                remaining -= batch
+                self.stdout.write(f"  ... {branch.name}: {options['receipts'] - remaining} وصل، إجمالي الأقساط {installments_created}...")
+
+        # --- 3. المخزون النهائي ---
+        final_stock = [
+            InventoryItem(pk=product_id, quantity=quantity)
+            for stock in stock_by_branch.values() for product_id, quantity in stock.items()
+        ]
+        InventoryItem.objects.bulk_update(final_stock, ['quantity'], batch_size=1000)
+
+        self.stdout.write("إعادة بناء ملخصات الداشبورد...")
+        rebuild_branch_month_stats()
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"اكتملت العملية! تم إنشاء {receipts_created} وصل و {installments_created} قسط."
+        ))
+
+    def create_fast_batch(self, rng, branch, count, receipt_numbers, stock, product_names, branch_salespersons, end_date, today, options):
+        receipts = []; sale_items = []; installments = []
+        product_ids = list(stock)
+        for _ in range(count):
+            month_offset = rng.randint(0, options['months'] - 1)
+            month_index = end_date.year * 12 + end_date.month - 1 - month_offset
+            sale_year, sale_month = month_index // 12, month_index % 12 + 1
+
+            receipt_total = 0
+            items = []
+            for product_id in rng.sample(product_ids, k=min(rng.randint(1, 5), len(product_ids))):
+                quantity = rng.randint(1, 2)
+                if stock[product_id] < quantity:
+                    # نفذ المخزون: نضيف كمية جديدة كما في التوليد العادي
+                    stock[product_id] += rng.randint(50, 150)
+                stock[product_id] -= quantity
+                sale_price = rng.randint(10, 60) * 50
+                items.append((product_id, quantity, sale_price))
+                receipt_total += quantity * sale_price
+
+            is_cash = rng.random() < 0.01
+            down_payment, installment_system_str, installment_amounts = 0, "", []
+            if not is_cash:
+                down_payment, installment_system_str, installment_amounts = build_installment_plan(rng, receipt_total)
+
+            receipt_number = next(receipt_numbers)
+            salesperson_id = rng.choice(branch_salespersons)
+            receipts.append(Receipt(
+                # الجدول فارغ بعد المسح، فالـ id = رقم الوصل (حتى نربط البنود والأقساط بدون استعلام إضافي)
+                id=receipt_number, receipt_number=receipt_number, branch=branch, salesperson_id=salesperson_id,
+                sale_year=sale_year, sale_month=sale_month, is_cash_sale=is_cash,
+                customer_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" if not is_cash else "",
+                phone_number=f"01{rng.randint(0, 2)}{rng.randint(10000000, 99999999)}" if not is_cash else "",
+                address=f"شارع {rng.randint(1, 100)}, {rng.choice(CITIES)}" if not is_cash else "",
+                area=rng.choice(CITIES), total_amount=receipt_total,
+                down_payment=down_payment if not is_cash else receipt_total,
+                installment_system=installment_system_str,
+                products_text=" + ".join(f"{quantity} x {product_names[product_id]}" for product_id, quantity, _ in items),
+            ))
+            sale_items += [
+                SaleItem(receipt_id=receipt_number, inventory_item_id=product_id, quantity=quantity, unit_price=price)
+                for product_id, quantity, price in items
+            ]
+            for payment_date, amount in installment_schedule(sale_year, sale_month, installment_amounts):
+                is_paid = False; collector_id = None
+                if payment_date <= today and rng.random() < options['paid_ratio']:
+                    is_paid = True; collector_id = rng.choice(branch_salespersons)
+                elif rng.random() < options['assigned_ratio']:
+                    collector_id = rng.choice(branch_salespersons)
+                installments.append((receipt_number, payment_date, amount, is_paid, collector_id))
+
+        with transaction.atomic():
+            Receipt.objects.bulk_create(receipts, batch_size=1000)
+            SaleItem.objects.bulk_create(sale_items, batch_size=1000)
+            installments_count = insert_installments(installments)
+        return len(receipts), installments_count
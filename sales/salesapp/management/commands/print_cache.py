@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from salesapp.models import Branch
+from salesapp.pdf_printing import get_pdf_fonts, iter_receipt_pdf_pages
+from salesapp.print_cache import get_print_cache
+from salesapp.printing import (
+    get_invoice_template, get_print_workers, iter_receipt_bodies, InvoiceTemplateError, PRINT_CHUNK_RECEIPTS,
+)
+from salesapp.views import filter_receipts, printable_receipts
+
+FORMATS = ('docx', 'pdf')
+
+
+class Command(BaseCommand):
+    help = (
+        'Manages the print page cache (SALES_PRINT_CACHE_DIR): warm renders the pages of the filtered receipts ahead of '
+        'printing, evict trims it to the size limit, purge deletes it, stats shows its size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['warm', 'evict', 'purge', 'stats'])
+        parser.add_argument('--branch', type=int, help='Branch id to warm (default: all branches).')
+        parser.add_argument('--year', help='Only receipts sold in this year.')
+        parser.add_argument('--month', help='Only receipts sold in this month.')
+        parser.add_argument('--salesperson', help='Only receipts of this salesperson id.')
+        parser.add_argument('--format', choices=FORMATS + ('all',), default='all', help='Print format to warm.')
+
+    def handle(self, *args, **options):
+        cache = get_print_cache()
+        if cache is None:
+            self.stdout.write(self.style.WARNING("كاش الطباعة معطل (SALES_PRINT_CACHE_MAX_BYTES = 0)."))
+            return
+
+        action = options['action']
+        if action == 'purge':
+            self.stdout.write(self.style.SUCCESS(f"تم حذف {cache.purge()} ملف من كاش الطباعة."))
+        elif action == 'evict':
+            self.stdout.write(self.style.SUCCESS(f"تم حذف {cache.evict()} ملف (الأقدم استخداماً) من كاش الطباعة."))
+        elif action == 'stats':
+            entries = cache.entries()
+            size = sum(size for _, size, _ in entries)
+            self.stdout.write(
+                f"{cache.directory}: {len(entries)} ملف، {size / 1024 / 1024:.1f} MB من {cache.max_bytes / 1024 / 1024:.0f} MB"
+            )
+        else:
+            self.warm(cache, options)
+
+    def warm(self, cache, options):
+        filters = {key: options[key] for key in ('year', 'month', 'salesperson') if options[key]}
+        formats = FORMATS if options['format'] == 'all' else (options['format'],)
+        branches = Branch.objects.order_by('id')
+        if options['branch']:
+            branches = branches.filter(pk=options['branch'])
+
+        for output_format in formats:
+            try:
+                if output_format == 'pdf':
+                    fonts = get_pdf_fonts()
+                    render = lambda receipts: iter_receipt_pdf_pages(fonts, receipts, cache)
+                else:
+                    invoice_template = get_invoice_template()
+                    if not invoice_template.supports_parallel:
+                        self.stdout.write(self.style.WARNING("قالب الطباعة لا يسمح بدمج صفحات جاهزة، لا يتم حفظ صفحات Word."))
+                        continue
+                    workers = get_print_workers()
+                    render = lambda receipts: iter_receipt_bodies(invoice_template, receipts, cache, workers)
+            except InvoiceTemplateError as e:
+                self.stdout.write(self.style.ERROR(str(e)))
+                continue
+
+            for branch in branches:
+                receipts_list = printable_receipts(filter_receipts(branch, filters))
+                count = sum(1 for _ in render(receipts_list.iterator(chunk_size=PRINT_CHUNK_RECEIPTS)))
+                self.stdout.write(self.style.SUCCESS(f"{branch.name} ({output_format}): {count} وصل في كاش الطباعة."))
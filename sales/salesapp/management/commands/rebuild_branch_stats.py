@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from salesapp.models import Branch
+from salesapp.stats import rebuild_branch_month_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the BranchMonthStats dashboard summaries from receipts and installments (backfill or repair).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', type=int, help='Only rebuild this branch id (default: all branches).')
+
+    def handle(self, *args, **options):
+        branch = None
+        if options.get('branch'):
+            try: branch = Branch.objects.get(pk=options['branch'])
+            except Branch.DoesNotExist: raise CommandError(f"الفرع رقم {options['branch']} غير موجود.")
+
+        self.stdout.write(f"جاري إعادة بناء ملخصات الداشبورد ({branch.name if branch else 'كل الفروع'})...")
+        rows_count = rebuild_branch_month_stats(branch)
+        self.stdout.write(self.style.SUCCESS(f"تم إنشاء {rows_count} صف ملخص."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from salesapp.search_index import rebuild_search_index, search_index_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the customer search index (SQLite FTS5) from all receipts (after bulk edits or repairs).'
+
+    def handle(self, *args, **options):
+        if not search_index_available():
+            self.stdout.write(self.style.WARNING("فهرس البحث متاح على SQLite فقط، البحث يستخدم icontains."))
+            return
+        self.stdout.write("جاري إعادة بناء فهرس بحث العملاء...")
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"تم فهرسة {count} وصل."))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from salesapp.models import PrintJob
+from salesapp.print_jobs import claim_next_job, run_print_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued batch print jobs (PrintJob) in the background and writes the generated Word files to SALES_PRINT_JOBS_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the pending jobs then exit instead of polling.')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait between polls when the queue is empty.')
+
+    def handle(self, *args, **options):
+        self.stdout.write("بدء تشغيل عامل مهام الطباعة...")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f"جاري تنفيذ مهمة الطباعة رقم {job.id}...")
+            job = run_print_job(job)
+            if job.status == PrintJob.STATUS_DONE:
+                self.stdout.write(self.style.SUCCESS(f"تم تجهيز المهمة {job.id} ({job.total_pages} صفحة): {job.output_path}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"فشلت المهمة {job.id}: {job.error_message}"))
+        self.stdout.write("لا توجد مهام أخرى في الانتظار.")
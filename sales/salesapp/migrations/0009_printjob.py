@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0008_receipt_products_text_alter_receipt_receipt_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrintJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filters', models.JSONField(blank=True, default=dict, verbose_name='فلاتر البحث')),
+                ('status', models.CharField(choices=[('pending', 'في الانتظار'), ('running', 'جاري التجهيز'), ('done', 'جاهز للتحميل'), ('failed', 'فشل')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('total_pages', models.PositiveIntegerField(default=0, verbose_name='عدد الصفحات')),
+                ('pages_done', models.PositiveIntegerField(default=0, verbose_name='الصفحات المنتهية')),
+                ('output_path', models.CharField(blank=True, max_length=500, verbose_name='مسار الملف الناتج')),
+                ('error_message', models.TextField(blank=True, verbose_name='رسالة الخطأ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='بداية التنفيذ')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='نهاية التنفيذ')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='salesapp.branch', verbose_name='الفرع')),
+            ],
+        ),
+    ]
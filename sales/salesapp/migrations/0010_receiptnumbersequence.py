@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+def seed_receipt_sequence(apps, schema_editor):
+    # بداية العداد من أكبر رقم وصل موجود
+    Receipt = apps.get_model('salesapp', 'Receipt')
+    ReceiptNumberSequence = apps.get_model('salesapp', 'ReceiptNumberSequence')
+    max_number = Receipt.objects.aggregate(models.Max('receipt_number'))['receipt_number__max'] or 0
+    ReceiptNumberSequence.objects.get_or_create(name='receipts', defaults={'last_value': max_number})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0009_printjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceiptNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='receipts', max_length=50, unique=True, verbose_name='اسم العداد')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='آخر رقم تم حجزه')),
+            ],
+        ),
+        migrations.RunPython(seed_receipt_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0010_receiptnumbersequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='installmentpayment',
+            index=models.Index(fields=['receipt', 'is_paid', 'payment_date'], name='inst_receipt_paid_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='installmentpayment',
+            index=models.Index(fields=['collector', 'is_paid', 'payment_date'], name='inst_collector_paid_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='installmentpayment',
+            index=models.Index(condition=models.Q(('is_paid', False)), fields=['payment_date'], name='inst_unpaid_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['branch', 'sale_year', 'sale_month'], name='receipt_branch_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['branch', '-receipt_number'], name='receipt_branch_number_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_branch_month_stats(apps, schema_editor):
+    from salesapp.stats import rebuild_branch_month_stats
+    rebuild_branch_month_stats(models=(
+        apps.get_model('salesapp', 'Receipt'),
+        apps.get_model('salesapp', 'InstallmentPayment'),
+        apps.get_model('salesapp', 'BranchMonthStats'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BranchMonthStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(verbose_name='السنة')),
+                ('month', models.PositiveIntegerField(verbose_name='الشهر')),
+                ('sales_count', models.IntegerField(default=0, verbose_name='عدد الوصلات')),
+                ('sales_total', models.BigIntegerField(default=0, verbose_name='إجمالي المبيعات')),
+                ('down_payments', models.BigIntegerField(default=0, verbose_name='المقدمات والكاش')),
+                ('collected_count', models.IntegerField(default=0, verbose_name='عدد الأقساط المحصلة')),
+                ('collected_total', models.BigIntegerField(default=0, verbose_name='إجمالي التحصيل')),
+                ('unpaid_count', models.IntegerField(default=0, verbose_name='عدد الأقساط غير المدفوعة')),
+                ('unpaid_total', models.BigIntegerField(default=0, verbose_name='إجمالي الأقساط غير المدفوعة')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='salesapp.branch', verbose_name='الفرع')),
+                ('salesperson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='salesapp.salesperson', verbose_name='المندوب / المحصل')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('branch', 'year', 'month', 'salesperson'), name='branch_month_stats_unique'), models.UniqueConstraint(condition=models.Q(('salesperson__isnull', True)), fields=('branch', 'year', 'month'), name='branch_month_stats_unique_unassigned')],
+            },
+        ),
+        migrations.RunPython(backfill_branch_month_stats, migrations.RunPython.noop),
+    ]
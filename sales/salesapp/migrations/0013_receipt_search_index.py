@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from salesapp.search_index import create_search_table, rebuild_search_index, search_index_available
+    using = schema_editor.connection.alias
+    if not search_index_available(using):
+        return
+    create_search_table(using)
+    rebuild_search_index(receipt_model=apps.get_model('salesapp', 'Receipt'), using=using)
+
+
+def drop_search_index(apps, schema_editor):
+    from salesapp.search_index import drop_search_table, search_index_available
+    using = schema_editor.connection.alias
+    if search_index_available(using):
+        drop_search_table(using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0012_branchmonthstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
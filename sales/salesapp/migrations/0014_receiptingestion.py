@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0013_receipt_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceiptIngestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True, verbose_name='مفتاح الطلب')),
+                ('payload_hash', models.CharField(max_length=64, verbose_name='بصمة البيانات')),
+                ('receipts_count', models.PositiveIntegerField(default=0, verbose_name='عدد الوصلات في الطلب')),
+                ('results', models.JSONField(blank=True, default=list, verbose_name='نتيجة كل وصل')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='salesapp.branch', verbose_name='الفرع')),
+            ],
+        ),
+    ]
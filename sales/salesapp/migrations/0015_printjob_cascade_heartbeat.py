@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0014_receiptingestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر نشاط'),
+        ),
+        migrations.AlterField(
+            model_name='printjob',
+            name='branch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='salesapp.branch', verbose_name='الفرع'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salesapp', '0015_printjob_cascade_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='receiptingestion',
+            name='branch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='salesapp.branch', verbose_name='الفرع'),
+        ),
+    ]
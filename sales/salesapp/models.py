@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 # ==========================================================
 # القسم الأول: النماذج الأساسية (الإعدادات)
@@ -67,10 +67,69 @@ class Receipt(models.Model):
     sale_year = models.PositiveIntegerField(verbose_name="سنة البيع")
     sale_month = models.PositiveIntegerField(verbose_name="شهر البيع")
     is_cash_sale = models.BooleanField(default=False, verbose_name="بيع كاش؟")
+
+    class Meta:
+        indexes = [
+            # الداشبورد والتقارير وبحث الوصلات: فلترة بالفرع + سنة/شهر البيع
+            models.Index(fields=['branch', 'sale_year', 'sale_month'], name='receipt_branch_period_idx'),
+            # بحث الوصلات: وصلات الفرع مرتبة بالرقم تنازلياً
+            models.Index(fields=['branch', '-receipt_number'], name='receipt_branch_number_idx'),
+        ]
     
     def __str__(self): 
         return f"وصل {self.receipt_number} للعميل {self.customer_name}"
 
+class ReceiptNumberSequence(models.Model):
+    """
+    عداد أرقام الوصلات (صف واحد للنظام كله لأن رقم الوصل فريد على مستوى كل الفروع).
+    يتم حجز الأرقام بتحديث ذري داخل transaction بدلاً من البحث عن أكبر رقم في جدول الوصلات.
+    """
+    DEFAULT_NAME = 'receipts'
+
+    name = models.CharField(max_length=50, unique=True, default=DEFAULT_NAME, verbose_name="اسم العداد")
+    last_value = models.PositiveIntegerField(default=0, verbose_name="آخر رقم تم حجزه")
+
+    @classmethod
+    def _get_or_create_row(cls, name):
+        row = cls.objects.filter(name=name).first()
+        if row is None:
+            # أول استخدام: البداية من أكبر رقم وصل موجود (مرة واحدة فقط)
+            max_number = Receipt.objects.aggregate(models.Max('receipt_number'))['receipt_number__max'] or 0
+            row, _ = cls.objects.get_or_create(name=name, defaults={'last_value': max_number})
+        return row
+
+    @classmethod
+    def peek_next(cls, name=DEFAULT_NAME):
+        """الرقم المتوقع للوصل القادم (للعرض فقط، بدون حجز)."""
+        row = cls.objects.filter(name=name).values_list('last_value', flat=True).first()
+        if row is None:
+            row = cls._get_or_create_row(name).last_value
+        return row + 1
+
+    @classmethod
+    def allocate(cls, count=1, name=DEFAULT_NAME):
+        """
+        يحجز count رقم متتالي ويرجع range بها.
+        التحديث بـ F() يأخذ قفل الصف حتى نهاية الـ transaction، فلا يحصل عميلان على نفس الرقم.
+        """
+        if count < 1:
+            raise ValueError("عدد الأرقام المطلوب حجزها يجب أن يكون 1 على الأقل.")
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(last_value=models.F('last_value') + count):
+                cls._get_or_create_row(name)
+                cls.objects.filter(name=name).update(last_value=models.F('last_value') + count)
+            last_value = cls.objects.filter(name=name).values_list('last_value', flat=True).get()
+        return range(last_value - count + 1, last_value + 1)
+
+    @classmethod
+    def advance_to(cls, value, name=DEFAULT_NAME):
+        """يرفع العداد إلى value على الأقل (بعد استيراد وصلات بأرقام محددة مسبقاً)."""
+        cls._get_or_create_row(name)
+        cls.objects.filter(name=name, last_value__lt=value).update(last_value=value)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
 class SaleItem(models.Model):
     # (هنا الحذف يجب أن يكون CASCADE، لأن حذف الوصل يجب أن يحذف مبيعاته)
     receipt = models.ForeignKey(Receipt, related_name='items', on_delete=models.CASCADE, verbose_name="الوصل التابع له")
@@ -102,5 +161,116 @@ class InstallmentPayment(models.Model):
         verbose_name="المُحصّل المسؤول"
     )
 
+    class Meta:
+        indexes = [
+            # أقساط الفرع (عبر الوصل) حسب حالة الدفع وتاريخ الاستحقاق
+            models.Index(fields=['receipt', 'is_paid', 'payment_date'], name='inst_receipt_paid_due_idx'),
+            # تحصيل كل محصل في شهر معين (الداشبورد) وشاشة التحصيل
+            models.Index(fields=['collector', 'is_paid', 'payment_date'], name='inst_collector_paid_due_idx'),
+            # الأقساط المستحقة غير المدفوعة فقط (Index جزئي: SQLite و PostgreSQL، ولا يتم إنشاؤه في MySQL)
+            models.Index(fields=['payment_date'], condition=models.Q(is_paid=False), name='inst_unpaid_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"قسط {self.amount} - تاريخ {self.payment_date} - (مدفوع: {self.is_paid})"
+
+class BranchMonthStats(models.Model):
+    """
+    ملخص شهري لكل فرع ومندوب/محصل (تقرأ منه الداشبورد بدلاً من تجميع كل الوصلات والأقساط).
+    يتم تحديثه تدريجياً من salesapp.stats، ويعاد بناؤه بأمر rebuild_branch_stats.
+    - صفوف المبيعات: حسب شهر البيع ومندوب الوصل.
+    - صفوف التحصيل والأقساط غير المدفوعة: حسب شهر استحقاق القسط والمحصل
+      (salesperson = None للأقساط غير المسندة ولوصلات بدون مندوب).
+    """
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, verbose_name="الفرع")
+    year = models.PositiveIntegerField(verbose_name="السنة")
+    month = models.PositiveIntegerField(verbose_name="الشهر")
+    salesperson = models.ForeignKey(Salesperson, on_delete=models.CASCADE, null=True, blank=True, verbose_name="المندوب / المحصل")
+
+    sales_count = models.IntegerField(default=0, verbose_name="عدد الوصلات")
+    sales_total = models.BigIntegerField(default=0, verbose_name="إجمالي المبيعات")
+    down_payments = models.BigIntegerField(default=0, verbose_name="المقدمات والكاش")
+    collected_count = models.IntegerField(default=0, verbose_name="عدد الأقساط المحصلة")
+    collected_total = models.BigIntegerField(default=0, verbose_name="إجمالي التحصيل")
+    unpaid_count = models.IntegerField(default=0, verbose_name="عدد الأقساط غير المدفوعة")
+    unpaid_total = models.BigIntegerField(default=0, verbose_name="إجمالي الأقساط غير المدفوعة")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'year', 'month', 'salesperson'], name='branch_month_stats_unique'),
+            # NULL لا يعتبر مكرراً في UniqueConstraint العادي، لذلك صف "بدون مندوب" له قيد منفصل
+            models.UniqueConstraint(fields=['branch', 'year', 'month'], condition=models.Q(salesperson__isnull=True),
+                                    name='branch_month_stats_unique_unassigned'),
+        ]
+
+    def __str__(self):
+        return f"{self.branch.name} {self.month}/{self.year} - {self.salesperson.name if self.salesperson else 'بدون'}"
+
+# ==========================================================
+# القسم الثالث: مهام الطباعة في الخلفية
+# ==========================================================
+
+class PrintJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'في الانتظار'),
+        (STATUS_RUNNING, 'جاري التجهيز'),
+        (STATUS_DONE, 'جاهز للتحميل'),
+        (STATUS_FAILED, 'فشل'),
+    ]
+
+    # المهام ملفات مؤقتة، فتحذف مع الفرع ولا تمنع مسح البيانات
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, verbose_name="الفرع")
+    # نسخة من فلاتر البحث وقت إنشاء المهمة (نفس مفاتيح GET في شاشة البحث)
+    filters = models.JSONField(default=dict, blank=True, verbose_name="فلاتر البحث")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="الحالة")
+    total_pages = models.PositiveIntegerField(default=0, verbose_name="عدد الصفحات")
+    pages_done = models.PositiveIntegerField(default=0, verbose_name="الصفحات المنتهية")
+    output_path = models.CharField(max_length=500, blank=True, verbose_name="مسار الملف الناتج")
+    error_message = models.TextField(blank=True, verbose_name="رسالة الخطأ")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="بداية التنفيذ")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="نهاية التنفيذ")
+    # يتحدث مع كل دفعة، فالمهمة الجارية التي توقف تحديثها تعتبر عاملاً متوقفاً وتعاد للانتظار
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="آخر نشاط")
+
+    @property
+    def progress_percent(self):
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.total_pages:
+            return 0
+        return min(100, int(self.pages_done * 100 / self.total_pages))
+
+    def __str__(self):
+        return f"مهمة طباعة {self.id} ({self.get_status_display()})"
+
+# ==========================================================
+# القسم الرابع: الإدخال الجماعي للوصلات (salesapp.ingestion)
+# ==========================================================
+
+class ReceiptIngestion(models.Model):
+    """
+    طلب إدخال جماعي بمفتاح من العميل (Idempotency-Key).
+    نتيجة كل وصل تحفظ مع نفس الـ transaction الذي حفظه، فإعادة إرسال نفس الطلب
+    ترجع النتائج المحفوظة وتكمل الوصلات التي لم تتم فقط.
+    """
+    key = models.CharField(max_length=100, unique=True, verbose_name="مفتاح الطلب")
+    # سجل الطلبات يحذف مع الفرع ولا يمنع مسح البيانات
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, verbose_name="الفرع")
+    # بصمة محتوى الطلب، لرفض استخدام نفس المفتاح مع بيانات مختلفة
+    payload_hash = models.CharField(max_length=64, verbose_name="بصمة البيانات")
+    receipts_count = models.PositiveIntegerField(default=0, verbose_name="عدد الوصلات في الطلب")
+    results = models.JSONField(default=list, blank=True, verbose_name="نتيجة كل وصل")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخر تحديث")
+
+    @property
+    def is_complete(self):
+        return len(self.results) >= self.receipts_count
+
     def __str__(self):
-        return f"قسط {self.amount} - تاريخ {self.payment_date} - (مدفوع: {self.is_paid})"
\ No newline at end of file
+        return f"إدخال جماعي {self.key} ({len(self.results)}/{self.receipts_count})"
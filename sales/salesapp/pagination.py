@@ -0,0 +1,135 @@
+# salesapp/pagination.py
+"""
+ترقيم صفحات بالمؤشر (keyset / cursor) بدلاً من OFFSET:
+الصفحة التالية تبدأ بعد آخر صف في الصفحة الحالية (WHERE key > آخر قيمة)،
+لذلك الصفحات البعيدة بنفس تكلفة الصفحة الأولى.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q
+
+CURSOR_SEPARATOR = '~'
+
+# رقم يتغير مع كل تعديل للوصلات/الأقساط، وهو جزء من مفتاح الكاش (تغييره يلغي كل الأعداد المحفوظة)
+COUNT_GENERATION_KEY = 'salesapp:count:generation'
+
+
+def invalidate_cached_counts():
+    try:
+        cache.incr(COUNT_GENERATION_KEY)
+    except ValueError:
+        cache.set(COUNT_GENERATION_KEY, 1, None)
+
+
+def current_generation():
+    """رقم نسخة البيانات الحالي (يتغير مع invalidate_cached_counts)، لاستخدامه في مفاتيح الكاش."""
+    return cache.get_or_set(COUNT_GENERATION_KEY, 0, None)
+
+
+def cached_count(queryset, timeout=None):
+    """
+    عدد صفوف الـ queryset من الكاش (يتم حسابه مرة كل timeout ثانية لنفس الفلاتر).
+    يتم إلغاؤه مع أي تعديل عبر salesapp.stats، وتعديلات العمليات الأخرى تظهر خلال timeout.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'SALES_COUNT_CACHE_SECONDS', 60)
+    generation = current_generation()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # فلتر لا يمكن أن يطابق أي صف (مثل رقم وصل أكبر من أقصى قيمة للعمود)، بدون استعلام
+        return 0
+    key = f'salesapp:count:{generation}:' + hashlib.md5(f"{sql}|{params}".encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPage:
+    """صفحة واحدة: قابلة للتكرار في القالب، مع مؤشرات الصفحة التالية والسابقة."""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    ordering: حقول ترتيب فريدة معاً (مثل ('-receipt_number',) أو ('payment_date', 'id')).
+    page(after=...) للصفحة التالية، page(before=...) للسابقة، وبدونهما للصفحة الأولى.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.fields = [queryset.model._meta.get_field(name) for name, _ in self.keys]
+
+    def encode_cursor(self, obj):
+        return CURSOR_SEPARATOR.join(str(getattr(obj, field.attname)) for field in self.fields)
+
+    def decode_cursor(self, cursor):
+        """يرجع قيم المؤشر، أو None إذا كان المؤشر غير صالح (يتم عرض الصفحة الأولى)."""
+        parts = (cursor or '').split(CURSOR_SEPARATOR)
+        if len(parts) != len(self.fields):
+            return None
+        try:
+            return [field.to_python(part) for field, part in zip(self.fields, parts)]
+        except Exception:
+            return None
+
+    def _ordering(self, backwards):
+        return [f"{'-' if desc != backwards else ''}{name}" for name, desc in self.keys]
+
+    def _seek(self, values, backwards):
+        # (a, b) بعد (va, vb) = a > va أو (a = va و b > vb)، مع عكس المقارنة للحقول التنازلية
+        condition = Q()
+        equal_prefix = {}
+        for (name, desc), value in zip(self.keys, values):
+            lookup = 'lt' if desc != backwards else 'gt'
+            condition |= Q(**equal_prefix, **{f'{name}__{lookup}': value})
+            equal_prefix[name] = value
+        return condition
+
+    def page(self, after=None, before=None):
+        after_values = self.decode_cursor(after) if after else None
+        before_values = self.decode_cursor(before) if before and not after_values else None
+        backwards = before_values is not None
+
+        queryset = self.queryset.order_by(*self._ordering(backwards))
+        cursor_values = before_values if backwards else after_values
+        if cursor_values is not None:
+            queryset = queryset.filter(self._seek(cursor_values, backwards))
+
+        # صف إضافي لمعرفة هل توجد صفحة بعد هذه
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, after_values is not None
+
+        return KeysetPage(
+            rows, has_next, has_previous,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0]) if rows and has_previous else None,
+        )
@@ -0,0 +1,643 @@
+# salesapp/pdf_printing.py
+"""
+طباعة الوصلات مباشرة إلى PDF (بديل لملف Word، يفتح ويطبع من المتصفح).
+- نفس بيانات الصفحات (iter_receipt_page_contexts) مرسومة على تخطيط ثابت بنفس جدول invoice.docx
+  (مقاس الصفحة وعرض الأعمدة وارتفاع الصفوف من القالب) وبخط Cairo من static/fonts.
+- قراءة الخط (woff2) وتضمين الحروف المستخدمة فقط بـ fontTools (+ brotli)، وتشكيل الحروف العربية بـ HarfBuzz (uharfbuzz).
+  هذه المكتبات اختيارية (PDF_REQUIREMENTS): بدونها تعمل الطباعة بصيغة Word فقط، ويظهر تحذير salesapp.W001
+  في manage.py check وعند تشغيل السيرفر.
+- الملف يكتب صفحة بصفحة: الجدول والعناوين الثابتة ترسم مرة واحدة (Form XObject) وكل صفحة تحتوي على قيم الحقول فقط،
+  ثم الخطوط وشجرة الصفحات والفهرس (xref) في النهاية. الذاكرة لا تكبر مع عدد الصفحات.
+- رسم كل قيمة (التشكيل، تقسيم الأسطر، أوامر PDF) محفوظ في lru_cache: المبالغ والتواريخ والأسماء تتكرر كثيراً.
+"""
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import threading
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+from .print_cache import get_print_cache, receipt_cache_key
+from .printing import InvoiceTemplateError, PRINT_CHUNK_PAGES, iter_receipt_page_contexts
+
+try:
+    import uharfbuzz as hb
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+except ImportError:  # الطباعة بصيغة Word لا تحتاج هذه المكتبات
+    hb = font_subset = TTFont = None
+
+# المكتبات المطلوبة للطباعة بصيغة PDF: {اسم الـ module: اسم الحزمة في pip}
+PDF_REQUIREMENTS = {'uharfbuzz': 'uharfbuzz', 'fontTools': 'fonttools', 'brotli': 'brotli'}
+
+PDF_CONTENT_TYPE = 'application/pdf'
+PDF_FORMAT = 'pdf'
+
+FONTS_DIR = os.path.join(settings.BASE_DIR, 'salesapp', 'static', 'fonts')
+PDF_FONT_PATHS = {
+    'regular': os.path.join(FONTS_DIR, 'cairo-v31-arabic_latin-regular.woff2'),
+    'bold': os.path.join(FONTS_DIR, 'cairo-v31-arabic_latin-700.woff2'),
+}
+# اسم كل خط داخل الصفحات (/F1 ...)
+PDF_FONT_NAMES = {'regular': 'F1', 'bold': 'F2'}
+
+SHAPE_CACHE_SIZE = 8192
+CELL_CACHE_SIZE = 8192
+
+
+class PdfPrintError(InvoiceTemplateError):
+    """خطأ في تحميل خطوط الطباعة بصيغة PDF."""
+
+
+def missing_pdf_requirements():
+    """أسماء حزم pip الناقصة من PDF_REQUIREMENTS (قائمة فارغة إذا كانت الطباعة بصيغة PDF متاحة)."""
+    return [package for module, package in PDF_REQUIREMENTS.items() if importlib.util.find_spec(module) is None]
+
+
+# =======================================
+# تخطيط الصفحة (من invoice.docx، بالـ twip = 1/20 نقطة)
+# =======================================
+PAGE_WIDTH, PAGE_HEIGHT = 11909, 5602
+PAGE_MARGIN_TOP, PAGE_MARGIN_RIGHT = 274, 360
+CELL_MARGIN = 115
+# عرض الأعمدة من اليمين إلى اليسار (الجدول bidiVisual)
+COLUMN_WIDTHS = (1471, 1236, 861, 22, 4163, 1613, 2039)
+ROW_HEIGHTS = (598, 624, 598, 598, 598, 624, 598, 598)
+BORDER_WIDTH = 1  # بالنقطة
+
+# المسافة بين الأسطر داخل الخلية (نسبة من حجم الخط)، وأصغر حجم خط عند تصغير نص لا يكفيه مكانه
+LINE_SPACING = 1.2
+MIN_FONT_SIZE = 6
+
+# (الصف، عدد الصفوف، العمود، عدد الأعمدة، النص، حجم الخط، الخط، في المنتصف)
+# {اسم} حقل من بيانات الصفحة؛ الخلايا بدون حقول ترسم مرة واحدة لكل الملف
+INVOICE_LAYOUT = (
+    (0, 1, 0, 1, "رقم الوصل:", 16, 'regular', False),
+    (0, 1, 1, 1, "{id}", 20, 'regular', True),
+    (0, 1, 2, 2, "{i}", 20, 'regular', True),
+    (0, 1, 4, 1, "شركة دار اليقين", 24, 'bold', True),
+    (0, 1, 5, 1, "الإجمالي :", 16, 'regular', True),
+    (0, 1, 6, 1, "{to}", 20, 'regular', True),
+    (1, 1, 0, 1, "المنطقة :", 16, 'regular', False),
+    (1, 1, 1, 1, "{area}", 12, 'regular', True),
+    (1, 1, 2, 2, "{t}", 20, 'regular', True),
+    (1, 1, 4, 1, "مفروشات - ادوات منزلية - اجهزة كهربائية", 12, 'regular', True),
+    (1, 1, 5, 1, "المقدم :", 16, 'regular', True),
+    (1, 1, 6, 1, "{re}", 20, 'regular', True),
+    (2, 1, 0, 1, "اسم العميل:", 16, 'regular', False),
+    (2, 1, 1, 4, "{CName}", 16, 'regular', False),
+    (2, 1, 5, 1, "الباقي بعد\nهذا الايصال :", 11, 'regular', True),
+    (2, 1, 6, 1, "{ga}", 20, 'regular', True),
+    (3, 1, 0, 1, "العنوان :", 16, 'regular', False),
+    (3, 1, 1, 4, "{CAddress}", 16, 'regular', False),
+    (3, 1, 5, 1, "هاتف :", 16, 'regular', True),
+    (3, 1, 6, 1, "{phnum}", 15, 'regular', True),
+    (4, 1, 0, 5, "بموجب هذا الإيصال أتعهد بأن أدفع مبلغ {evm} {evmar} جنيها فقط لا غير", 12, 'regular', False),
+    (4, 1, 5, 1, "تاريخ الدفع :", 16, 'regular', False),
+    (4, 1, 6, 1, "{payd}", 14, 'regular', True),
+    (5, 2, 0, 1, "المنتج:", 16, 'regular', False),
+    (5, 2, 1, 4, "{pro}", 13, 'regular', False),
+    (5, 1, 5, 1, "تاريخ البيع :", 16, 'regular', False),
+    (5, 1, 6, 1, "{seld}", 14, 'regular', True),
+    (6, 1, 5, 1, "نظام القسط :", 16, 'regular', False),
+    (6, 1, 6, 1, "{ins}", 14, 'regular', True),
+    (7, 1, 0, 1, "المندوب :", 16, 'regular', False),
+    (7, 1, 1, 2, "{empl}", 14, 'regular', True),
+    (7, 1, 3, 4, "رجاء الإحتفاظ بهذا الإيصال للإستعلام : 01090782620 - 01118189384", 14, 'regular', True),
+)
+
+_FIELD_RE = re.compile(r"\{(\w+)\}")
+
+# box: (يسار، أسفل، يمين، أعلى) بالنقطة من أسفل يسار الصفحة
+_Cell = namedtuple('_Cell', 'box text fields size font center')
+
+
+def compile_layout(layout, column_widths=COLUMN_WIDTHS, row_heights=ROW_HEIGHTS,
+                   page_size=(PAGE_WIDTH, PAGE_HEIGHT), margins=(PAGE_MARGIN_TOP, PAGE_MARGIN_RIGHT)):
+    """خلايا التخطيط (_Cell) من جدول: عرض الأعمدة من اليمين، ارتفاع الصفوف، مقاس الصفحة والهوامش (بالـ twip)."""
+    page_width, page_height = page_size
+    margin_top, margin_right = margins
+    right_edge = (page_width - margin_right + CELL_MARGIN) / 20
+    column_rights = [right_edge - sum(column_widths[:index]) / 20 for index in range(len(column_widths) + 1)]
+    top_edge = (page_height - margin_top) / 20
+    row_tops = [top_edge - sum(row_heights[:index]) / 20 for index in range(len(row_heights) + 1)]
+    cells = []
+    for row, rows, column, columns, text, size, font, center in layout:
+        box = (column_rights[column + columns], row_tops[row + rows], column_rights[column], row_tops[row])
+        cells.append(_Cell(box, text, tuple(_FIELD_RE.findall(text)), size, font, center))
+    return tuple(cells)
+
+
+INVOICE_CELLS = compile_layout(INVOICE_LAYOUT)
+
+
+# =======================================
+# الخطوط والتشكيل
+# =======================================
+# أرقام وكلمات لاتينية داخل النص العربي تكتب من اليسار لليمين (مثل التواريخ ١٥/١٠/٢٠٢٥ وأرقام الهاتف)
+_LTR_RUN_RE = re.compile(r"[A-Za-z0-9٠-٩]+(?:(?:[./:,٫]|\s+(?=[A-Za-z]))[A-Za-z0-9٠-٩]+)*")
+
+
+class PdfFont:
+    """
+    خط محمل مرة واحدة في الذاكرة: التشكيل (HarfBuzz) وعرض الحروف وتضمين الحروف المستخدمة في ملف PDF.
+    glyph في نتيجة التشكيل: (رقم الحرف في الخط، العرض، إزاحة x، إزاحة y، النص الأصلي) بوحدات الخط.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        # بدون تحديث تاريخ التعديل (head.modified) عند الحفظ: الخط المضمن في PDF يبقى متطابقاً بين العمليات
+        font = TTFont(path, recalcTimestamp=False)
+        font.flavor = None  # woff2 -> TrueType (HarfBuzz و PDF يحتاجان ملف ttf)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        self.data = buffer.getvalue()
+
+        head, hhea = font['head'], font['hhea']
+        self.units_per_em = head.unitsPerEm
+        self.scale = 1000 / self.units_per_em
+        self.ascent, self.descent = hhea.ascent, hhea.descent
+        self.cap_height = getattr(font['OS/2'], 'sCapHeight', 0) or self.ascent
+        self.bbox = (head.xMin, head.yMin, head.xMax, head.yMax)
+        self.name = re.sub(r'[^A-Za-z0-9-]', '', font['name'].getDebugName(6) or '') or 'Font'
+        hmtx = font['hmtx']
+        # العرض بوحدات PDF (1/1000 من حجم الخط) كما يكتب في /W
+        self.widths = [round(hmtx[name][0] * self.scale) for name in font.getGlyphOrder()]
+        # النص الأصلي لكل حرف (ToUnicode: نسخ النص والبحث داخل ملف PDF)
+        self.to_unicode = {}
+        self._hb_font = hb.Font(hb.Face(self.data))
+        self.shape_line = lru_cache(maxsize=SHAPE_CACHE_SIZE)(self._shape_line)
+
+    def _shape_run(self, text, rtl):
+        buffer = hb.Buffer()
+        buffer.add_str(text)
+        buffer.guess_segment_properties()
+        buffer.direction = 'rtl' if rtl else 'ltr'
+        hb.shape(self._hb_font, buffer, {})
+
+        infos, positions = buffer.glyph_infos, buffer.glyph_positions
+        starts = sorted({info.cluster for info in infos})
+        ends = dict(zip(starts, starts[1:] + [len(text)]))
+        glyphs, seen = [], set()
+        for info, position in zip(infos, positions):
+            chars = ''
+            if info.cluster not in seen:
+                seen.add(info.cluster)
+                chars = text[info.cluster:ends[info.cluster]]
+                self.to_unicode.setdefault(info.codepoint, chars)
+            glyphs.append((info.codepoint, position.x_advance, position.x_offset, position.y_offset, chars))
+        return glyphs
+
+    def _shape_line(self, text):
+        """(glyphs السطر بالترتيب المرئي من اليسار لليمين، عرض السطر). الفقرة من اليمين لليسار."""
+        runs = []
+        position = 0
+        for match in _LTR_RUN_RE.finditer(text):
+            if match.start() > position:
+                runs.append((text[position:match.start()], True))
+            runs.append((match.group(), False))
+            position = match.end()
+        if position < len(text):
+            runs.append((text[position:], True))
+        glyphs = tuple(glyph for run, rtl in reversed(runs) for glyph in self._shape_run(run, rtl))
+        return glyphs, sum(glyph[1] for glyph in glyphs)
+
+    def line_width(self, text, size):
+        return self.shape_line(text)[1] * size / self.units_per_em
+
+    def subset(self, gids):
+        """ملف TrueType بالحروف gids فقط (بنفس أرقامها في الخط الأصلي حتى يعمل CIDToGIDMap /Identity)."""
+        options = font_subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.layout_features = []
+        options.drop_tables += ['GSUB', 'GPOS', 'GDEF', 'STAT']
+        # بدون تحديث تاريخ التعديل داخل الخط حتى يكون الملف الناتج متطابقاً بين مرة وأخرى
+        font = TTFont(io.BytesIO(self.data), recalcTimestamp=False)
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(gids=gids)
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        return buffer.getvalue()
+
+
+_font_cache = {}
+_font_cache_lock = threading.Lock()
+
+
+def get_pdf_font(path):
+    """يعيد الخط من ذاكرة العملية، ويعيد تحميله إذا تغير تاريخ تعديل الملف (mtime)."""
+    missing = missing_pdf_requirements()
+    if missing or TTFont is None:
+        raise PdfPrintError(
+            f"خطأ: الطباعة بصيغة PDF تحتاج إلى المكتبات: {', '.join(missing or PDF_REQUIREMENTS.values())}."
+        )
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        raise PdfPrintError(f"خطأ: الخط '{os.path.basename(path)}' غير موجود.")
+
+    cached = _font_cache.get(path)
+    if cached is not None and cached.mtime == mtime:
+        return cached
+    with _font_cache_lock:
+        cached = _font_cache.get(path)
+        if cached is None or cached.mtime != mtime:
+            try:
+                cached = PdfFont(path)
+            except ImportError:  # ملفات woff2 تحتاج brotli
+                raise PdfPrintError("خطأ: قراءة خطوط woff2 تحتاج إلى المكتبة brotli.")
+            except Exception as e:
+                raise PdfPrintError(f"خطأ: تعذر تحميل الخط '{os.path.basename(path)}': {e}")
+            _font_cache[path] = cached
+        return cached
+
+
+def get_pdf_fonts():
+    """{اسم الخط: PdfFont} (SALES_PDF_FONTS في الإعدادات لاستخدام ملفات خطوط أخرى)."""
+    paths = getattr(settings, 'SALES_PDF_FONTS', None) or PDF_FONT_PATHS
+    return {key: get_pdf_font(path) for key, path in paths.items()}
+
+
+# =======================================
+# رسم النصوص
+# =======================================
+def _number(value):
+    return f"{value:.2f}".rstrip('0').rstrip('.') or '0'
+
+
+def _wrap(font, text, size, width):
+    """يقسم النص إلى أسطر (بين الكلمات) لا يزيد عرض كل منها عن width إن أمكن."""
+    lines = []
+    for paragraph in text.split('\n'):
+        words = paragraph.split()
+        line = ''
+        for word in words:
+            candidate = f"{line} {word}" if line else word
+            if line and font.line_width(candidate, size) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _fit(font, text, size, width, height):
+    """أكبر حجم خط (حتى size) يكفي فيه النص مساحة الخلية، مع تقسيمه إلى أسطر عند الحاجة."""
+    while True:
+        lines = _wrap(font, text, size, width)
+        fits = (
+            len(lines) * size * LINE_SPACING <= height
+            and all(font.line_width(line, size) <= width for line in lines)
+        )
+        if fits or size <= MIN_FONT_SIZE:
+            return size, lines
+        size = max(MIN_FONT_SIZE, size - 1)
+
+
+def _show_glyphs(font, glyphs, size):
+    """أوامر TJ لسطر واحد: العرض والإزاحات من HarfBuzz كتعديلات على عرض الحروف في /W."""
+    ops, parts, hexes = [], [], []
+    rise = 0
+
+    def flush():
+        if hexes:
+            parts.append('<' + ''.join(hexes) + '>')
+            hexes.clear()
+        if parts:
+            ops.append('[' + ''.join(parts) + '] TJ')
+            parts.clear()
+
+    for gid, advance, x_offset, y_offset, _ in glyphs:
+        if y_offset != rise:
+            flush()
+            rise = y_offset
+            ops.append(f"{_number(rise * size / font.units_per_em)} Ts")
+        before = -x_offset * font.scale
+        after = font.widths[gid] + (x_offset - advance) * font.scale
+        if abs(before) >= 0.01:
+            if hexes:
+                parts.append('<' + ''.join(hexes) + '>')
+                hexes.clear()
+            parts.append(' ' + _number(before))
+        hexes.append('%04x' % gid)
+        if abs(after) >= 0.01:
+            parts.append('<' + ''.join(hexes) + '>')
+            hexes.clear()
+            parts.append(' ' + _number(after))
+    flush()
+    if rise:
+        ops.append('0 Ts')
+    return ' '.join(ops)
+
+
+@lru_cache(maxsize=CELL_CACHE_SIZE)
+def _cell_text(font, font_name, text, size, box, center):
+    """(أوامر رسم النص داخل BT/ET، أرقام الحروف المستخدمة) لنص في خلية."""
+    left, bottom, right, top = box
+    padding = CELL_MARGIN / 20
+    size, lines = _fit(font, text, size, right - left - 2 * padding, top - bottom)
+    line_height = size * LINE_SPACING
+    # الأسطر في منتصف الخلية رأسياً، وخط الأساس في منتصف المسافة بين أعلى وأسفل حروف الخط
+    baseline = (top + bottom + len(lines) * line_height) / 2 - line_height / 2
+    baseline -= (font.ascent + font.descent) / 2 * size / font.units_per_em
+    ops = [f"/{font_name} {_number(size)} Tf"]
+    gids = set()
+    for line in lines:
+        glyphs, width = font.shape_line(line)
+        width = width * size / font.units_per_em
+        x = (left + right - width) / 2 if center else right - padding - width
+        ops.append(f"1 0 0 1 {_number(x)} {_number(baseline)} Tm {_show_glyphs(font, glyphs, size)}")
+        gids.update(glyph[0] for glyph in glyphs)
+        baseline -= line_height
+    return '\n'.join(ops).encode('utf-8'), frozenset(gids)
+
+
+def _cell_value(cell, context):
+    if cell.text == '{%s}' % cell.fields[0]:
+        return str(context.get(cell.fields[0], ''))
+    return _FIELD_RE.sub(lambda match: str(context.get(match.group(1), '')), cell.text)
+
+
+def _draw_cell(fonts, cell, text, glyphs):
+    """أوامر رسم نص الخلية، مع إضافة الحروف المستخدمة إلى glyphs ({اسم الخط: {رقم الحرف: النص}})."""
+    font = fonts[cell.font]
+    data, gids = _cell_text(font, PDF_FONT_NAMES[cell.font], text, cell.size, cell.box, cell.center)
+    used = glyphs.setdefault(cell.font, {})
+    for gid in gids:
+        used[gid] = font.to_unicode.get(gid, '')
+    return data
+
+
+def _static_content(fonts, cells, glyphs):
+    """الجدول والعناوين الثابتة (Form XObject مشترك بين كل الصفحات)."""
+    ops = [b'%s w' % _number(BORDER_WIDTH).encode()]
+    for cell in cells:
+        left, bottom, right, top = cell.box
+        ops.append(' '.join(_number(value) for value in (left, bottom, right - left, top - bottom)).encode() + b' re S')
+    ops.append(b'BT')
+    # الخلايا بدون نص (مثل خانات العلامات) حدود فقط
+    ops.extend(_draw_cell(fonts, cell, cell.text, glyphs) for cell in cells if not cell.fields and cell.text)
+    ops.append(b'ET')
+    return b'\n'.join(ops)
+
+
+def render_pdf_pages(fonts, contexts, cells=INVOICE_CELLS):
+    """
+    صفحات PDF لمجموعة contexts (عادة صفحات وصل واحد) مستقلة عن الملف الذي توضع فيه:
+    (محتوى كل صفحة مضغوطاً، {اسم الخط: {رقم الحرف: النص}} للحروف المستخدمة).
+    """
+    dynamic_cells = [cell for cell in cells if cell.fields]
+    pages, glyphs = [], {}
+    for context in contexts:
+        ops = [b'/Tpl Do\nBT']
+        for cell in dynamic_cells:
+            text = _cell_value(cell, context).strip()
+            if text:
+                ops.append(_draw_cell(fonts, cell, text, glyphs))
+        ops.append(b'ET')
+        pages.append(zlib.compress(b'\n'.join(ops)))
+    return pages, glyphs
+
+
+# =======================================
+# كتابة ملف PDF
+# =======================================
+class _PdfWriter:
+    """يكتب ملف PDF كسلسلة bytes: كل object يكتب مرة واحدة ويحفظ مكانه فقط لجدول الفهرس (xref)."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self._offsets = {}
+        self._next_number = 1
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self._chunks.append(data)
+        self._offset += len(data)
+
+    def reserve(self):
+        """رقم object يكتب لاحقاً (للإشارة إليه قبل كتابته)."""
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def write_object(self, number, body):
+        self._offsets[number] = self._offset
+        self._write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+
+    def write_stream(self, number, data, dictionary=b'', compressed=False):
+        if not compressed:
+            data = zlib.compress(data)
+        self.write_object(number, b'<<%s /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (
+            dictionary, len(data), data,
+        ))
+
+    def close(self, root):
+        xref_offset = self._offset
+        size = self._next_number
+        entries = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        entries.extend(b'%010d 00000 n \n' % self._offsets[number] for number in range(1, size))
+        self._write(b''.join(entries))
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, root, xref_offset))
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _to_unicode_cmap(mapping):
+    entries = sorted(mapping.items())
+    blocks = []
+    for start in range(0, len(entries), 100):
+        block = entries[start:start + 100]
+        blocks.append('%d beginbfchar\n%s\nendbfchar' % (len(block), '\n'.join(
+            '<%04x> <%s>' % (gid, text.encode('utf-16-be').hex()) for gid, text in block
+        )))
+    return (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <ffff>\nendcodespacerange\n"
+        f"{chr(10).join(blocks)}\nendcmap\n"
+        "CMapName currentdict /CMapResource defineresource pop\nend\nend\n"
+    ).encode('ascii')
+
+
+class _PdfDocument:
+    """ملف PDF للوصلات: الجدول الثابت مرسوم مرة واحدة، والصفحات تضاف جاهزة (render_pdf_pages أو الكاش)."""
+
+    def __init__(self, fonts, cells=INVOICE_CELLS, page_size=(PAGE_WIDTH, PAGE_HEIGHT)):
+        self.fonts = fonts
+        self.page_size = ' '.join(_number(value / 20) for value in page_size).encode()
+        self.writer = _PdfWriter()
+        self.catalog = self.writer.reserve()
+        self.pages = self.writer.reserve()
+        self.resources = self.writer.reserve()
+        self.font_objects = {key: self.writer.reserve() for key in fonts}
+        # الحروف المستخدمة في الملف لكل خط: {رقم الحرف: النص} (الحرف 0 مطلوب دائماً في الخط المضمن)
+        self.used_glyphs = {key: {0: ''} for key in fonts}
+        self.page_objects = []
+
+        template = self.writer.reserve()
+        static = _static_content(fonts, cells, self.used_glyphs)
+        self.writer.write_stream(template, static, b' /Type /XObject /Subtype /Form /BBox [0 0 %s] /Resources %d 0 R' % (
+            self.page_size, self.resources,
+        ))
+        self.writer.write_object(self.resources, b'<< /Font << %s >> /XObject << /Tpl %d 0 R >> >>' % (
+            b' '.join(b'/%s %d 0 R' % (PDF_FONT_NAMES[key].encode(), number) for key, number in self.font_objects.items()),
+            template,
+        ))
+
+    def add_pages(self, pages, glyphs):
+        """pages: محتوى الصفحات مضغوطاً، glyphs: الحروف المستخدمة فيها (نتيجة render_pdf_pages)."""
+        for key, used in glyphs.items():
+            self.used_glyphs[key].update(used)
+        for content in pages:
+            content_object, page = self.writer.reserve(), self.writer.reserve()
+            self.writer.write_stream(content_object, content, compressed=True)
+            self.writer.write_object(page, b'<< /Type /Page /Parent %d 0 R /Resources %d 0 R /Contents %d 0 R >>' % (
+                self.pages, self.resources, content_object,
+            ))
+            self.page_objects.append(page)
+
+    def _write_font(self, number, font, glyphs):
+        writer = self.writer
+        gids = sorted(glyphs)
+        descendant, descriptor, font_file, to_unicode = (writer.reserve() for _ in range(4))
+        # اسم الخط المضمن: 6 حروف من الحروف المستخدمة + اسم الخط (طريقة تسمية الـ subset في PDF)
+        tag = ''.join(chr(65 + byte % 26) for byte in hashlib.md5(repr(gids).encode()).digest()[:6])
+        name = f"{tag}+{font.name}".encode('ascii')
+
+        writer.write_object(number, b'<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H /DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>' % (
+            name, descendant, to_unicode,
+        ))
+        widths = ' '.join(f"{gid} [{font.widths[gid]}]" for gid in gids).encode()
+        writer.write_object(descendant, (
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+            b'/FontDescriptor %d 0 R /CIDToGIDMap /Identity /W [%s] >>'
+        ) % (name, descriptor, widths))
+        bbox = ' '.join(str(round(value * font.scale)) for value in font.bbox).encode()
+        writer.write_object(descriptor, (
+            b'<< /Type /FontDescriptor /FontName /%s /Flags 4 /FontBBox [%s] /ItalicAngle 0 '
+            b'/Ascent %d /Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+        ) % (
+            name, bbox, round(font.ascent * font.scale), round(font.descent * font.scale),
+            round(font.cap_height * font.scale), font_file,
+        ))
+        data = font.subset(gids)
+        writer.write_stream(font_file, data, b' /Length1 %d' % len(data))
+        writer.write_stream(to_unicode, _to_unicode_cmap({gid: text for gid, text in glyphs.items() if text}))
+
+    def close(self):
+        """يكتب الخطوط (الحروف المستخدمة فقط) وشجرة الصفحات والفهرس."""
+        for key, number in self.font_objects.items():
+            self._write_font(number, self.fonts[key], self.used_glyphs[key])
+        self.writer.write_object(self.pages, b'<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 %s] >>' % (
+            b' '.join(b'%d 0 R' % number for number in self.page_objects), len(self.page_objects), self.page_size,
+        ))
+        self.writer.write_object(self.catalog, b'<< /Type /Catalog /Pages %d 0 R >>' % self.pages)
+        self.writer.close(self.catalog)
+
+    def drain(self):
+        return self.writer.drain()
+
+
+def _iter_pdf(fonts, bundles, chunk_size, **layout):
+    document = None
+    pending = 0
+    for pages, glyphs in bundles:
+        if document is None:
+            document = _PdfDocument(fonts, **layout)
+        document.add_pages(pages, glyphs)
+        pending += len(pages)
+        if pending >= chunk_size:
+            pending = 0
+            yield document.drain()
+    if document is not None:
+        document.close()
+        yield document.drain()
+
+
+def iter_print_pdf(contexts, chunk_size=PRINT_CHUNK_PAGES, cells=INVOICE_CELLS, page_size=(PAGE_WIDTH, PAGE_HEIGHT)):
+    """
+    يرسم صفحة لكل context في ملف PDF واحد ويعيده كسلسلة bytes (دفعة كل chunk_size صفحة تقريباً).
+    cells و page_size لتخطيط غير الوصل (compile_layout). لا يعيد شيئاً إذا لم تكن هناك صفحات.
+    يرفع PdfPrintError إذا لم تكن الخطوط أو مكتباتها متاحة.
+    """
+    fonts = get_pdf_fonts()
+    return _iter_pdf(
+        fonts, (render_pdf_pages(fonts, [context], cells) for context in contexts), chunk_size,
+        cells=cells, page_size=page_size,
+    )
+
+
+# =======================================
+# الطباعة من كاش الصفحات (print_cache)
+# =======================================
+# تغيير التخطيط في هذا الملف يجعل كل الصفحات المحفوظة قديمة
+LAYOUT_VERSION = hashlib.md5(repr((
+    PAGE_WIDTH, PAGE_HEIGHT, PAGE_MARGIN_TOP, PAGE_MARGIN_RIGHT, CELL_MARGIN, COLUMN_WIDTHS, ROW_HEIGHTS,
+    LINE_SPACING, MIN_FONT_SIZE, INVOICE_LAYOUT, PDF_FONT_NAMES,
+)).encode('utf-8')).hexdigest()[:12]
+
+
+def pdf_cache_version(fonts):
+    return f"pdf:{LAYOUT_VERSION}:" + ':'.join(f"{os.path.basename(fonts[key].path)}@{fonts[key].mtime}" for key in sorted(fonts))
+
+
+def pack_pdf_pages(pages, glyphs):
+    """صفحات وصل (render_pdf_pages) كملف واحد للكاش: سطر JSON (أطوال الصفحات والحروف) ثم محتوى الصفحات."""
+    header = json.dumps({
+        'pages': [len(content) for content in pages],
+        'glyphs': {key: sorted(used.items()) for key, used in glyphs.items()},
+    }, ensure_ascii=False).encode('utf-8')
+    return header + b'\n' + b''.join(pages)
+
+
+def unpack_pdf_pages(data):
+    header, _, body = data.partition(b'\n')
+    header = json.loads(header)
+    pages, position = [], 0
+    for length in header['pages']:
+        pages.append(body[position:position + length])
+        position += length
+    return pages, {key: dict(used) for key, used in header['glyphs'].items()}
+
+
+def iter_receipt_pdf_pages(fonts, receipts_list, cache=None):
+    """(صفحات، حروف) لكل وصل بالترتيب: من الكاش إن وجد، أو ترسم وتحفظ فيه. الوصل بدون صفحات لا يعيد شيئاً."""
+    version = pdf_cache_version(fonts) if cache is not None else None
+    for receipt in receipts_list:
+        key = receipt_cache_key(receipt, version) if cache is not None else None
+        data = cache.get(key) if cache is not None else None
+        if data is not None:
+            yield unpack_pdf_pages(data)
+            continue
+        pages, glyphs = render_pdf_pages(fonts, iter_receipt_page_contexts(receipt))
+        if not pages:
+            continue
+        if cache is not None:
+            cache.set(key, pack_pdf_pages(pages, glyphs))
+        yield pages, glyphs
+
+
+def iter_print_pdf_receipts(receipts_list, chunk_size=PRINT_CHUNK_PAGES):
+    """
+    مثل iter_print_pdf لكن من الوصلات (محملة بـ printable_receipts): صفحات الوصل المحفوظة في كاش الطباعة
+    لا ترسم من جديد، والملف يجمع منها مباشرة.
+    """
+    fonts = get_pdf_fonts()
+    return _iter_pdf(fonts, iter_receipt_pdf_pages(fonts, receipts_list, get_print_cache()), chunk_size)
@@ -0,0 +1,149 @@
+# salesapp/print_cache.py
+"""
+كاش صفحات الطباعة على القرص: صفحات كل وصل بعد رسمها (محتوى body للوورد، أو صفحات PDF) تحفظ في ملف
+اسمه hash لبيانات الوصل وأقساطه (المبلغ، التاريخ، مدفوع) ونسخة القالب (mtime).
+أي تعديل على الوصل أو القالب يغير المفتاح، فلا يوجد إلغاء صريح: الملفات القديمة لا تستخدم وتحذف مع الوقت.
+إعادة طباعة نفس الوصل أو نفس الدفعة (مثلاً بعد انحشار الورق في الطابعة) تجمع الصفحات المحفوظة فقط بدون رسم.
+الحجم محدود بـ SALES_PRINT_CACHE_MAX_BYTES: عند تجاوزه تحذف الملفات الأقدم استخداماً
+(LRU بتاريخ تعديل الملف، ويتم تحديثه مع كل قراءة).
+"""
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+
+# يتغير عند تغيير طريقة رسم أو حفظ الصفحات، فلا تستخدم الملفات المحفوظة بالطريقة القديمة
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# بعد تجاوز الحد يتم الحذف حتى هذه النسبة منه (حتى لا يتكرر الحذف مع كل ملف جديد)
+EVICT_TO_RATIO = 0.9
+
+# بيانات الوصل التي تظهر في صفحات الطباعة (مع اسم المندوب والأقساط)
+RECEIPT_KEY_FIELDS = (
+    'receipt_number', 'customer_name', 'phone_number', 'address', 'area', 'products_text',
+    'is_cash_sale', 'sale_year', 'sale_month', 'total_amount', 'down_payment', 'installment_system',
+)
+
+
+def receipt_cache_key(receipt, template_version):
+    """
+    مفتاح صفحات الوصل في الكاش. template_version: نسخة القالب وصيغة الملف (مثلاً 'docx:invoice.docx:<mtime>').
+    يتوقع أن تكون الأقساط محملة مسبقاً (printable_receipts).
+    """
+    state = [CACHE_VERSION, template_version, receipt.salesperson.name if receipt.salesperson_id else '']
+    state.extend(getattr(receipt, field) for field in RECEIPT_KEY_FIELDS)
+    state.append([(payment.amount, payment.payment_date, payment.is_paid) for payment in receipt.payments.all()])
+    return hashlib.sha256(json.dumps(state, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class PrintCache:
+    """ملفات الكاش في directory/<أول حرفين من المفتاح>/<المفتاح>."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        # الحجم الكلي التقريبي (يحسب من القرص أول مرة، ثم يزيد مع كل ملف جديد في هذه العملية)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """محتوى الملف أو None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # آخر استخدام (LRU)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # الكاش لا يوقف الطباعة (مثلاً القرص ممتلئ): الصفحات ترسم من جديد في المرة القادمة
+            return
+        with self._lock:
+            self._size = self.total_size() if self._size is None else self._size + len(data)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def entries(self):
+        """[(آخر استخدام، الحجم، المسار)] لكل ملفات الكاش."""
+        entries = []
+        try:
+            folders = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return entries
+        for folder in folders:
+            try:
+                files = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in files:
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def total_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, target=None):
+        """يحذف الملفات الأقدم استخداماً حتى يصبح الحجم <= target (افتراضياً 90% من الحد). يرجع عدد الملفات المحذوفة."""
+        if target is None:
+            target = int(self.max_bytes * EVICT_TO_RATIO)
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        with self._lock:
+            self._size = total
+        return removed
+
+    def purge(self):
+        """يحذف كل ملفات الكاش."""
+        return self.evict(target=0)
+
+
+_print_cache = None
+_print_cache_lock = threading.Lock()
+
+
+def get_print_cache():
+    """كاش الطباعة حسب الإعدادات، أو None إذا كان معطلاً (SALES_PRINT_CACHE_MAX_BYTES = 0)."""
+    global _print_cache
+    max_bytes = getattr(settings, 'SALES_PRINT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    if not max_bytes:
+        return None
+    directory = str(getattr(settings, 'SALES_PRINT_CACHE_DIR', os.path.join(settings.BASE_DIR, 'print_cache')))
+    with _print_cache_lock:
+        if _print_cache is None or (_print_cache.directory, _print_cache.max_bytes) != (directory, max_bytes):
+            _print_cache = PrintCache(directory, max_bytes)
+        return _print_cache
@@ -0,0 +1,100 @@
+# salesapp/print_jobs.py
+"""
+تنفيذ مهام الطباعة المجمعة في الخلفية (PrintJob).
+الطلب من الواجهة ينشئ المهمة فقط، وأمر run_print_jobs يجهز الملف ويحدث نسبة الإنجاز.
+"""
+import datetime
+import os
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import PrintJob
+from .printing import get_invoice_template, iter_print_docx_receipts, PRINT_CHUNK_RECEIPTS
+from .views import filter_receipts, printable_receipts
+
+
+def count_batch_pages(receipts_list):
+    """عدد صفحات الطباعة: صفحة لكل وصل كاش + صفحة لكل قسط في وصلات التقسيط."""
+    totals = receipts_list.order_by().aggregate(
+        cash=Count('id', filter=Q(is_cash_sale=True), distinct=True),
+        installments=Count('payments', filter=Q(is_cash_sale=False)),
+    )
+    return (totals['cash'] or 0) + (totals['installments'] or 0)
+
+
+def get_print_jobs_dir():
+    return getattr(settings, 'SALES_PRINT_JOBS_DIR', os.path.join(settings.BASE_DIR, 'print_jobs'))
+
+
+def requeue_stale_jobs(stale_seconds=None):
+    """
+    يعيد للانتظار المهام الجارية التي توقف تحديث تقدمها (العامل توقف أو انهار أثناء التنفيذ).
+    الملف الجزئي يكتب من البداية عند إعادة التنفيذ، فيبدأ العد من الصفر.
+    """
+    if stale_seconds is None:
+        stale_seconds = getattr(settings, 'SALES_PRINT_JOB_STALE_SECONDS', 30 * 60)
+    stale_before = timezone.now() - datetime.timedelta(seconds=stale_seconds)
+    return PrintJob.objects.filter(status=PrintJob.STATUS_RUNNING).filter(
+        Q(heartbeat_at__lt=stale_before) | Q(heartbeat_at__isnull=True, started_at__lt=stale_before)
+    ).update(status=PrintJob.STATUS_PENDING, pages_done=0, started_at=None, heartbeat_at=None)
+
+
+def claim_next_job():
+    """
+    يحجز أقدم مهمة في الانتظار. التحديث مشروط بالحالة حتى لا تأخذ عمليتان نفس المهمة.
+    """
+    requeue_stale_jobs()
+    for job_id in PrintJob.objects.filter(status=PrintJob.STATUS_PENDING).order_by('created_at').values_list('id', flat=True)[:10]:
+        claimed = PrintJob.objects.filter(pk=job_id, status=PrintJob.STATUS_PENDING).update(
+            status=PrintJob.STATUS_RUNNING, started_at=timezone.now(), heartbeat_at=timezone.now()
+        )
+        if claimed:
+            return PrintJob.objects.select_related('branch').get(pk=job_id)
+    return None
+
+
+def _counted(receipts_list, counter):
+    # نفس عد count_batch_pages: صفحة لوصل الكاش، وصفحة لكل قسط
+    for receipt in receipts_list:
+        counter[0] += 1 if receipt.is_cash_sale else len(receipt.payments.all())
+        yield receipt
+
+
+def run_print_job(job):
+    """يجهز ملف Word للمهمة ويكتبه على القرص على دفعات، مع تحديث الصفحات المنتهية بعد كل دفعة."""
+    try:
+        receipts_list = printable_receipts(filter_receipts(job.branch, job.filters))
+        job.total_pages = count_batch_pages(receipts_list)
+        job.save(update_fields=['total_pages'])
+        if not job.total_pages:
+            raise ValueError("لم يتم العثور على أي أقساط أو وصلات كاش للطباعة.")
+
+        invoice_template = get_invoice_template()
+        jobs_dir = get_print_jobs_dir()
+        os.makedirs(jobs_dir, exist_ok=True)
+        output_path = os.path.join(jobs_dir, f"print_job_{job.id}.docx")
+        tmp_path = output_path + '.part'
+
+        # عدد صفحات الوصلات التي تم سحبها من المولد؛ الدفعة الأخيرة فقط تكون ناقصة.
+        # صفحات الوصلات التي لم تتغير منذ آخر طباعة تؤخذ جاهزة من كاش الطباعة
+        consumed = [0]
+        receipts_iterator = _counted(receipts_list.iterator(chunk_size=PRINT_CHUNK_RECEIPTS), consumed)
+        with open(tmp_path, 'wb') as output:
+            for data in iter_print_docx_receipts(invoice_template, receipts_iterator):
+                output.write(data)
+                PrintJob.objects.filter(pk=job.pk).update(
+                    pages_done=min(consumed[0], job.total_pages), heartbeat_at=timezone.now()
+                )
+        os.replace(tmp_path, output_path)
+
+        job.output_path = output_path
+        job.pages_done = job.total_pages
+        job.status = PrintJob.STATUS_DONE
+    except Exception as e:
+        job.status = PrintJob.STATUS_FAILED
+        job.error_message = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'pages_done', 'output_path', 'error_message', 'finished_at'])
+    return job
@@ -0,0 +1,536 @@
+import collections
+import copy
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.oxml.ns import qn
+from docxcompose.composer import Composer
+from docxtpl import DocxTemplate
+from jinja2 import Environment, meta
+
+from .formatting import format_fields
+from .print_cache import get_print_cache, receipt_cache_key
+
+# =======================================
+# قالب الطباعة (invoice.docx)
+# =======================================
+INVOICE_TEMPLATE_PATH = os.path.join(settings.BASE_DIR, 'salesapp', 'static', 'salesapp', 'invoice.docx')
+
+# الحقول التي تملؤها شاشات الطباعة في القالب
+INVOICE_PLACEHOLDERS = frozenset({
+    'id', 'CName', 'phnum', 'CAddress', 'pro', 'area', 'empl', 'ins', 'seld',
+    't', 'i', 'to', 're', 'ga', 'payd', 'evm', 'evmar',
+})
+
+
+class InvoiceTemplateError(Exception):
+    """خطأ في تحميل أو التحقق من قالب الطباعة."""
+
+
+class _CompiledPage(DocxTemplate):
+    """
+    DocxTemplate لصفحة واحدة يستخدم قوالب jinja المترجمة مسبقاً
+    بدلاً من تنظيف الـ XML وترجمته من جديد مع كل صفحة، ونسخة من
+    المستند المحمل مسبقاً بدلاً من فك ملف الـ docx من جديد.
+    """
+
+    def __init__(self, compiled):
+        super().__init__(compiled.path)
+        self._compiled = compiled
+        # الرسم يعدل المستند (الـ body، الـ header/footer، الخصائص) لذلك كل صفحة تأخذ نسخة منفصلة
+        self.docx = copy.deepcopy(compiled.document)
+
+    def build_xml(self, context, jinja_env=None):
+        return self._render_compiled(self._compiled.body_template, self.docx._part, context)
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for rel_key, part in self.get_headers_footers(uri):
+            template, encoding = self._compiled.part_templates[rel_key]
+            yield rel_key, self._render_compiled(template, part, context).encode(encoding)
+
+    def _render_compiled(self, template, part, context):
+        # نفس المعالجة اللاحقة في DocxTemplate.render_xml_part
+        self.current_rendering_part = part
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (
+            dst_xml.replace("{_{", "{{")
+            .replace("}_}", "}}")
+            .replace("{_%", "{%")
+            .replace("%_}", "%}")
+        )
+        return self.resolve_listing(dst_xml)
+
+
+class CompiledInvoiceTemplate:
+    """
+    قالب docx محمل في الذاكرة: يقرأ الملف ويترجم أجزاءه مرة واحدة،
+    ثم يرسم كل صفحة من النسخة المترجمة.
+    """
+
+    def __init__(self, path, placeholders=INVOICE_PLACEHOLDERS):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        self._jinja_env = Environment()
+        loader = DocxTemplate(path)
+        loader.init_docx()
+        # المستند المحمل (قبل الرسم) تنسخ منه كل صفحة
+        self.document = loader.docx
+
+        sources = [self._prepare_xml(loader, loader.get_xml())]
+        self.body_template = self._jinja_env.from_string(sources[0])
+        self.part_templates = {}
+        for uri in (DocxTemplate.HEADER_URI, DocxTemplate.FOOTER_URI):
+            for rel_key, part in loader.get_headers_footers(uri):
+                xml = loader.get_part_xml(part)
+                encoding = loader.get_headers_footers_encoding(xml)
+                source = self._prepare_xml(loader, xml)
+                sources.append(source)
+                self.part_templates[rel_key] = (self._jinja_env.from_string(source), encoding)
+
+        self.variables = frozenset().union(
+            *(meta.find_undeclared_variables(self._jinja_env.parse(s)) for s in sources)
+        )
+        # الدمج في عمليات منفصلة ممكن فقط إذا لم يحتوي الـ body على صور أو روابط
+        # أو معرفات تحتاج إلى إعادة ترقيم داخل المستند النهائي
+        body_source = sources[0]
+        if '<w:sectPr' in body_source:
+            body_source = body_source[:body_source.rfind('<w:sectPr')]
+        self.supports_parallel = not re.search(r'r:id=|r:embed=|<wp:docPr|<w:bookmarkStart', body_source)
+
+        unknown = self.variables - placeholders
+        if unknown:
+            raise InvoiceTemplateError(
+                f"خطأ: القالب '{os.path.basename(path)}' يحتوي على حقول غير معروفة: {', '.join(sorted(unknown))}"
+            )
+        missing = placeholders - self.variables
+        if missing:
+            raise InvoiceTemplateError(
+                f"خطأ: القالب '{os.path.basename(path)}' لا يحتوي على الحقول: {', '.join(sorted(missing))}"
+            )
+
+    @staticmethod
+    def _prepare_xml(loader, xml):
+        # نفس التحضير الذي يتم داخل DocxTemplate.render_xml_part قبل الترجمة
+        return re.sub(r"<w:p([ >])", r"\n<w:p\1", loader.patch_xml(xml))
+
+    def render(self, context):
+        """يرسم صفحة واحدة ويعيد مستند python-docx جاهز للدمج."""
+        page = _CompiledPage(self)
+        page.render(context, self._jinja_env)
+        return page.docx
+
+
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+
+def get_invoice_template(path=INVOICE_TEMPLATE_PATH):
+    """
+    يعيد القالب المترجم من ذاكرة العملية، ويعيد تحميله إذا تغير
+    تاريخ تعديل الملف (mtime).
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        raise InvoiceTemplateError(f"خطأ: قالب '{os.path.basename(path)}' غير موجود.")
+
+    cached = _template_cache.get(path)
+    if cached is not None and cached.mtime == mtime:
+        return cached
+    with _template_cache_lock:
+        cached = _template_cache.get(path)
+        if cached is None or cached.mtime != mtime:
+            cached = CompiledInvoiceTemplate(path)
+            _template_cache[path] = cached
+        return cached
+
+
+# =======================================
+# بيانات الصفحات
+# =======================================
+def receipt_page_fields(receipt, installments):
+    """
+    حقول الصفحة الثابتة لكل صفحات الوصل (العميل، المنتجات، المندوب، نظام القسط...)،
+    تنسق مرة واحدة للوصل. installments: أقساط الوصل مرتبة حسب payment_date.
+    """
+    fields = {
+        'id': receipt.receipt_number, 'CName': receipt.customer_name,
+        'phnum': receipt.phone_number, 'CAddress': receipt.address,
+        'pro': receipt.products_text, 'area': receipt.area,
+        'empl': receipt.salesperson.name,
+        'to': receipt.total_amount, 're': receipt.down_payment,
+    }
+    if receipt.is_cash_sale:
+        fields.update(ins="كاش", seld=f"{receipt.sale_month}/{receipt.sale_year}", t=1)
+    else:
+        fields.update(ins=receipt.installment_system, seld=f"15/{receipt.sale_month}/{receipt.sale_year}", t=len(installments))
+    return format_fields(fields)
+
+
+def iter_installment_page_fields(receipt, installments):
+    """الحقول التي تتغير من صفحة لأخرى فقط: i, payd, evm, evmar, ga (صفحة لكل قسط، أو صفحة واحدة للكاش)."""
+    if receipt.is_cash_sale:
+        yield format_fields({
+            'i': 1, 'ga': "خالص", 'payd': f"{receipt.sale_month}/{receipt.sale_year}", 'evm': receipt.total_amount,
+        }, words={'evmar': receipt.total_amount})
+        return
+
+    paid_so_far = receipt.down_payment
+    for month_index, inst in enumerate(installments):
+        paid_so_far += inst.amount
+        remaining_after_this = receipt.total_amount - paid_so_far
+        yield format_fields({
+            'i': month_index + 1,
+            'ga': remaining_after_this if remaining_after_this > 0 else "خالص",
+            'payd': inst.payment_date, 'evm': inst.amount,
+        }, words={'evmar': inst.amount})
+
+
+def iter_receipt_page_contexts(receipt):
+    """
+    بيانات صفحات الطباعة لوصل واحد (المصدر الوحيد لكل شاشات الطباعة وأي صيغة تصدير).
+    يتوقع أن تكون أقساط الوصل محملة مسبقاً ومرتبة حسب payment_date (printable_receipts).
+    """
+    installments = list(receipt.payments.all())
+    fields = receipt_page_fields(receipt, installments)
+    for page_fields in iter_installment_page_fields(receipt, installments):
+        yield {**fields, **page_fields}
+
+
+def iter_batch_page_contexts(receipts_list):
+    """يولد بيانات صفحات الطباعة المجمعة واحدة تلو الأخرى (صفحة لكل قسط أو وصل كاش)."""
+    for receipt in receipts_list:
+        yield from iter_receipt_page_contexts(receipt)
+
+
+# =======================================
+# الدمج المتدفق للصفحات (طباعة مجمعة)
+# =======================================
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# عدد الصفحات التي تدمج في الذاكرة قبل كتابتها إلى الملف الناتج
+PRINT_CHUNK_PAGES = 50
+# عدد الوصلات التي تجلب من قاعدة البيانات في كل دفعة أثناء الطباعة المجمعة
+PRINT_CHUNK_RECEIPTS = 100
+
+_BODY_START_RE = re.compile(rb'<w:body[^>]*>')
+
+
+class _StreamBuffer:
+    """ملف للكتابة فقط (غير قابل للـ seek) يجمع ما يكتبه zipfile حتى يتم تفريغه."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _split_body_xml(document_element):
+    """يقسم XML المستند إلى (بداية المستند، محتوى الـ body، نهاية المستند)."""
+    xml = serialize_part_xml(document_element)
+    body_start = _BODY_START_RE.search(xml).end()
+    body_end = xml.rfind(b'<w:sectPr')
+    if body_end < body_start:
+        body_end = xml.rfind(b'</w:body>')
+    return xml[:body_start], xml[body_start:body_end], xml[body_end:]
+
+
+def _zip_info(name):
+    # تاريخ ثابت لكل الملفات داخل الـ zip حتى يكون الناتج متطابقاً بين مرة وأخرى
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+class _ChunkedDocxWriter:
+    """
+    يكتب ملف docx (zip) إلى output بحيث يُكتب word/document.xml على دفعات:
+    الصفحات تضاف إلى مستند رئيسي عبر Composer، ثم تُنقل عناصر الـ body
+    إلى الملف وتحذف من الذاكرة بعد كل دفعة.
+    """
+
+    def __init__(self, output, first_page, keep_first_page=True):
+        self.zip_file = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+        self.master = first_page
+        self.composer = Composer(first_page)
+        self.body = first_page.element.body
+        self._next_docpr_id = 1
+        self._next_bookmark_id = 0
+
+        prefix, _, _ = _split_body_xml(first_page.element)
+        self.stream = self.zip_file.open(_zip_info(first_page.part.partname.membername), 'w', force_zip64=True)
+        self.stream.write(prefix)
+        if not keep_first_page:
+            self._clear_body()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # في حالة الخطأ نغلق الملف كما هو حتى لا يخفي zipfile الخطأ الأصلي
+        if exc_type is not None:
+            self.stream.close()
+            self.zip_file.close()
+
+    def append(self, page):
+        self.composer.append(page)
+
+    def write_body_xml(self, body_xml):
+        """يكتب محتوى body جاهز (مدمج في عملية أخرى) مباشرة إلى الملف."""
+        self.stream.write(body_xml)
+
+    def flush(self):
+        """ينقل الصفحات المدمجة حتى الآن إلى الملف ويفرغ الـ body."""
+        # ترقيم المعرفات بشكل متصل عبر كل الدفعات
+        for doc_pr in self.body.iter(qn('wp:docPr')):
+            doc_pr.set('id', str(self._next_docpr_id))
+            self._next_docpr_id += 1
+        bookmark_ids = {}
+        for bookmark in self.body.iter(qn('w:bookmarkStart'), qn('w:bookmarkEnd')):
+            old_id = bookmark.get(qn('w:id'))
+            if old_id not in bookmark_ids:
+                bookmark_ids[old_id] = str(self._next_bookmark_id)
+                self._next_bookmark_id += 1
+            bookmark.set(qn('w:id'), bookmark_ids[old_id])
+
+        _, body_xml, _ = _split_body_xml(self.master.element)
+        self.write_body_xml(body_xml)
+        self._clear_body()
+
+    def _clear_body(self):
+        for element in list(self.body):
+            if element.tag != qn('w:sectPr'):
+                self.body.remove(element)
+
+    def close(self):
+        """يكمل document.xml ثم يكتب باقي أجزاء الحزمة (الأنماط، العلاقات، ...)."""
+        self.flush()
+        _, _, suffix = _split_body_xml(self.master.element)
+        self.stream.write(suffix)
+        self.stream.close()
+
+        package = self.master.part.package
+        parts = package.parts
+        for part in parts:
+            part.before_marshal()
+        self.zip_file.writestr(_zip_info(CONTENT_TYPES_URI.membername), _ContentTypesItem.from_parts(parts).blob)
+        self.zip_file.writestr(_zip_info(PACKAGE_URI.rels_uri.membername), package.rels.xml)
+        for part in parts:
+            if part is not self.master.part:
+                self.zip_file.writestr(_zip_info(part.partname.membername), part.blob)
+            if len(part.rels):
+                self.zip_file.writestr(_zip_info(part.partname.rels_uri.membername), part.rels.xml)
+        self.zip_file.close()
+
+
+def iter_composed_docx(pages, chunk_size=PRINT_CHUNK_PAGES):
+    """
+    يدمج مستندات الصفحات (من CompiledInvoiceTemplate.render) في ملف docx واحد
+    ويعيده كسلسلة من الـ bytes، بحيث لا يبقى في الذاكرة أكثر من دفعة واحدة.
+    لا يعيد شيئاً إذا لم تكن هناك صفحات.
+    """
+    pages = iter(pages)
+    first_page = next(pages, None)
+    if first_page is None:
+        return
+
+    buffer = _StreamBuffer()
+    with _ChunkedDocxWriter(buffer, first_page) as writer:
+        pending = 1
+        for page in pages:
+            writer.append(page)
+            pending += 1
+            if pending >= chunk_size:
+                writer.flush()
+                pending = 0
+                yield buffer.drain()
+        writer.close()
+    yield buffer.drain()
+
+
+# =======================================
+# الرسم المتوازي للصفحات (Process Pool)
+# =======================================
+_print_executor = None
+_print_executor_workers = 0
+_print_executor_lock = threading.Lock()
+
+
+def get_print_workers():
+    """عدد العمليات المستخدمة في رسم الصفحات (SALES_PRINT_WORKERS في الإعدادات، 0 أو 1 = بدون توازي)."""
+    return getattr(settings, 'SALES_PRINT_WORKERS', 0) or 0
+
+
+def _get_print_executor(workers):
+    # Pool واحد لكل عملية سيرفر، يعاد استخدامه بين الطلبات
+    global _print_executor, _print_executor_workers
+    with _print_executor_lock:
+        if _print_executor is None or _print_executor_workers != workers:
+            if _print_executor is not None:
+                _print_executor.shutdown(wait=False)
+            _print_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            _print_executor_workers = workers
+        return _print_executor
+
+
+def _render_chunk_body(template_path, contexts):
+    """(داخل عملية فرعية) يرسم دفعة صفحات ويدمجها ويعيد محتوى الـ body كـ bytes."""
+    invoice_template = get_invoice_template(template_path)
+    pages = [invoice_template.render(context) for context in contexts]
+    composer = Composer(pages[0])
+    for page in pages[1:]:
+        composer.append(page)
+    _, body_xml, _ = _split_body_xml(pages[0].element)
+    return body_xml
+
+
+def iter_composed_docx_parallel(invoice_template, contexts, workers, chunk_size=PRINT_CHUNK_PAGES):
+    """
+    مثل iter_composed_docx لكن يوزع رسم ودمج كل دفعة صفحات على Process Pool،
+    ثم يكتب الدفعات بنفس ترتيب الوصلات والأقساط. الناتج مطابق للمسار العادي.
+    """
+    contexts = iter(contexts)
+    first_chunk = list(itertools.islice(contexts, chunk_size))
+    if not first_chunk:
+        return
+
+    executor = _get_print_executor(workers)
+    pending = collections.deque()
+
+    def submit_next_chunk(chunk=None):
+        chunk = chunk or list(itertools.islice(contexts, chunk_size))
+        if chunk:
+            pending.append(executor.submit(_render_chunk_body, invoice_template.path, chunk))
+
+    # نبقي عدداً محدوداً من الدفعات قيد التنفيذ حتى لا تكبر الذاكرة
+    submit_next_chunk(first_chunk)
+    for _ in range(workers * 2 - 1):
+        submit_next_chunk()
+
+    # المستند الرئيسي يستخدم فقط لبداية ونهاية document.xml وباقي أجزاء الحزمة
+    master = invoice_template.render(first_chunk[0])
+    buffer = _StreamBuffer()
+    with _ChunkedDocxWriter(buffer, master, keep_first_page=False) as writer:
+        while pending:
+            body_xml = pending.popleft().result()
+            submit_next_chunk()
+            writer.write_body_xml(body_xml)
+            yield buffer.drain()
+        writer.close()
+    yield buffer.drain()
+
+
+def iter_print_docx(invoice_template, contexts, workers=None):
+    """
+    يرسم صفحة لكل context ويعيد ملف docx المدمج كسلسلة bytes.
+    يستخدم المسار المتوازي إذا كان عدد العمليات أكبر من 1 والقالب يسمح بذلك.
+    """
+    if workers is None:
+        workers = get_print_workers()
+    if workers > 1 and invoice_template.supports_parallel:
+        return iter_composed_docx_parallel(invoice_template, contexts, workers)
+    return iter_composed_docx(invoice_template.render(context) for context in contexts)
+
+
+# =======================================
+# الطباعة من كاش الصفحات (print_cache)
+# =======================================
+def docx_cache_version(invoice_template):
+    """نسخة القالب في مفتاح الكاش: تعديل invoice.docx يجعل كل الصفحات المحفوظة قديمة."""
+    return f"docx:{os.path.basename(invoice_template.path)}:{invoice_template.mtime}"
+
+
+def iter_receipt_bodies(invoice_template, receipts_list, cache, workers=0):
+    """
+    محتوى body (صفحات مدمجة) لكل وصل بالترتيب: من الكاش، أو يرسم ويحفظ فيه
+    (في Process Pool إذا كان workers أكبر من 1). الوصل بدون صفحات لا يعيد شيئاً.
+    """
+    version = docx_cache_version(invoice_template)
+    executor = _get_print_executor(workers) if workers > 1 else None
+    pending = collections.deque()
+
+    def resolve(key, body):
+        if not isinstance(body, bytes):
+            body = body.result()
+            cache.set(key, zlib.compress(body))
+        return body
+
+    for receipt in receipts_list:
+        key = receipt_cache_key(receipt, version)
+        # محتوى body مضغوط في الكاش (XML الوورد يقل حجمه كثيراً)
+        body = cache.get(key)
+        if body is not None:
+            body = zlib.decompress(body)
+        else:
+            contexts = list(iter_receipt_page_contexts(receipt))
+            if not contexts:
+                continue
+            if executor is None:
+                body = _render_chunk_body(invoice_template.path, contexts)
+                cache.set(key, zlib.compress(body))
+            else:
+                body = executor.submit(_render_chunk_body, invoice_template.path, contexts)
+        pending.append((key, body))
+        # الترتيب محفوظ: ننتظر أقدم وصل فقط عند امتلاء الطابور أو إذا كان جاهزاً
+        while pending and (isinstance(pending[0][1], bytes) or len(pending) > workers * 2):
+            yield resolve(*pending.popleft())
+    while pending:
+        yield resolve(*pending.popleft())
+
+
+def iter_print_docx_receipts(invoice_template, receipts_list, workers=None):
+    """
+    مثل iter_print_docx لكن من الوصلات (محملة بـ printable_receipts): صفحات الوصل المحفوظة في كاش الطباعة
+    لا ترسم من جديد، والملف يجمع من body كل وصل. بدون كاش (SALES_PRINT_CACHE_MAX_BYTES = 0)
+    أو مع قالب لا يسمح بدمج أجزاء جاهزة يتم الرسم العادي.
+    """
+    if workers is None:
+        workers = get_print_workers()
+    cache = get_print_cache()
+    if cache is None or not invoice_template.supports_parallel:
+        return iter_print_docx(invoice_template, iter_batch_page_contexts(receipts_list), workers)
+    return _iter_docx_from_bodies(invoice_template, iter_receipt_bodies(invoice_template, receipts_list, cache, workers))
+
+
+def _iter_docx_from_bodies(invoice_template, bodies):
+    bodies = iter(bodies)
+    first_body = next(bodies, None)
+    if first_body is None:
+        return
+
+    # المستند الرئيسي يستخدم فقط لبداية ونهاية document.xml وباقي أجزاء الحزمة (كما في المسار المتوازي)
+    master = invoice_template.render({})
+    buffer = _StreamBuffer()
+    with _ChunkedDocxWriter(buffer, master, keep_first_page=False) as writer:
+        writer.write_body_xml(first_body)
+        for body in bodies:
+            writer.write_body_xml(body)
+            data = buffer.drain()
+            if data:
+                yield data
+        writer.close()
+    yield buffer.drain()
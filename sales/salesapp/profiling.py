@@ -0,0 +1,187 @@
+# salesapp/profiling.py
+"""
+قياس أداء الطلبات في بيئة التشغيل الفعلية:
+عدد الاستعلامات وزمنها، أبطأ الاستعلامات، وزمن رسم القوالب، مع سجل للطلبات البطيئة حسب اسم الشاشة.
+يعمل بنظام العينات (SALES_PROFILING_SAMPLE_RATE)، وهو متوقف افتراضياً (النسبة 0):
+بدون تفعيله لا يتم تغيير أي شيء في Django ويمر الطلب كما هو.
+"""
+import contextlib
+import contextvars
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template as DjangoTemplate
+from django.utils import timezone
+
+slow_request_logger = logging.getLogger('salesapp.slow_requests')
+
+# قياس الطلب الحالي (None = الطلب ليس ضمن العينة)
+_current_profile = contextvars.ContextVar('salesapp_request_profile', default=None)
+
+MAX_SQL_LENGTH = 1000
+
+
+class RequestProfile:
+    """تجميع قياسات طلب واحد."""
+
+    def __init__(self, top_n):
+        self.started = time.perf_counter()
+        self.top_n = top_n
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self._slowest = []  # heap صغير بأبطأ top_n استعلامات: (ms, ترتيب, sql)
+
+    def record_query(self, sql, duration_ms):
+        self.query_count += 1
+        self.db_ms += duration_ms
+        item = (duration_ms, self.query_count, sql[:MAX_SQL_LENGTH])
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, item)
+        elif self.top_n:
+            heapq.heappushpop(self._slowest, item)
+
+    def as_dict(self, request, response, streaming=False):
+        match = request.resolver_match
+        return {
+            'time': timezone.now().isoformat(timespec='seconds'),
+            'view': (match.url_name or match.view_name) if match else request.path,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'streaming': streaming,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'db_ms': round(self.db_ms, 2),
+            'query_count': self.query_count,
+            'template_ms': round(self.template_ms, 2),
+            'slowest_queries': [
+                {'ms': round(ms, 2), 'sql': sql} for ms, _, sql in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+
+def _query_timer(profile):
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            profile.record_query(sql, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+_original_template_render = DjangoTemplate.render
+
+
+def _timed_template_render(self, context=None, request=None):
+    profile = _current_profile.get()
+    if profile is None:
+        return _original_template_render(self, context, request)
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context, request)
+    finally:
+        profile.template_ms += (time.perf_counter() - start) * 1000
+
+
+def install_template_timer():
+    # قوالب الشاشات تُرسم عبر render() -> Template.render الخاص بالـ backend (مرة واحدة لكل صفحة).
+    # يتم التركيب مع أول طلب مقاس فقط، فلا يتغير رسم القوالب إذا كان القياس متوقفاً
+    if DjangoTemplate.render is not _timed_template_render:
+        DjangoTemplate.render = _timed_template_render
+
+
+class RequestProfilingMiddleware:
+    """
+    يقيس عينة من الطلبات، ويضيف هيدر Server-Timing للطلبات المقاسة،
+    ويكتب الطلبات الأبطأ من SALES_SLOW_REQUEST_MS في سجل salesapp.slow_requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'SALES_PROFILING_SAMPLE_RATE', 0)
+        if not sample_rate or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        install_template_timer()
+        profile = RequestProfile(getattr(settings, 'SALES_PROFILING_TOP_QUERIES', 5))
+        stack = contextlib.ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(_query_timer(profile)))
+        _current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self._stop(stack)
+            raise
+
+        if response.streaming:
+            # الطباعة المجمعة: العمل الفعلي يتم أثناء إرسال المحتوى، لذلك ينتهي القياس عند إغلاق الـ response.
+            # close() يستدعيه خادم WSGI دائماً، حتى لو انقطع الاتصال قبل آخر جزء (بعكس finally داخل المولد)
+            response._resource_closers.append(lambda: self._finish_stream(request, response, profile, stack))
+            return response
+
+        self._stop(stack)
+        record = profile.as_dict(request, response)
+        response['Server-Timing'] = (
+            f"db;dur={record['db_ms']};desc=\"{record['query_count']} queries\", "
+            f"tpl;dur={record['template_ms']}, total;dur={record['total_ms']}"
+        )
+        self._log_if_slow(record)
+        return response
+
+    def _finish_stream(self, request, response, profile, stack):
+        self._stop(stack)
+        self._log_if_slow(profile.as_dict(request, response, streaming=True))
+
+    @staticmethod
+    def _stop(stack):
+        stack.close()
+        _current_profile.set(None)
+
+    @staticmethod
+    def _log_if_slow(record):
+        if record['total_ms'] >= getattr(settings, 'SALES_SLOW_REQUEST_MS', 1000):
+            slow_request_logger.warning(json.dumps(record, ensure_ascii=False))
+
+
+def read_slow_requests(limit_per_view=20, path=None):
+    """
+    يقرأ سجل الطلبات البطيئة (الملف الحالي فقط) ويجمعه حسب اسم الشاشة:
+    {view: {'count', 'avg_ms', 'max_ms', 'recent': [آخر الطلبات]}} مرتب من الأبطأ.
+    """
+    path = path or settings.SALES_SLOW_REQUEST_LOG
+    by_view = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                stats = by_view.setdefault(record['view'], {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'recent': deque(maxlen=limit_per_view),
+                })
+                stats['count'] += 1
+                stats['total_ms'] += record['total_ms']
+                stats['max_ms'] = max(stats['max_ms'], record['total_ms'])
+                stats['recent'].append(record)
+
+    summary = {}
+    for view, stats in sorted(by_view.items(), key=lambda item: -item[1]['max_ms']):
+        summary[view] = {
+            'count': stats['count'],
+            'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+            'max_ms': stats['max_ms'],
+            'recent': list(reversed(stats['recent'])),
+        }
+    return summary
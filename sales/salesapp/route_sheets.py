@@ -0,0 +1,360 @@
+# salesapp/route_sheets.py
+"""
+كشف خط سير المحصل: الأقساط غير المدفوعة المسندة لمحصل في شهر استحقاق واحد (بعد الإسناد الجماعي في شاشة التحصيل)
+مرتبة ومجمعة حسب المنطقة ثم العنوان (كل عنوان = محطة واحدة في خط السير)، بصيغة CSV أو Excel (xlsx) أو PDF.
+- الكشف كله استعلام واحد يستخدم فهرس inst_collector_paid_due_idx (المحصل، مدفوع، تاريخ الاستحقاق)،
+  ويقرأ على دفعات بـ .iterator(chunk_size) (server-side cursor في PostgreSQL). التجميع يتم أثناء القراءة (groupby)
+  لأن الصفوف مرتبة بالمنطقة والعنوان: الذاكرة لا تكبر مع عدد المحطات.
+- الملف يرسل للمتصفح أثناء إنشائه: CSV سطراً بسطر، و xlsx بكتابة ورقة العمل مباشرة داخل الـ zip
+  (بدون openpyxl؛ النصوص في جدول shared strings يكتب بعد ورقة العمل: المنطقة والعنوان والأسماء المتكررة
+  تحفظ مرة واحدة، والذاكرة تكبر مع عدد النصوص المختلفة فقط)، و PDF بنفس كاتب الصفحات في pdf_printing.
+"""
+import csv
+import itertools
+import re
+import zipfile
+from collections import namedtuple
+from datetime import date
+from xml.sax.saxutils import escape, quoteattr
+
+from .formatting import format_value
+from .models import InstallmentPayment
+from .pdf_printing import PDF_CONTENT_TYPE, compile_layout, iter_print_pdf
+from .printing import _StreamBuffer, _zip_info
+from .utils import month_date_range
+
+# عدد الصفوف في كل دفعة من قاعدة البيانات، وعدد الصفوف في كل دفعة ترسل للمتصفح (CSV و xlsx)
+ROUTE_SHEET_CHUNK_SIZE = 2000
+ROUTE_SHEET_FLUSH_ROWS = 500
+
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# (اسم الحقل في الاستعلام) بنفس ترتيب RouteInstallment ثم المنطقة والعنوان
+ROUTE_FIELDS = (
+    'id', 'receipt__receipt_number', 'receipt__customer_name', 'receipt__phone_number', 'payment_date', 'amount',
+    'receipt__area', 'receipt__address',
+)
+
+RouteInstallment = namedtuple('RouteInstallment', 'id receipt_number customer_name phone_number payment_date amount')
+# number: رقم المحطة في خط السير (من 1)
+RouteStop = namedtuple('RouteStop', 'number area address installments')
+RouteSheet = namedtuple('RouteSheet', 'branch collector year month')
+
+
+def route_sheet_queryset(sheet):
+    """أقساط الكشف كـ values_list (ROUTE_FIELDS) مرتبة بالمنطقة ثم العنوان ثم رقم الوصل."""
+    month_start, next_month_start = month_date_range(sheet.year, sheet.month)
+    # is_paid__in بدلاً من is_paid=False: Django يكتب الثانية NOT "is_paid" فلا يستخدم SQLite إلا أول عمود من الفهرس،
+    # بينما "is_paid" IN (0) يبحث في الفهرس بالأعمدة الثلاثة (المحصل، مدفوع، مدى التاريخ)
+    return InstallmentPayment.objects.filter(
+        collector=sheet.collector, is_paid__in=[False],
+        payment_date__gte=month_start, payment_date__lt=next_month_start,
+        receipt__branch=sheet.branch,
+    ).order_by(
+        'receipt__area', 'receipt__address', 'receipt__receipt_number', 'payment_date', 'id',
+    ).values_list(*ROUTE_FIELDS)
+
+
+def iter_route_stops(rows):
+    """يجمع الصفوف المرتبة (ROUTE_FIELDS) في محطات: عنوان واحد في منطقة واحدة."""
+    for number, ((area, address), group) in enumerate(itertools.groupby(rows, key=lambda row: row[6:]), 1):
+        yield RouteStop(number, area, address, [RouteInstallment(*row[:6]) for row in group])
+
+
+def iter_sheet_stops(sheet, chunk_size=ROUTE_SHEET_CHUNK_SIZE):
+    return iter_route_stops(route_sheet_queryset(sheet).iterator(chunk_size=chunk_size))
+
+
+def _batched(rows, size=ROUTE_SHEET_FLUSH_ROWS):
+    iterator = iter(rows)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+# =======================================
+# CSV و Excel: صف لكل قسط (المنطقة والعنوان في كل صف حتى يمكن الفرز والفلترة)
+# =======================================
+ROUTE_COLUMNS = (
+    ('المحطة', 8), ('المنطقة', 18), ('العنوان', 40), ('رقم الوصل', 11), ('العميل', 28),
+    ('الهاتف', 15), ('تاريخ الاستحقاق', 14), ('المبلغ', 10), ('رقم القسط', 11),
+)
+
+
+def iter_route_rows(stops):
+    for stop in stops:
+        for installment in stop.installments:
+            yield (
+                stop.number, stop.area, stop.address, installment.receipt_number, installment.customer_name,
+                installment.phone_number, installment.payment_date, installment.amount, installment.id,
+            )
+
+
+class _Echo:
+    """csv.writer يعيد السطر بدلاً من كتابته في ملف."""
+
+    def write(self, value):
+        return value
+
+
+def iter_route_sheet_csv(sheet, stops):
+    # BOM حتى يفتح Excel الملف بترميز UTF-8 (الأسماء العربية)
+    writer = csv.writer(_Echo())
+    yield ('\ufeff' + writer.writerow([title for title, _ in ROUTE_COLUMNS])).encode('utf-8')
+    for batch in _batched(iter_route_rows(stops)):
+        yield ''.join(writer.writerow(row) for row in batch).encode('utf-8')
+
+
+# حروف التحكم غير مسموحة في XML
+_XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# رقم التاريخ في Excel: عدد الأيام من 30/12/1899
+_EXCEL_EPOCH = date(1899, 12, 30)
+# أرقام التنسيقات في styles.xml
+_XLSX_DATE_STYLE, _XLSX_HEADER_STYLE = 1, 2
+
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_workbook(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name={quoteattr(sheet_name)} sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+
+
+class _SharedStrings:
+    """جدول shared strings: رقم لكل نص مختلف بترتيب أول ظهور."""
+
+    def __init__(self):
+        self.indexes = {}
+        self.count = 0
+
+    def index(self, text):
+        self.count += 1
+        return self.indexes.setdefault(text, len(self.indexes))
+
+    def xml(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'count="{self.count}" uniqueCount="{len(self.indexes)}">'
+            + ''.join(f'<si><t xml:space="preserve">{escape(text)}</t></si>' for text in self.indexes)
+            + '</sst>'
+        )
+
+
+def _xlsx_cell(value, strings, style=0):
+    style_attribute = f' s="{style}"' if style else ''
+    if value is None:
+        value = ''
+    if isinstance(value, date):
+        return f'<c s="{_XLSX_DATE_STYLE}"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c{style_attribute}><v>{value}</v></c>'
+    text = _XML_INVALID_RE.sub('', str(value))
+    return f'<c t="s"{style_attribute}><v>{strings.index(text)}</v></c>'
+
+
+def _xlsx_row(values, strings, style=0):
+    return '<row>' + ''.join(_xlsx_cell(value, strings, style) for value in values) + '</row>'
+
+
+def iter_route_sheet_xlsx(sheet, stops):
+    """ملف xlsx بورقة عمل واحدة (من اليمين لليسار، الصف الأول ثابت) تكتب داخل الـ zip على دفعات."""
+    output = _StreamBuffer()
+    strings = _SharedStrings()
+    zip_file = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+    worksheet = zip_file.open(_zip_info('xl/worksheets/sheet1.xml'), 'w', force_zip64=True)
+    worksheet.write((
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetViews><sheetView rightToLeft="1" workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+        '<cols>' + ''.join(
+            f'<col min="{index}" max="{index}" width="{width}" customWidth="1"/>'
+            for index, (_, width) in enumerate(ROUTE_COLUMNS, 1)
+        ) + '</cols><sheetData>'
+        + _xlsx_row([title for title, _ in ROUTE_COLUMNS], strings, _XLSX_HEADER_STYLE)
+    ).encode('utf-8'))
+    for batch in _batched(iter_route_rows(stops)):
+        worksheet.write(''.join(_xlsx_row(row, strings) for row in batch).encode('utf-8'))
+        yield output.drain()
+    worksheet.write(b'</sheetData></worksheet>')
+    worksheet.close()
+    zip_file.writestr(_zip_info('[Content_Types].xml'), _XLSX_CONTENT_TYPES)
+    zip_file.writestr(_zip_info('_rels/.rels'), _XLSX_ROOT_RELS)
+    zip_file.writestr(_zip_info('xl/workbook.xml'), _xlsx_workbook('خط السير'))
+    zip_file.writestr(_zip_info('xl/_rels/workbook.xml.rels'), _XLSX_WORKBOOK_RELS)
+    zip_file.writestr(_zip_info('xl/styles.xml'), _XLSX_STYLES)
+    zip_file.writestr(_zip_info('xl/sharedStrings.xml'), strings.xml())
+    zip_file.close()
+    yield output.drain()
+
+
+# =======================================
+# PDF: جدول بصفوف ثابتة في كل صفحة (A4 بالعرض، بالـ twip)، المنطقة والعنوان يكتبان أول مرة فقط
+# =======================================
+ROUTE_PAGE_SIZE = (16838, 11906)
+ROUTE_PAGE_MARGINS = (360, 360)
+ROUTE_ROWS_PER_PAGE = 24
+ROUTE_DATA_SIZE = 10
+
+# (اسم الحقل، عنوان العمود، العرض، في المنتصف) من اليمين إلى اليسار؛ عمود "تم" فارغ يعلم عليه المحصل
+ROUTE_PDF_COLUMNS = (
+    ('stop', "م", 700, True),
+    ('area', "المنطقة", 1900, False),
+    ('address', "العنوان", 4000, False),
+    ('number', "رقم الوصل", 1100, True),
+    ('name', "العميل", 3000, False),
+    ('phone', "الهاتف", 1700, True),
+    ('due', "الاستحقاق", 1400, True),
+    ('amount', "المبلغ", 1100, True),
+    ('done', "تم", 1200, True),
+)
+
+
+def _route_layout():
+    layout = [
+        (0, 1, 0, 3, "كشف خط سير المحصل: {collector}", 14, 'bold', False),
+        (0, 1, 3, 3, "شهر الاستحقاق: {month}", 14, 'bold', True),
+        (0, 1, 6, 3, "{branch} - صفحة {page}", 12, 'regular', True),
+    ]
+    layout.extend((1, 1, index, 1, title, 11, 'bold', True) for index, (_, title, _, _) in enumerate(ROUTE_PDF_COLUMNS))
+    for row in range(ROUTE_ROWS_PER_PAGE):
+        layout.extend(
+            (row + 2, 1, index, 1, "" if field == 'done' else "{%s%d}" % (field, row), ROUTE_DATA_SIZE, 'regular', center)
+            for index, (field, _, _, center) in enumerate(ROUTE_PDF_COLUMNS)
+        )
+    return compile_layout(
+        layout, column_widths=tuple(width for _, _, width, _ in ROUTE_PDF_COLUMNS),
+        row_heights=(640, 480) + (400,) * ROUTE_ROWS_PER_PAGE,
+        page_size=ROUTE_PAGE_SIZE, margins=ROUTE_PAGE_MARGINS,
+    )
+
+
+ROUTE_CELLS = _route_layout()
+
+
+def _stop_cells(stop):
+    return {'stop': format_value(stop.number), 'area': stop.area or "بدون منطقة", 'address': stop.address}
+
+
+def _total_line(label, amount):
+    return {'name': label, 'amount': format_value(amount)}, None
+
+
+def iter_route_pdf_lines(stops):
+    """
+    (سطر الجدول {اسم الحقل: النص}، المحطة أو None): سطر لكل قسط، وسطر إجمالي بعد كل منطقة وفي نهاية الكشف.
+    رقم المحطة والعنوان في أول سطر من المحطة فقط، والمنطقة في أول سطر منها فقط.
+    """
+    area, area_stops, area_amount = None, 0, 0
+    total_stops, total_installments, total_amount = 0, 0, 0
+    for stop in stops:
+        new_area = stop.area != area or not area_stops
+        if new_area and area_stops:
+            yield _total_line(f"إجمالي المنطقة ({format_value(area_stops)} محطة)", area_amount)
+            area_stops, area_amount = 0, 0
+        area = stop.area
+        for index, installment in enumerate(stop.installments):
+            line = {
+                'number': format_value(installment.receipt_number), 'name': installment.customer_name,
+                'phone': format_value(installment.phone_number), 'due': format_value(installment.payment_date),
+                'amount': format_value(installment.amount),
+            }
+            if index == 0:
+                cells = _stop_cells(stop)
+                if not new_area:
+                    del cells['area']
+                line.update(cells)
+            yield line, stop
+            area_amount += installment.amount
+        area_stops += 1
+        total_stops += 1
+        total_installments += len(stop.installments)
+        total_amount += sum(installment.amount for installment in stop.installments)
+    if area_stops:
+        yield _total_line(f"إجمالي المنطقة ({format_value(area_stops)} محطة)", area_amount)
+        yield _total_line(
+            f"الإجمالي: {format_value(total_stops)} محطة، {format_value(total_installments)} قسط", total_amount,
+        )
+
+
+def iter_route_pdf_contexts(sheet, stops):
+    """
+    بيانات صفحات الـ PDF: ROUTE_ROWS_PER_PAGE سطر في كل صفحة (الحقول {اسم الحقل}{رقم السطر}).
+    أول سطر في الصفحة يكرر المحطة والمنطقة والعنوان إذا كانت المحطة بدأت في الصفحة السابقة.
+    """
+    header = {
+        'collector': sheet.collector.name, 'branch': sheet.branch.name,
+        'month': format_value(f"{sheet.month:02d}/{sheet.year}"),
+    }
+    for page, lines in enumerate(_batched(iter_route_pdf_lines(stops), ROUTE_ROWS_PER_PAGE), 1):
+        context = {**header, 'page': format_value(page)}
+        for row, (line, stop) in enumerate(lines):
+            if row == 0 and stop is not None:
+                line = {**_stop_cells(stop), **line}
+            context.update((f"{field}{row}", value) for field, value in line.items())
+        yield context
+
+
+def iter_route_sheet_pdf(sheet, stops):
+    # get_pdf_fonts يتم استدعاؤها هنا مباشرة (وليس عند أول صفحة) حتى يظهر خطأ الخطوط قبل إرسال الملف
+    return iter_print_pdf(iter_route_pdf_contexts(sheet, stops), cells=ROUTE_CELLS, page_size=ROUTE_PAGE_SIZE)
+
+
+# (نوع الملف، الدالة) لكل صيغة
+ROUTE_SHEET_FORMATS = {
+    'pdf': (PDF_CONTENT_TYPE, iter_route_sheet_pdf),
+    'csv': (CSV_CONTENT_TYPE, iter_route_sheet_csv),
+    'xlsx': (XLSX_CONTENT_TYPE, iter_route_sheet_xlsx),
+}
+
+
+def iter_route_sheet(sheet, output_format, chunk_size=ROUTE_SHEET_CHUNK_SIZE):
+    """
+    (نوع الملف، الملف كسلسلة bytes) لكشف sheet بصيغة output_format (ROUTE_SHEET_FORMATS).
+    الاستعلام ينفذ مع أول دفعة. يرفع PdfPrintError لصيغة pdf إذا لم تكن الخطوط متاحة.
+    """
+    content_type, render = ROUTE_SHEET_FORMATS[output_format]
+    return content_type, render(sheet, iter_sheet_stops(sheet, chunk_size))
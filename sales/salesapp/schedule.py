@@ -0,0 +1,115 @@
+# salesapp/schedule.py
+"""
+محرك جدول الأقساط الموحد: تحليل نص نظام القسط (مثل '12*250 + 1*130') وتوليد تواريخ ومبالغ الأقساط.
+كل أجزاء النظام (شاشة الإضافة، الإدخال الجماعي، الاستيراد من CSV وتوليد بيانات الاختبار) تستخدم هذا الملف.
+
+الصيغة: أجزاء مفصولة بـ '+'، كل جزء 'عدد*مبلغ' أو 'مبلغ*عدد' أو مبلغ وحده (قسط واحد).
+في 'a*b' الرقم الأصغر من 20 هو عدد الشهور إذا كان الآخر 20 أو أكثر، وإلا فالأول هو العدد.
+أول قسط يوم 15 من الشهر التالي لشهر البيع، ثم قسط كل شهر. الأقساط بمبلغ صفر لا يتم إنشاؤها.
+
+الأنظمة المتكررة (أغلب الوصلات تستخدم نفس النصوص) والتواريخ لكل (شهر بيع، عدد أقساط) محفوظة في lru_cache،
+فتوليد أقساط آلاف الوصلات لا يحلل النص أو ينشئ تواريخ جديدة لكل وصل.
+"""
+import calendar
+import re
+from datetime import date
+from functools import lru_cache
+
+DUE_DAY = 15
+# 'a*b': الرقم الأصغر من هذا الحد هو عدد الشهور
+MAX_MONTHS_HINT = 20
+
+# حد لعدد الأقساط في نظام واحد (نص مثل '999999*20' كان ينشئ مليون قسط)
+MAX_INSTALLMENTS = 1200
+
+PARSE_CACHE_SIZE = 4096
+DATES_CACHE_SIZE = 4096
+
+_PART_SEPARATOR = re.compile(r"\+")
+
+
+class InstallmentSystemError(ValueError):
+    pass
+
+
+def _parse_part(part):
+    text = part.strip()
+    if not text:
+        raise ValueError("يوجد جزء فارغ (علامة + زائدة؟)")
+    pieces = text.split("*")
+    if len(pieces) < 2:
+        if not pieces[0].isdigit():
+            raise ValueError(f"الصيغة '{part}' خاطئة.")
+        return 1, int(pieces[0])
+    first, second = pieces[0].strip(), pieces[1].strip()
+    if not first.isdigit() or not second.isdigit():
+        raise ValueError(f"الأرقام غير صحيحة في '{part}'.")
+    first, second = int(first), int(second)
+    if second < MAX_MONTHS_HINT <= first:
+        return second, first
+    return first, second
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(text):
+    try:
+        parts = [_parse_part(part) for part in _PART_SEPARATOR.split(text)]
+        if sum(count for count, _ in parts) > MAX_INSTALLMENTS:
+            raise ValueError(f"عدد الأقساط أكبر من {MAX_INSTALLMENTS}.")
+        return tuple(amount for count, amount in parts for _ in range(count))
+    except ValueError as e:
+        return f"خطأ في تحليل نظام القسط: {e}"
+
+
+def parse_installment_system(text):
+    """يرجع tuple بمبالغ الأقساط بالترتيب، أو يرفع InstallmentSystemError. النص الفارغ = بدون أقساط."""
+    if not text:
+        return ()
+    result = _parse(text.strip())
+    if isinstance(result, str):
+        raise InstallmentSystemError(result)
+    return result
+
+
+def parse_installment_string(ps_string):
+    """الواجهة القديمة: list بالمبالغ أو نص رسالة الخطأ."""
+    try:
+        return list(parse_installment_system(ps_string))
+    except InstallmentSystemError as e:
+        return str(e)
+
+
+@lru_cache(maxsize=DATES_CACHE_SIZE)
+def due_dates(sale_year, sale_month, count, day=DUE_DAY):
+    """
+    tuple بتواريخ count قسط شهري تبدأ من الشهر التالي لشهر البيع (بحساب رقم الشهر بدون relativedelta).
+    اليوم الأكبر من أيام الشهر يصبح آخر يوم فيه.
+    """
+    if not 1 <= sale_month <= 12:
+        raise ValueError("month must be in 1..12")
+    first_index = sale_year * 12 + sale_month  # رقم الشهر التالي (الشهور من 0)
+    dates = []
+    for month_index in range(first_index, first_index + count):
+        year, month = divmod(month_index, 12)
+        month += 1
+        dates.append(date(year, month, day if day <= 28 else min(day, calendar.monthrange(year, month)[1])))
+    return tuple(dates)
+
+
+def installment_schedule(sale_year, sale_month, amounts):
+    """[(تاريخ الاستحقاق, المبلغ)] لأقساط وصل واحد (amounts: قائمة المبالغ أو نص نظام القسط)."""
+    if isinstance(amounts, str):
+        amounts = parse_installment_system(amounts)
+    return [(due, amount) for due, amount in zip(due_dates(sale_year, sale_month, len(amounts)), amounts) if amount > 0]
+
+
+def expand_schedules(receipts):
+    """
+    توليد أقساط عدة وصلات مرة واحدة.
+    receipts: [(مفتاح الوصل, سنة البيع, شهر البيع, المبالغ أو نص نظام القسط)].
+    يرجع [(مفتاح الوصل, تاريخ الاستحقاق, المبلغ)] بنفس ترتيب الوصلات. يرفع InstallmentSystemError للنص غير الصحيح.
+    """
+    rows = []
+    for key, sale_year, sale_month, amounts in receipts:
+        rows.extend((key, due, amount) for due, amount in installment_schedule(sale_year, sale_month, amounts))
+    return rows
@@ -0,0 +1,122 @@
+# salesapp/search_index.py
+"""
+فهرس بحث العملاء: جدول FTS5 (trigram) على SQLite يحتوي الاسم والهاتف والعنوان والمنطقة لكل وصل
+بعد توحيد الكتابة العربية (normalize_arabic)، حتى يكون البحث بجزء من الاسم بدون مسح كل الوصلات.
+يتم تحديثه عند حفظ الوصل (post_save)، والإضافة الجماعية (bulk_create) تحتاج rebuild_search_index.
+لا يوجد post_delete حتى لا يفقد حذف الوصلات الجماعي مسار الحذف السريع؛ صفوف الوصلات المحذوفة
+لا تظهر في النتائج لأن البحث يتم داخل فلتر Receipt، ويتم مسحها مع إعادة البناء.
+على قواعد البيانات الأخرى يتم الرجوع لـ icontains.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Receipt
+from .utils import normalize_arabic
+
+SEARCH_TABLE = 'salesapp_receiptsearch'
+SEARCH_COLUMNS = ('customer_name', 'phone_number', 'address', 'area')
+
+# trigram لا يفهرس أقل من 3 حروف؛ الكلمات الأقصر يتم البحث عنها بـ icontains (مسح بنفس تكلفة البحث القديم)
+MIN_TRIGRAM_LENGTH = 3
+
+REBUILD_CHUNK_SIZE = 5000
+
+
+def search_index_available(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_table(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            f"USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='trigram')"
+        )
+
+
+def drop_search_table(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def _index_rows(cursor, rows):
+    """rows: (receipt_id, customer_name, phone_number, address, area)."""
+    placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 1))
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES ({placeholders})",
+        [(row[0], *(normalize_arabic(value) for value in row[1:])) for row in rows],
+    )
+
+
+def index_receipts(receipts, using=DEFAULT_DB_ALIAS):
+    if not search_index_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        _index_rows(cursor, [
+            (receipt.pk, *(getattr(receipt, column) for column in SEARCH_COLUMNS)) for receipt in receipts
+        ])
+
+
+def rebuild_search_index(receipt_model=None, using=DEFAULT_DB_ALIAS):
+    """يعيد بناء الفهرس بالكامل. receipt_model من apps.get_model عند الاستدعاء من migration. يرجع عدد الوصلات."""
+    if not search_index_available(using):
+        return 0
+    receipt_model = receipt_model or Receipt
+    rows = receipt_model.objects.using(using).order_by('pk').values_list('pk', *SEARCH_COLUMNS)
+    count = 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        chunk = []
+        for row in rows.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) >= REBUILD_CHUNK_SIZE:
+                _index_rows(cursor, chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            _index_rows(cursor, chunk)
+            count += len(chunk)
+    return count
+
+
+def _quote_match_term(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def receipt_search_q(text, columns=SEARCH_COLUMNS, receipt_path='', using=DEFAULT_DB_ALIAS):
+    """
+    Q يطابق الوصلات التي تحتوي كل كلمات text في أي من columns
+    (الكلمات من 3 حروف فأكثر من الفهرس بعد التوحيد، والأقصر منها بـ icontains).
+    receipt_path: مسار الوصل من الموديل المطلوب فلترته (مثلاً 'receipt__' للأقساط).
+    """
+    terms = normalize_arabic(text).split()
+    if not terms:
+        return Q()
+
+    indexed = search_index_available(using)
+    long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH] if indexed else []
+    # الكلمات القصيرة (أو عدم وجود الفهرس): icontains على أعمدة الوصل مثل البحث القديم
+    short_terms = [term for term in text.split() if len(normalize_arabic(term)) < MIN_TRIGRAM_LENGTH] if indexed else text.split()
+
+    condition = Q()
+    for term in short_terms:
+        term_condition = Q()
+        for column in columns:
+            term_condition |= Q(**{f'{receipt_path}{column}__icontains': term})
+        condition &= term_condition
+    if not long_terms:
+        return condition
+
+    column_filter = '{' + ' '.join(columns) + '}'
+    match = ' AND '.join(f"{column_filter} : {_quote_match_term(term)}" for term in long_terms)
+    sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+    return condition & Q(**{f'{receipt_path}id__in': RawSQL(sql, [match])})
+
+
+@receiver(post_save, sender=Receipt, dispatch_uid='salesapp_index_receipt')
+def _index_saved_receipt(sender, instance, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if not raw:
+        index_receipts([instance], using=using)
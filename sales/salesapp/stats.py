@@ -0,0 +1,169 @@
+# salesapp/stats.py
+"""
+صيانة جدول BranchMonthStats (ملخصات الداشبورد).
+كل تغيير على الوصلات أو الأقساط يتحول إلى فروقات (deltas) تضاف على الصفوف بتحديث ذري بـ F()،
+ويجب استدعاء هذه الدوال داخل نفس الـ transaction الذي يعدل البيانات.
+التعديلات التي تتم خارج هذه الدوال (مثل لوحة الإدارة أو أوامر الاستيراد) تحتاج rebuild_branch_stats.
+نفس الدوال تلغي الأعداد وقوائم الفلاتر المحفوظة في الكاش (pagination و filter_options).
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import BranchMonthStats, InstallmentPayment, Receipt
+from .filter_options import invalidate_filter_options
+from .pagination import invalidate_cached_counts
+
+STAT_FIELDS = (
+    'sales_count', 'sales_total', 'down_payments',
+    'collected_count', 'collected_total', 'unpaid_count', 'unpaid_total',
+)
+
+# الحقول المطلوبة من القسط لحساب مساهمته في الملخصات
+INSTALLMENT_STATE_FIELDS = ('id', 'amount', 'is_paid', 'payment_date', 'collector_id', 'receipt__branch_id')
+
+
+def _new_deltas():
+    return defaultdict(lambda: defaultdict(int))
+
+
+def add_receipt_deltas(deltas, receipt, sign=1):
+    row = deltas[(receipt.branch_id, receipt.sale_year, receipt.sale_month, receipt.salesperson_id)]
+    row['sales_count'] += sign
+    row['sales_total'] += sign * receipt.total_amount
+    row['down_payments'] += sign * receipt.down_payment
+
+
+def add_installment_deltas(deltas, branch_id, state, sign=1):
+    """state: dict فيه amount, is_paid, payment_date, collector_id."""
+    payment_date = state['payment_date']
+    collector_id = state['collector_id']
+    if state['is_paid']:
+        # الداشبورد تعرض التحصيل لكل محصل فقط، القسط المدفوع بدون محصل لا يظهر فيها
+        if collector_id is None:
+            return
+        row = deltas[(branch_id, payment_date.year, payment_date.month, collector_id)]
+        row['collected_count'] += sign
+        row['collected_total'] += sign * state['amount']
+    else:
+        row = deltas[(branch_id, payment_date.year, payment_date.month, collector_id)]
+        row['unpaid_count'] += sign
+        row['unpaid_total'] += sign * state['amount']
+
+
+def apply_deltas(deltas):
+    # أعداد صفحات البحث والأقساط (cached_count) لم تعد صحيحة بعد أي تعديل
+    transaction.on_commit(invalidate_cached_counts)
+    for (branch_id, year, month, salesperson_id), values in deltas.items():
+        values = {field: value for field, value in values.items() if value}
+        if not values:
+            continue
+        rows = BranchMonthStats.objects.filter(branch_id=branch_id, year=year, month=month, salesperson_id=salesperson_id)
+        if rows.update(**{field: F(field) + value for field, value in values.items()}):
+            continue
+        try:
+            with transaction.atomic():
+                BranchMonthStats.objects.create(
+                    branch_id=branch_id, year=year, month=month, salesperson_id=salesperson_id, **values
+                )
+        except IntegrityError:
+            # تم إنشاء الصف من طلب آخر في نفس اللحظة
+            rows.update(**{field: F(field) + value for field, value in values.items()})
+
+
+def record_new_receipt(receipt, installments=()):
+    """يضيف وصلاً جديداً وأقساطه إلى الملخصات."""
+    record_new_receipts([(receipt, [
+        {'amount': inst.amount, 'is_paid': inst.is_paid, 'payment_date': inst.payment_date, 'collector_id': inst.collector_id}
+        for inst in installments
+    ])])
+
+
+def record_new_receipts(entries):
+    """
+    يضيف عدة وصلات جديدة إلى الملخصات بتحديث واحد لكل صف ملخص.
+    entries: [(receipt, [dict فيه amount, is_paid, payment_date, collector_id لكل قسط])].
+    """
+    deltas = _new_deltas()
+    branch_ids = set()
+    for receipt, installment_states in entries:
+        add_receipt_deltas(deltas, receipt)
+        for state in installment_states:
+            add_installment_deltas(deltas, receipt.branch_id, state)
+        branch_ids.add(receipt.branch_id)
+    apply_deltas(deltas)
+    # منطقة أو شهر جديد قد يظهر في قوائم فلاتر صفحة الأقساط
+    for branch_id in branch_ids:
+        transaction.on_commit(lambda branch_id=branch_id: invalidate_filter_options(branch_id))
+
+
+def update_installments(queryset, **changes):
+    """
+    بديل queryset.update() للأقساط يحدّث الملخصات معها.
+    changes يدعم is_paid و collector/collector_id. يرجع عدد الأقساط المعدلة.
+    """
+    if 'collector' in changes:
+        collector = changes.pop('collector')
+        changes['collector_id'] = collector.pk if collector is not None else None
+
+    with transaction.atomic():
+        old_states = list(queryset.select_for_update().values(*INSTALLMENT_STATE_FIELDS))
+        if not old_states:
+            return 0
+        count = InstallmentPayment.objects.filter(pk__in=[state['id'] for state in old_states]).update(**changes)
+
+        deltas = _new_deltas()
+        for state in old_states:
+            branch_id = state['receipt__branch_id']
+            add_installment_deltas(deltas, branch_id, state, sign=-1)
+            add_installment_deltas(deltas, branch_id, {**state, **changes})
+        apply_deltas(deltas)
+    return count
+
+
+def rebuild_branch_month_stats(branch=None, models=None):
+    """
+    يعيد حساب الملخصات بالكامل (لفرع واحد أو لكل الفروع). يرجع عدد الصفوف المنشأة.
+    models: (Receipt, InstallmentPayment, BranchMonthStats) من apps.get_model عند الاستدعاء من migration.
+    """
+    receipt_model, installment_model, stats_model = models or (Receipt, InstallmentPayment, BranchMonthStats)
+    receipts = receipt_model.objects.all()
+    installments = installment_model.objects.all()
+    stats = stats_model.objects.all()
+    if branch is not None:
+        receipts = receipts.filter(branch=branch)
+        installments = installments.filter(receipt__branch=branch)
+        stats = stats.filter(branch=branch)
+
+    rows = defaultdict(dict)
+    for row in receipts.order_by().values('branch_id', 'sale_year', 'sale_month', 'salesperson_id').annotate(
+        count=Count('id'), total=Sum('total_amount'), down=Sum('down_payment'),
+    ):
+        rows[(row['branch_id'], row['sale_year'], row['sale_month'], row['salesperson_id'])].update(
+            sales_count=row['count'], sales_total=row['total'] or 0, down_payments=row['down'] or 0,
+        )
+
+    grouped_installments = installments.order_by().annotate(
+        year=ExtractYear('payment_date'), month=ExtractMonth('payment_date'),
+    ).values('receipt__branch_id', 'year', 'month', 'collector_id')
+    for row in grouped_installments.filter(is_paid=True, collector__isnull=False).annotate(count=Count('id'), total=Sum('amount')):
+        rows[(row['receipt__branch_id'], row['year'], row['month'], row['collector_id'])].update(
+            collected_count=row['count'], collected_total=row['total'] or 0,
+        )
+    for row in grouped_installments.filter(is_paid=False).annotate(count=Count('id'), total=Sum('amount')):
+        rows[(row['receipt__branch_id'], row['year'], row['month'], row['collector_id'])].update(
+            unpaid_count=row['count'], unpaid_total=row['total'] or 0,
+        )
+
+    with transaction.atomic():
+        stats.delete()
+        stats_model.objects.bulk_create([
+            stats_model(branch_id=branch_id, year=year, month=month, salesperson_id=salesperson_id, **values)
+            for (branch_id, year, month, salesperson_id), values in rows.items()
+        ], batch_size=500)
+        if models is None:
+            transaction.on_commit(invalidate_cached_counts)
+            transaction.on_commit(lambda: invalidate_filter_options(branch.pk if branch else None))
+    return len(rows)
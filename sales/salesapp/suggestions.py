@@ -0,0 +1,119 @@
+# salesapp/suggestions.py
+"""
+اقتراحات البحث أثناء الكتابة (JSON): أفضل N وصل/عميل لجزء من الاسم أو الهاتف أو رقم الوصل.
+الاستعلام محدود (LIMIT) ويستخدم فهرس البحث، والنتائج الأخيرة محفوظة في LRU داخل العملية.
+كل طلب يحمل رقم تسلسل (seq) من المتصفح؛ الطلب الأقدم من آخر seq وصل من نفس الجلسة لا يتم تنفيذه (آخر طلب يفوز).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Case, Count, Q, When
+
+from .models import Receipt
+from .pagination import current_generation
+from .search_index import receipt_search_q
+
+MIN_QUERY_LENGTH = 2
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+
+
+class LRUCache:
+    """LRU بسيط آمن للـ threads، مع مدة صلاحية لكل عنصر."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_results = LRUCache(
+    getattr(settings, 'SALES_SUGGEST_CACHE_SIZE', 512), ttl=getattr(settings, 'SALES_SUGGEST_CACHE_SECONDS', 60),
+)
+# آخر seq لكل جلسة (لإلغاء الطلبات القديمة التي ما زالت في الطابور)
+_latest_seq = LRUCache(getattr(settings, 'SALES_SUGGEST_CACHE_SIZE', 512))
+_latest_seq_lock = threading.Lock()
+
+
+def is_superseded(session_key, seq):
+    """يسجل seq كآخر طلب للجلسة، ويرجع True إذا كان هناك طلب أحدث منه بالفعل."""
+    if not session_key or seq is None:
+        return False
+    with _latest_seq_lock:
+        latest = _latest_seq.get(session_key)
+        if latest is not None and latest > seq:
+            return True
+        _latest_seq.set(session_key, seq)
+        return False
+
+
+def _find(branch, text, limit):
+    receipts = Receipt.objects.filter(branch=branch)
+    condition = receipt_search_q(text)
+    ordering = ['-receipt_number']
+    if text.isdigit():
+        # رقم الوصل المطابق تماماً يظهر أولاً (قبل الوصلات التي يحتوي هاتفها على نفس الأرقام)
+        condition |= Q(receipt_number=int(text))
+        receipts = receipts.annotate(exact_number=Case(When(receipt_number=int(text), then=0), default=1))
+        ordering.insert(0, 'exact_number')
+    matches = receipts.filter(condition)
+
+    receipt_rows = list(
+        matches.order_by(*ordering)
+        .values('id', 'receipt_number', 'customer_name', 'phone_number', 'area',
+                'sale_year', 'sale_month', 'salesperson__name')[:limit]
+    )
+    customer_rows = list(
+        matches.exclude(customer_name='')
+        .values('customer_name', 'phone_number', 'area')
+        .annotate(receipts_count=Count('id'))
+        .order_by('-receipts_count', 'customer_name')[:limit]
+    )
+    return {'receipts': receipt_rows, 'customers': customer_rows}
+
+
+def suggest(branch, text, limit=DEFAULT_LIMIT):
+    """يرجع (النتائج، هل من الكاش)."""
+    text = ' '.join((text or '').split())
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    if len(text) < MIN_QUERY_LENGTH:
+        return {'receipts': [], 'customers': []}, False
+
+    # current_generation يتغير مع أي وصل جديد، فتصبح النتائج القديمة غير مستخدمة تلقائياً
+    key = (branch.pk, text, limit, current_generation())
+    result = _results.get(key)
+    if result is not None:
+        return result, True
+    result = _find(branch, text, limit)
+    _results.set(key, result)
+    return result, False
@@ -1,3 +1,1849 @@
-from django.test import TestCase
+import codecs
+import csv
+import functools
+import importlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import zipfile
+import zlib
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+from dateutil.relativedelta import relativedelta
+from docx import Document
+from num2words import num2words
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .benchmarks import seed_dataset, run_benchmarks, compare_with_baseline
+from .formatting import amount_to_words_ar, ed2ad, format_fields, format_value
+from .ingestion import _save_batch, ingest_receipts
+from .inventory import InsufficientStockError, apply_stock_changes, reserve_stock
+from .management.commands.create_fromapp import BulkReceiptImporter, parse_rows
+from .management.commands.populate_data import Command as PopulateDataCommand
+from .pdf_printing import (
+    PdfPrintError, get_pdf_fonts, iter_print_pdf, iter_print_pdf_receipts, missing_pdf_requirements, pack_pdf_pages,
+    render_pdf_pages, unpack_pdf_pages,
+)
+from .models import (
+    Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment, ReceiptNumberSequence, PrintJob,
+    BranchMonthStats,
+)
+from .pagination import CURSOR_SEPARATOR, KeysetPaginator, cached_count
+from .print_cache import PrintCache, get_print_cache, receipt_cache_key
+from .print_jobs import claim_next_job, requeue_stale_jobs, run_print_job
+from .schedule import (
+    parse_installment_string, parse_installment_system, installment_schedule, expand_schedules, due_dates,
+    InstallmentSystemError, MAX_INSTALLMENTS, _parse,
+)
+from .printing import (
+    CompiledInvoiceTemplate, INVOICE_PLACEHOLDERS, INVOICE_TEMPLATE_PATH, InvoiceTemplateError, _render_chunk_body,
+    docx_cache_version, get_invoice_template, iter_batch_page_contexts, iter_composed_docx, iter_composed_docx_parallel,
+    iter_installment_page_fields, iter_print_docx, iter_receipt_page_contexts, receipt_page_fields,
+)
+from .route_sheets import (
+    ROUTE_COLUMNS, RouteSheet, iter_route_pdf_contexts, iter_route_pdf_lines, iter_route_sheet, iter_sheet_stops,
+)
+from .search_index import SEARCH_TABLE, rebuild_search_index, receipt_search_q
+from .stats import STAT_FIELDS, rebuild_branch_month_stats
+from .suggestions import LRUCache, is_superseded, _results as suggestions_results
+from .utils import get_paydL, normalize_arabic
+from .views import printable_receipts
+
+
+# =======================================
+# أدوات حد الاستعلامات (query budget)
+# =======================================
+def _format_queries(queries):
+    return '\n'.join(f"{number}. {query['sql']}" for number, query in enumerate(queries, 1))
+
+
+class QueryBudgetMixin:
+    """تأكيدات تفشل إذا تجاوزت الشاشة عدداً محدداً من الاستعلامات أو زاد عددها مع حجم النتائج (N+1)."""
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return queries
+
+    def assertQueryBudget(self, budget, func):
+        queries = self.count_queries(func)
+        if len(queries) > budget:
+            self.fail(f"{len(queries)} queries > budget {budget}:\n{_format_queries(queries)}")
+        return queries
+
+    def assertQueriesDoNotScale(self, func, grow):
+        """ينفذ func، ثم يزيد البيانات بـ grow()، ثم ينفذها مرة أخرى: عدد الاستعلامات يجب أن يبقى كما هو."""
+        before = self.count_queries(func)
+        grow()
+        after = self.count_queries(func)
+        if len(after) != len(before):
+            self.fail(
+                f"query count scales with result size: {len(before)} -> {len(after)}\n"
+                f"{_format_queries(after)}"
+            )
+
+
+def query_budget(budget):
+    """decorator لاختبارات QueryBudgetMixin: كل الاختبار (بدون setUp) يجب ألا يتجاوز budget استعلام."""
+    def decorator(test_method):
+        @functools.wraps(test_method)
+        def wrapper(self, *args, **kwargs):
+            self.assertQueryBudget(budget, lambda: test_method(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def _get_ok(test, url, params=None):
+    def request():
+        response = test.client.get(url, params or {})
+        test.assertEqual(response.status_code, 200)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return request
+
+
+class BenchmarkHarnessTests(TestCase):
+    """تشغيل أداة قياس الأداء على بيانات صغيرة للتأكد أن كل الحالات تعمل."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(branches=1, salespersons=2, products=5, receipts=40)
+
+    def test_all_cases_are_measured(self):
+        results = run_benchmarks(repeat=1, only='')
+        self.assertIn('dashboard', results)
+        self.assertIn('search_receipts[none]', results)
+        self.assertIn('manage_installments[confirmation]', results)
+        self.assertIn('print_batch_receipts', results)
+        self.assertIn('add_receipt[POST]', results)
+        self.assertEqual(len([name for name in results if name.startswith('search_receipts[')]), 64)
+        # تنسيق صفحات الطباعة وحده: بدون استعلامات، مع الزمن لكل صفحة
+        self.assertEqual(results['print_page_contexts']['queries'], 0)
+        self.assertGreater(results['print_page_contexts']['pages'], 0)
+        for name, result in results.items():
+            if name != 'print_page_contexts':
+                self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_kb'], 0)
+
+    def test_compare_with_baseline_flags_query_increase(self):
+        baseline = {'results': {'dashboard': {'wall_ms': 10, 'queries': 5, 'peak_kb': 100}}}
+        same = {'dashboard': {'wall_ms': 12, 'queries': 5, 'peak_kb': 110}}
+        worse = {'dashboard': {'wall_ms': 30, 'queries': 6, 'peak_kb': 100}}
+        self.assertEqual(compare_with_baseline(same, baseline, tolerance=0.5), [])
+        self.assertEqual(len(compare_with_baseline(worse, baseline, tolerance=0.5)), 2)
+        self.assertEqual(compare_with_baseline(worse, None), [])
+
+
+class BranchDataTestCase(TestCase):
+    """فرع بأصناف مخزن، والجلسة مفتوحة عليه، مع أداة لإضافة وصلات تقسيط."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='فرع الاختبار')
+        cls.products = [
+            InventoryItem.objects.create(name=f'صنف {number}', quantity=100, branch=cls.branch)
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        # الأعداد وقوائم الفلاتر المحفوظة من اختبار سابق لا تؤثر على هذا الاختبار
+        for cache in caches.all():
+            cache.clear()
+        self.client.get(reverse('set_branch', args=[self.branch.id]))
+
+    def add_receipts(self, count, items=1):
+        numbers = ReceiptNumberSequence.allocate(count)
+        for number in numbers:
+            # مندوب مختلف لكل وصل حتى لا يخفي التكرار مشكلة N+1
+            salesperson = Salesperson.objects.create(name=f'مندوب {number}', branch=self.branch)
+            receipt = Receipt.objects.create(
+                receipt_number=number, customer_name=f'عميل {number}', salesperson=salesperson,
+                branch=self.branch, sale_year=2025, sale_month=1, total_amount=1000,
+                down_payment=100, installment_system='300*3',
+            )
+            for product in self.products[:items]:
+                SaleItem.objects.create(receipt=receipt, inventory_item=product, quantity=1, unit_price=300)
+            for month in range(1, 4):
+                InstallmentPayment.objects.create(receipt=receipt, payment_date=date(2025, month + 1, 1), amount=300)
+        return receipt
+
+
+# الأعداد الكلية تحسب في كل طلب (بدون كاش) حتى تكون المقارنة بين الطلبين بنفس الاستعلامات
+@override_settings(SALES_PRINT_CACHE_MAX_BYTES=0, SALES_COUNT_CACHE_SECONDS=0)
+class ReceiptViewsQueryTests(QueryBudgetMixin, BranchDataTestCase):
+    """الشاشات التي تعرض الوصلات يجب أن تجلب البيانات المرتبطة بعدد ثابت من الاستعلامات."""
+
+    def test_search_receipts_does_not_scale(self):
+        self.add_receipts(2)
+        self.assertQueriesDoNotScale(_get_ok(self, reverse('search_receipts')), lambda: self.add_receipts(10))
+
+    def test_print_batch_receipts_does_not_scale(self):
+        self.add_receipts(2)
+        self.assertQueriesDoNotScale(_get_ok(self, reverse('print_batch_receipts')), lambda: self.add_receipts(5))
+
+    def test_edit_receipt_does_not_scale_with_items(self):
+        one_item = self.add_receipts(1, items=1)
+        three_items = self.add_receipts(1, items=3)
+        before = self.count_queries(_get_ok(self, reverse('edit_receipt', args=[one_item.id])))
+        after = self.count_queries(_get_ok(self, reverse('edit_receipt', args=[three_items.id])))
+        self.assertEqual(len(before), len(after), _format_queries(after))
+
+    def test_print_receipt_budget(self):
+        receipt = self.add_receipts(1)
+        # الجلسة + الفرع + الوصل مع المندوب + الأقساط
+        self.assertQueryBudget(4, _get_ok(self, reverse('print_receipt', args=[receipt.id])))
+
+    def test_collector_route_sheet_budget(self):
+        collector = Salesperson.objects.create(name='محصل', branch=self.branch)
+
+        def assign(count):
+            self.add_receipts(count)
+            InstallmentPayment.objects.filter(receipt__branch=self.branch).update(collector=collector)
+
+        assign(2)
+        for output_format in ('csv', 'xlsx'):
+            request = _get_ok(self, reverse('collector_route_sheet'), {
+                'collector_id': collector.id, 'month': '2025-02', 'format': output_format,
+            })
+            # الجلسة + الفرع + المحصل + أقساط الكشف (استعلام واحد مهما كان عدد المحطات)
+            self.assertQueryBudget(4, request)
+            self.assertQueriesDoNotScale(request, lambda: assign(5))
+
+    @query_budget(8)
+    def test_search_receipts_page_budget(self):
+        _get_ok(self, reverse('search_receipts'), {'year': 2025})()
+
+
+# =======================================
+# خطط تنفيذ الاستعلامات الثقيلة (explain_hot_queries)
+# =======================================
+class HotQueryIndexTests(BranchDataTestCase):
+    """الشاشات الثقيلة تستخدم الـ indexes المركبة والجزئية (migration 0011) وليس مسحاً كاملاً للجداول."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_receipts(30)
+        InstallmentPayment.objects.filter(payment_date=date(2025, 2, 1)).update(is_paid=True)
+
+    def test_command_reports_app_indexes_as_used(self):
+        out = io.StringIO()
+        call_command('explain_hot_queries', '--branch', str(self.branch.id), '--analyze', stdout=out, no_color=True)
+        output = out.getvalue()
+        for name in ('receipt_branch_period_idx', 'receipt_branch_number_idx', 'inst_receipt_paid_due_idx', 'inst_unpaid_due_idx'):
+            self.assertIn(f"مستخدم: {name}", output)
+
+    def test_hot_query_plans(self):
+        queries = {
+            'receipt_branch_number_idx': Receipt.objects.filter(branch=self.branch).order_by('-receipt_number')[:25],
+            # قائمة السنوات والشهور في فلاتر البحث
+            'receipt_branch_period_idx': Receipt.objects.filter(branch=self.branch).values('sale_year', 'sale_month').distinct(),
+            'inst_unpaid_due_idx': InstallmentPayment.objects.filter(
+                is_paid=False, payment_date__range=(date(2025, 3, 1), date(2025, 3, 31)),
+            ),
+            # شهور الأقساط في فلاتر صفحة الأقساط
+            'inst_receipt_paid_due_idx': InstallmentPayment.objects.filter(receipt__branch=self.branch).dates('payment_date', 'month'),
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                self.assertIn(name, queryset.explain())
+
+
+# =======================================
+# قوائم فلاتر صفحة الأقساط (salesapp.filter_options)
+# =======================================
+class FilterOptionsTests(BranchDataTestCase):
+
+    def options(self):
+        return self.client.get(reverse('manage_installments')).context
+
+    def test_saved_receipt_appears_in_filter_options(self):
+        salesperson = Salesperson.objects.create(name='مندوب', branch=self.branch)
+        self.assertEqual(self.options()['available_areas'], [])
+        # القائمة محفوظة في الكاش: الشاشة لا تعيد حسابها
+        with CaptureQueriesContext(connection) as queries:
+            self.options()
+        self.assertFalse([query for query in queries if 'DISTINCT' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_receipt'), _receipt_form(salesperson, self.products[0], area='منطقة جديدة', sale_month=3))
+        context = self.options()
+        self.assertEqual(context['available_areas'], ['منطقة جديدة'])
+        self.assertEqual(context['available_sale_months'], ['2025-03'])
+        self.assertEqual(context['available_payment_months'], ['2025-06', '2025-05', '2025-04'])
+
+    def test_new_collector_appears_after_save(self):
+        self.assertEqual(list(self.options()['salespersons']), [])
+        self.client.post(reverse('manage_salespersons'), {'person_name': 'محصل جديد'})
+        self.assertEqual([person.name for person in self.options()['salespersons']], ['محصل جديد'])
+
+    def test_rebuild_invalidates_every_branch(self):
+        self.add_receipts(1)
+        self.assertEqual(self.options()['available_areas'], [])
+        Receipt.objects.update(area='منطقة مستوردة')
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_branch_month_stats()
+        self.assertEqual(self.options()['available_areas'], ['منطقة مستوردة'])
+
+
+# =======================================
+# فهرس بحث العملاء (salesapp.search_index)
+# =======================================
+class SearchIndexTests(BranchDataTestCase):
+
+    def create_receipt(self, customer_name, **fields):
+        return Receipt.objects.create(
+            receipt_number=ReceiptNumberSequence.allocate(1)[0], customer_name=customer_name, branch=self.branch,
+            sale_year=2025, sale_month=1, total_amount=100, is_cash_sale=True, **fields,
+        )
+
+    def search(self, text):
+        return set(Receipt.objects.filter(receipt_search_q(text)).values_list('customer_name', flat=True))
+
+    def test_normalize_arabic(self):
+        self.assertEqual(normalize_arabic('أحمد إبراهيم آمال'), 'احمد ابراهيم امال')
+        self.assertEqual(normalize_arabic('فاطمة'), normalize_arabic('فاطمه'))
+        self.assertEqual(normalize_arabic('مصطفى'), normalize_arabic('مصطفي'))
+        self.assertEqual(normalize_arabic(' مُحَمَّـــد  ٠١٢٣ '), 'محمد 0123')
+
+    def test_search_matches_spelling_variants(self):
+        self.create_receipt('أحمد إبراهيم', area='المنصورة')
+        self.create_receipt('فاطمة مصطفى', phone_number='٠١٠٥٥٥')
+        self.create_receipt('محمود علي')
+        self.assertEqual(self.search('احمد'), {'أحمد إبراهيم'})
+        self.assertEqual(self.search('ابراهيم المنصوره'), {'أحمد إبراهيم'})
+        self.assertEqual(self.search('فاطمه مصطفي'), {'فاطمة مصطفى'})
+        self.assertEqual(self.search('0105'), {'فاطمة مصطفى'})
+        self.assertEqual(self.search('احمد علي'), set())
+
+    def test_short_terms_fall_back_to_icontains(self):
+        self.create_receipt('محمود علي')
+        self.create_receipt('علاء حسن')
+        condition = receipt_search_q('عل')
+        self.assertNotIn(SEARCH_TABLE, str(Receipt.objects.filter(condition).query))
+        self.assertEqual(self.search('عل'), {'محمود علي', 'علاء حسن'})
+        # كلمة قصيرة مع كلمة من الفهرس: الاثنين معاً
+        self.assertIn(SEARCH_TABLE, str(Receipt.objects.filter(receipt_search_q('عل محمود')).query))
+        self.assertEqual(self.search('عل محمود'), {'محمود علي'})
+
+    def test_edited_receipt_is_reindexed(self):
+        receipt = self.create_receipt('سعيد منصور')
+        receipt.customer_name = 'خالد جمال'
+        receipt.save()
+        self.assertEqual(self.search('سعيد'), set())
+        self.assertEqual(self.search('جمال'), {'خالد جمال'})
+        # الإضافة الجماعية لا ترسل post_save، وإعادة البناء تضيفها للفهرس
+        Receipt.objects.bulk_create([Receipt(
+            receipt_number=ReceiptNumberSequence.allocate(1)[0], customer_name='يوسف صالح', branch=self.branch,
+            sale_year=2025, sale_month=1, total_amount=100, is_cash_sale=True,
+        )])
+        self.assertEqual(self.search('يوسف'), set())
+        rebuild_search_index()
+        self.assertEqual(self.search('يوسف'), {'يوسف صالح'})
+
+
+# =======================================
+# اقتراحات البحث أثناء الكتابة (salesapp.suggestions)
+# =======================================
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(2)
+        lru.set('a', 1); lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)  # a أصبح الأحدث استخداماً
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c'), len(lru)), (1, None, 3, 2))
+
+    def test_expired_items_are_dropped(self):
+        lru = LRUCache(2, ttl=10)
+        with mock.patch('salesapp.suggestions.time.monotonic', return_value=100):
+            lru.set('a', 1)
+        with mock.patch('salesapp.suggestions.time.monotonic', return_value=109):
+            self.assertEqual(lru.get('a'), 1)
+        with mock.patch('salesapp.suggestions.time.monotonic', return_value=111):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 0)
+
+    def test_is_superseded(self):
+        self.assertFalse(is_superseded('session-a', 1))
+        self.assertFalse(is_superseded('session-a', 3))
+        # طلب أقدم وصل بعد الأحدث: لا يتم تنفيذه، ولا يرجع آخر seq للخلف
+        self.assertTrue(is_superseded('session-a', 2))
+        self.assertFalse(is_superseded('session-a', 3))
+        self.assertFalse(is_superseded('session-a', 4))
+        self.assertTrue(is_superseded('session-a', 3))
+        # كل جلسة لها تسلسل منفصل، والطلب بدون seq أو بدون جلسة لا يلغى
+        self.assertFalse(is_superseded('session-b', 1))
+        self.assertFalse(is_superseded('session-a', None))
+        self.assertFalse(is_superseded(None, 1))
+
+
+class SearchSuggestionsTests(BranchDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        suggestions_results.clear()
+
+    def suggest(self, **params):
+        return self.client.get(reverse('search_suggestions'), params).json()
+
+    def test_results_are_cached_until_data_changes(self):
+        salesperson = Salesperson.objects.create(name='مندوب', branch=self.branch)
+        self.client.post(reverse('add_receipt'), _receipt_form(salesperson, self.products[0], customer_name='أحمد إبراهيم'))
+        first = self.suggest(q='احمد', seq=1)
+        self.assertEqual(([row['customer_name'] for row in first['receipts']], first['cached']), (['أحمد إبراهيم'], False))
+        self.assertTrue(self.suggest(q='احمد', seq=2)['cached'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_receipt'), _receipt_form(salesperson, self.products[1], customer_name='أحمد علي'))
+        second = self.suggest(q='احمد', seq=3)
+        self.assertFalse(second['cached'])
+        self.assertEqual(len(second['receipts']), 2)
+
+    def test_older_request_is_superseded(self):
+        self.assertFalse(self.suggest(q='احمد', seq=5)['superseded'])
+        stale = self.suggest(q='احم', seq=4)
+        self.assertEqual((stale['superseded'], stale['receipts']), (True, []))
+        self.assertFalse(self.suggest(q='احمد ع', seq=6)['superseded'])
+
+
+# =======================================
+# ترقيم الصفحات بالمؤشر (salesapp.pagination)
+# =======================================
+class KeysetPaginatorTests(BranchDataTestCase):
+
+    def walk(self, paginator):
+        """كل الصفحات من الأولى للأخيرة بالمؤشر التالي، ثم من الأخيرة للأولى بالمؤشر السابق."""
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous:
+            backwards.append(paginator.page(before=backwards[-1].previous_cursor))
+        return pages, backwards[::-1]
+
+    def test_next_and_previous_cursors(self):
+        self.add_receipts(7)
+        receipts = Receipt.objects.all()
+        pages, backwards = self.walk(KeysetPaginator(receipts, ('-receipt_number',), 3))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(
+            [receipt.receipt_number for page in pages for receipt in page],
+            list(receipts.order_by('-receipt_number').values_list('receipt_number', flat=True)),
+        )
+        self.assertEqual([page.object_list for page in backwards], [page.object_list for page in pages])
+        self.assertEqual((pages[0].has_previous, pages[0].previous_cursor), (False, None))
+        self.assertEqual((pages[-1].has_next, pages[-1].next_cursor), (False, None))
+
+    def test_cursor_with_ties_on_the_first_key(self):
+        # كل وصل له أقساط بنفس التواريخ: الترتيب الثاني (id) يحسم التساوي
+        self.add_receipts(4)
+        installments = InstallmentPayment.objects.all()
+        pages, backwards = self.walk(KeysetPaginator(installments, ('payment_date', 'id'), 5))
+        self.assertEqual(
+            [installment.id for page in pages for installment in page],
+            list(installments.order_by('payment_date', 'id').values_list('id', flat=True)),
+        )
+        self.assertEqual([page.object_list for page in backwards], [page.object_list for page in pages])
+
+    def test_invalid_cursor_shows_first_page(self):
+        self.add_receipts(4)
+        paginator = KeysetPaginator(InstallmentPayment.objects.all(), ('payment_date', 'id'), 5)
+        first = paginator.page()
+        for cursor in ('x', '2025-13-01~1', '1~2~3', CURSOR_SEPARATOR):
+            with self.subTest(cursor=cursor):
+                for page in (paginator.page(after=cursor), paginator.page(before=cursor)):
+                    self.assertEqual(page.object_list, first.object_list)
+                    self.assertFalse(page.has_previous)
+
+    def test_empty_result(self):
+        page = KeysetPaginator(Receipt.objects.none(), ('-receipt_number',), 3).page()
+        self.assertEqual((len(page), page.has_other_pages(), page.next_cursor), (0, False, None))
+        self.assertEqual(cached_count(Receipt.objects.none()), 0)
+        # رقم أكبر من أقصى قيمة للعمود: Django لا يرسل الاستعلام أصلاً (EmptyResultSet)
+        self.add_receipts(1)
+        huge = '9999999999999999999999999'
+        _get_ok(self, reverse('search_receipts'), {'receipt_from': huge})()
+        _get_ok(self, reverse('manage_installments'), {'search_receipt_num_from': huge})()
+
+
+# =======================================
+# عداد أرقام الوصلات (ReceiptNumberSequence)
+# =======================================
+class ReceiptNumberSequenceTests(BranchDataTestCase):
+
+    def test_first_use_continues_after_existing_numbers(self):
+        ReceiptNumberSequence.objects.all().delete()
+        Receipt.objects.create(
+            receipt_number=500, customer_name='عميل', branch=self.branch, sale_year=2025, sale_month=1,
+            total_amount=100, is_cash_sale=True,
+        )
+        self.assertEqual(ReceiptNumberSequence.peek_next(), 501)
+        # العرض لا يحجز الرقم
+        self.assertEqual(ReceiptNumberSequence.peek_next(), 501)
+        self.assertEqual(ReceiptNumberSequence.allocate(3), range(501, 504))
+        self.assertEqual(ReceiptNumberSequence.peek_next(), 504)
+
+    def test_allocations_never_overlap(self):
+        blocks = [ReceiptNumberSequence.allocate(count) for count in (1, 5, 2, 10, 1)]
+        numbers = [number for block in blocks for number in block]
+        self.assertEqual(len(numbers), 19)
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 19)))
+        with self.assertRaises(ValueError):
+            ReceiptNumberSequence.allocate(0)
+
+    def test_advance_to_only_moves_forward(self):
+        start = ReceiptNumberSequence.allocate(1)[0]
+        ReceiptNumberSequence.advance_to(start + 100)
+        ReceiptNumberSequence.advance_to(start + 50)
+        self.assertEqual(ReceiptNumberSequence.allocate(1)[0], start + 101)
+
+    def test_seed_migration_starts_from_max_receipt_number(self):
+        seed_receipt_sequence = importlib.import_module('salesapp.migrations.0010_receiptnumbersequence').seed_receipt_sequence
+        ReceiptNumberSequence.objects.all().delete()
+        Receipt.objects.create(
+            receipt_number=1200, customer_name='عميل', branch=self.branch, sale_year=2025, sale_month=1,
+            total_amount=100, is_cash_sale=True,
+        )
+        seed_receipt_sequence(django_apps, None)
+        self.assertEqual(ReceiptNumberSequence.objects.get().last_value, 1200)
+        # إعادة التشغيل لا ترجع العداد للخلف
+        ReceiptNumberSequence.allocate(5)
+        seed_receipt_sequence(django_apps, None)
+        self.assertEqual(ReceiptNumberSequence.peek_next(), 1206)
+
+
+# =======================================
+# حجز المخزون (salesapp.inventory)
+# =======================================
+class InventoryTests(BranchDataTestCase):
+
+    def quantities(self):
+        return list(InventoryItem.objects.filter(branch=self.branch).order_by('pk').values_list('quantity', flat=True))
+
+    def updates(self, queries):
+        return [query for query in queries if query['sql'].startswith('UPDATE')]
+
+    def test_single_update_for_all_items(self):
+        p0, p1, p2 = (product.pk for product in self.products)
+        with CaptureQueriesContext(connection) as queries:
+            items = reserve_stock(self.branch, [(p0, 5), (p1, 1), (p2, 100)])
+        self.assertEqual(len(self.updates(queries)), 1)
+        self.assertEqual(self.quantities(), [95, 99, 0])
+        self.assertEqual({pk: item.quantity for pk, item in items.items()}, {p0: 95, p1: 99, p2: 0})
+
+    def test_insufficient_stock_writes_nothing(self):
+        p0, p1, _ = (product.pk for product in self.products)
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertRaises(InsufficientStockError):
+                reserve_stock(self.branch, {p0: 1, p1: 101})
+        self.assertEqual(self.updates(queries), [])
+        self.assertEqual(self.quantities(), [100, 100, 100])
+
+    def test_duplicate_lines_are_merged(self):
+        p0 = self.products[0].pk
+        # كل سطر وحده أقل من المتاح، لكن مجموعهما أكثر
+        with self.assertRaises(InsufficientStockError):
+            reserve_stock(self.branch, [(p0, 60), (str(p0), 50)])
+        reserve_stock(self.branch, [(p0, 30), (p0, 20)])
+        self.assertEqual(self.quantities()[0], 50)
+
+    def test_released_quantities_are_returned(self):
+        p0, p1, p2 = (product.pk for product in self.products)
+        reserve_stock(self.branch, {p0: 100})
+        # تعديل وصل: الكمية القديمة ترجع للمخزن والتحقق على الصافي فقط
+        reserve_stock(self.branch, {p0: 30, p2: 5}, released={p0: 100, p1: 10})
+        self.assertEqual(self.quantities(), [70, 110, 95])
+
+    def test_item_from_another_branch(self):
+        other = InventoryItem.objects.create(name='صنف فرع آخر', quantity=10, branch=Branch.objects.create(name='فرع آخر'))
+        with self.assertRaises(InventoryItem.DoesNotExist):
+            reserve_stock(self.branch, {self.products[0].pk: 1, other.pk: 1})
+        self.assertEqual(self.quantities(), [100, 100, 100])
+
+    def test_apply_stock_changes(self):
+        p0, p1, p2 = (product.pk for product in self.products)
+        self.assertEqual(apply_stock_changes({p0: -10, p1: 0, p2: 7}), 2)
+        self.assertEqual(apply_stock_changes({p0: 0}), 0)
+        self.assertEqual(self.quantities(), [90, 100, 107])
+
+    def test_add_receipt_with_insufficient_stock(self):
+        salesperson = Salesperson.objects.create(name='مندوب', branch=self.branch)
+        form = _receipt_form(salesperson, self.products[0], is_cash_sale='on', installment_system='')
+        form['sale_items_json'] = json.dumps([
+            {'id': self.products[0].pk, 'quantity': 1, 'price': 100, 'name': 'صنف 0'},
+            {'id': self.products[1].pk, 'quantity': 101, 'price': 100, 'name': 'صنف 1'},
+        ])
+        response = self.client.post(reverse('add_receipt'), form)
+        self.assertIn('غير كاف', response.context['error_message'])
+        self.assertFalse(Receipt.objects.exists())
+        self.assertEqual(self.quantities(), [100, 100, 100])
+
+
+# =======================================
+# ملخصات الداشبورد (salesapp.stats)
+# =======================================
+def _receipt_form(salesperson, product, **fields):
+    """بيانات POST لشاشة add_receipt: وصل تقسيط بصنف واحد (1000 = 100 مقدم + 300*3)."""
+    return {
+        'salesperson_id': salesperson.pk, 'sale_year': 2025, 'sale_month': 1,
+        'customer_name': 'عميل', 'area': 'وسط البلد', 'down_payment': 100, 'installment_system': '300*3',
+        'sale_items_json': json.dumps([{'id': product.pk, 'quantity': 1, 'price': 1000, 'name': product.name}]),
+        **fields,
+    }
+
+
+def _stats_rows():
+    # الصفوف التي أصبحت كلها أصفار بعد التعديلات التدريجية لا ينشئها إعادة البناء
+    return sorted((
+        row for row in BranchMonthStats.objects.values_list('branch_id', 'year', 'month', 'salesperson_id', *STAT_FIELDS)
+        if any(row[4:])
+    ), key=lambda row: (row[:3], row[3] or 0))
+
+
+class BranchMonthStatsTests(BranchDataTestCase):
+    """كل مسار يعدل الوصلات أو الأقساط يترك الملخصات مطابقة لإعادة حسابها من الصفر."""
+
+    def assertStatsMatchRebuild(self):
+        stored = _stats_rows()
+        rebuild_branch_month_stats()
+        self.assertEqual(stored, _stats_rows())
+        self.assertTrue(stored)
+
+    def test_mutation_paths_match_rebuild(self):
+        salesperson = Salesperson.objects.create(name='مندوب', branch=self.branch)
+        collector = Salesperson.objects.create(name='محصل', branch=self.branch)
+
+        self.client.post(reverse('add_receipt'), _receipt_form(salesperson, self.products[0]))
+        self.client.post(reverse('add_receipt'), _receipt_form(
+            salesperson, self.products[1], is_cash_sale='on', sale_month=2, installment_system='',
+        ))
+        self.assertEqual(Receipt.objects.count(), 2)
+        self.assertStatsMatchRebuild()
+
+        installments = list(InstallmentPayment.objects.values_list('id', flat=True))
+        self.client.post(reverse('manage_installments'), {
+            'action': 'bulk_assign_selected', 'new_collector_id': collector.pk, 'selected_ids': installments,
+        })
+        self.assertEqual(InstallmentPayment.objects.filter(collector=collector).count(), 3)
+        self.assertStatsMatchRebuild()
+
+        self.client.post(reverse('manage_installments'), {
+            'action': 'bulk_mark_paid_selected', 'selected_ids': installments[:2],
+        })
+        self.assertEqual(InstallmentPayment.objects.filter(is_paid=True).count(), 2)
+        self.assertStatsMatchRebuild()
+
+        receipts = [
+            {**_receipt_form(salesperson, self.products[2]), 'sale_items': [{'id': self.products[2].pk, 'quantity': 1, 'price': 1000}]},
+            # وصل مرفوض لا يغير الملخصات
+            {**_receipt_form(salesperson, self.products[2]), 'installment_system': '300*2'},
+        ]
+        ingestion, _ = ingest_receipts(self.branch, 'stats-test', receipts)
+        self.assertEqual([result['status'] for result in ingestion.results], ['created', 'error'])
+        self.assertStatsMatchRebuild()
+
+
+# =======================================
+# التوليد السريع للبيانات (populate_data --fast)
+# =======================================
+def _populate_snapshot():
+    """البيانات المولدة بدون المعرفات (أرقام الوصلات تستمر من العداد بين مرة وأخرى)."""
+    return {
+        'receipts': list(Receipt.objects.order_by('receipt_number').values_list(
+            'branch__name', 'salesperson__name', 'sale_year', 'sale_month', 'is_cash_sale', 'customer_name',
+            'total_amount', 'down_payment', 'installment_system', 'products_text',
+        )),
+        'items': SaleItem.objects.aggregate(count=Count('id'), quantities=Sum('quantity'), prices=Sum('unit_price')),
+        'installments': InstallmentPayment.objects.aggregate(
+            count=Count('id'), total=Sum('amount'), paid=Count('id', filter=Q(is_paid=True)),
+            collected=Sum('amount', filter=Q(is_paid=True)), assigned=Count('id', filter=Q(collector__isnull=False)),
+        ),
+        'stock': list(InventoryItem.objects.order_by('branch__name', 'name').values_list('branch__name', 'name', 'quantity')),
+    }
+
+
+class PopulateFastTests(TestCase):
+    """نفس الـ seed ونفس --end-month يعطيان نفس البيانات، والملخصات مطابقة لإعادة الحساب."""
+
+    def populate(self):
+        call_command(
+            'populate_data', '--fast', '--branches', '2', '--salespersons', '3', '--products', '6',
+            '--receipts', '40', '--months', '6', '--end-month', '2025-06', '--seed', '7', '--batch-size', '15',
+            stdout=io.StringIO(),
+        )
+        return _populate_snapshot()
+
+    def test_same_seed_gives_same_data(self):
+        first = self.populate()
+        self.assertEqual(len(first['receipts']), 80)
+        self.assertEqual(first['items']['count'], SaleItem.objects.count())
+        self.assertGreater(first['installments']['count'], 0)
+        self.assertGreater(first['installments']['paid'], 0)
+        # مجموع مبالغ الأقساط + المقدم = إجمالي الوصل
+        self.assertEqual(
+            first['installments']['total'] + sum(receipt[7] for receipt in first['receipts']),
+            sum(receipt[6] for receipt in first['receipts']),
+        )
+
+        second = self.populate()
+        self.assertEqual(second, first)
+
+    def test_stats_match_rebuild(self):
+        self.populate()
+        stored = _stats_rows()
+        self.assertTrue(stored)
+        BranchMonthStats.objects.all().delete()
+        rebuild_branch_month_stats()
+        self.assertEqual(_stats_rows(), stored)
+        totals = BranchMonthStats.objects.aggregate(
+            sales=Sum('sales_count'), sales_total=Sum('sales_total'), down_payments=Sum('down_payments'),
+            collected_total=Sum('collected_total'), unpaid_total=Sum('unpaid_total'),
+        )
+        receipts = Receipt.objects.aggregate(sales=Count('id'), sales_total=Sum('total_amount'), down_payments=Sum('down_payment'))
+        installments = InstallmentPayment.objects.aggregate(
+            collected_total=Sum('amount', filter=Q(is_paid=True)), unpaid_total=Sum('amount', filter=Q(is_paid=False)),
+        )
+        self.assertEqual(totals, {**receipts, **installments})
+
+
+# =======================================
+# استيراد ملف النظام القديم (create_fromapp)
+# =======================================
+_LEGACY_CSV_HEADER = 'ID,CName,PhoneNum,CAddress,Products,Price,Retainer,InstSystem,Area,Zone,EmployeeName,SellingDate'
+
+
+def _legacy_csv_row(number, **fields):
+    row = {
+        'ID': number, 'CName': f'عميل {number}', 'PhoneNum': '0100', 'CAddress': 'عنوان', 'Products': 'مروحة',
+        'Price': 2800, 'Retainer': 200, 'InstSystem': '13*200', 'Area': 'السنبلاوين', 'Zone': 'العزب',
+        'EmployeeName': 'خالد', 'SellingDate': '25/06/2025', **fields,
+    }
+    return ','.join(str(row[name]) for name in _LEGACY_CSV_HEADER.split(','))
+
+
+class LegacyImportTests(TestCase):
+
+    def write_csv(self, directory, lines):
+        path = os.path.join(directory, 'legacy.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join([_LEGACY_CSV_HEADER, *lines]) + '\n')
+        return path
+
+    def import_csv(self, path, workers=1, chunk_size=2):
+        rejects = io.StringIO()
+        importer = BulkReceiptImporter(chunk_size=chunk_size, rejects_file=rejects)
+        importer.import_file(path, workers=workers)
+        return importer, list(csv.DictReader(io.StringIO(rejects.getvalue())))
+
+    def test_short_rows_are_rejected(self):
+        # صف ناقص الأعمدة من DictReader أو من قراءة النطاقات: القيم الناقصة None
+        short = dict(zip(_LEGACY_CSV_HEADER.split(','), '1,a,1,b,p,2800,200,13*200,X,Z,E'.split(',')))
+        short['SellingDate'] = None
+        (_, _, data, reason), = parse_rows([(2, short)])
+        self.assertIsNone(data)
+        self.assertIn('تاريخ البيع', reason)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_csv(directory, [
+                _legacy_csv_row(1),
+                '2,a,1,b,p,2800,200,13*200,X,Z,E',
+                _legacy_csv_row(3, SellingDate='31/02/2025'),
+                _legacy_csv_row(4),
+            ])
+            importer, rejects = self.import_csv(path)
+        self.assertEqual(sorted(Receipt.objects.values_list('receipt_number', flat=True)), [1, 4])
+        self.assertEqual((importer.created_receipts, importer.rejected_rows), (2, 2))
+        self.assertEqual([row['line'] for row in rejects], ['3', '4'])
+
+    def snapshot(self):
+        receipts = list(Receipt.objects.order_by('receipt_number').values_list(
+            'receipt_number', 'branch__name', 'salesperson__name', 'customer_name', 'area', 'total_amount',
+            'down_payment', 'sale_year', 'sale_month', 'is_cash_sale',
+        ))
+        installments = list(InstallmentPayment.objects.order_by('receipt__receipt_number', 'payment_date').values_list(
+            'receipt__receipt_number', 'payment_date', 'amount',
+        ))
+        return receipts, installments
+
+    def test_parallel_import_matches_serial(self):
+        lines = [_legacy_csv_row(number, InstSystem='كاش' if number % 4 == 0 else '6*400') for number in range(1, 12)]
+        lines[2] = '3,a,1,b,p,2800,200,13*200,X,Z,E'
+        lines[5] = _legacy_csv_row(6, SellingDate='x')
+        lines[8] = _legacy_csv_row(2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_csv(directory, lines)
+            serial_importer, serial_rejects = self.import_csv(path, workers=1)
+            serial = self.snapshot()
+            for model in (InstallmentPayment, SaleItem, Receipt, InventoryItem, Salesperson, Branch):
+                model.objects.all().delete()
+            parallel_importer, parallel_rejects = self.import_csv(path, workers=2)
+        self.assertEqual(self.snapshot(), serial)
+        self.assertEqual(parallel_rejects, serial_rejects)
+        self.assertEqual(
+            (parallel_importer.created_receipts, parallel_importer.created_installments, parallel_importer.rejected_rows),
+            (serial_importer.created_receipts, serial_importer.created_installments, serial_importer.rejected_rows),
+        )
+        self.assertEqual((serial_importer.created_receipts, serial_importer.rejected_rows), (8, 3))
+
+
+# =======================================
+# محرك الأقساط الموحد (salesapp.schedule)
+# =======================================
+# نسخ من التطبيقات القديمة قبل توحيدها، للمقارنة معها (السلوك الحالي)
+def _legacy_parse(ps_string):
+    """parse_installment_string القديمة في views.py و create_fromapp.py."""
+    if not ps_string: return []
+    try:
+        ps_list = []
+        for m_part in re.split("\\+", ps_string.strip()):
+            m = m_part.strip()
+            if not m: raise ValueError("يوجد جزء فارغ (علامة + زائدة؟)")
+            parts = m.split("*")
+            if len(parts) < 2:
+                if len(parts) == 1 and parts[0].isdigit(): count = 1; amount_str = parts[0].strip()
+                else: raise ValueError(f"الصيغة '{m_part}' خاطئة.")
+            else:
+                part1 = parts[0].strip(); part2 = parts[1].strip()
+                if not part1.isdigit() or not part2.isdigit(): raise ValueError(f"الأرقام غير صحيحة في '{m_part}'.")
+                num1 = int(part1); num2 = int(part2)
+                if num2 < 20 and num1 >= 20: count = num2; amount_str = part1
+                elif num1 < 20 and num2 >= 20: count = num1; amount_str = part2
+                else: count = num1; amount_str = part2
+            ps_list.extend([int(amount_str)] * count)
+        return ps_list
+    except ValueError as e: return f"خطأ في تحليل نظام القسط: {e}"
+
+
+def _legacy_app_functions_parse(installment_string):
+    """parse_installment_string القديمة في app_functions.py (صيغة مبلغ*عدد فقط)."""
+    installments = []
+    for part in re.split(r'\s*\+\s*', installment_string.strip()):
+        part = part.strip()
+        if not part: continue
+        match = re.match(r'(\d+)\s*\*\s*(\d+)', part)
+        if match:
+            installments.extend([int(match.group(1))] * int(match.group(2)))
+        elif part.isdigit():
+            installments.append(int(part))
+        else:
+            return f"صيغة القسط غير صحيحة في الجزء: '{part}'"
+    return installments
+
+
+def _legacy_schedule(sale_year, sale_month, amounts):
+    """حلقة relativedelta القديمة في add_receipt و populate_data."""
+    start_date = date(sale_year, sale_month, 15)
+    return [(start_date + relativedelta(months=i + 1), amount) for i, amount in enumerate(amounts) if amount > 0]
+
+
+def _legacy_get_paydL(seld, nofm):
+    dates = []
+    current_date = seld
+    for _ in range(nofm):
+        if current_date.month == 12: current_date = current_date.replace(year=current_date.year + 1, month=1)
+        else: current_date = current_date.replace(month=current_date.month + 1)
+        dates.append(current_date.strftime(r"%d/%m/%Y"))
+    return dates
+
+
+class InstallmentScheduleTests(SimpleTestCase):
+    """اختبارات خصائص (بيانات عشوائية بـ seed ثابت): المحرك الموحد يعطي نفس نتائج التطبيقات القديمة."""
+
+    EXAMPLES = 3000
+
+    def setUp(self):
+        self.rng = random.Random(2025)
+
+    def random_part(self):
+        rng = self.rng
+        count = rng.choice([1, 2, 3, 6, 10, 11, 12, 13, 18, 19, 20, 24])
+        amount = rng.choice([0, 5, 19, 20, 50, 100, 125, 235, 1000, rng.randint(1, 5000)])
+        form = rng.random()
+        if form < 0.1:
+            return str(amount)
+        text = f"{count}*{amount}" if form < 0.6 else f"{amount}*{count}"
+        return text.replace('*', rng.choice(['*', ' * ', '*  '])) if rng.random() < 0.2 else text
+
+    def random_system(self):
+        return self.rng.choice(['+', ' + ', '+ ']).join(self.random_part() for _ in range(self.rng.randint(1, 3)))
+
+    def random_garbage(self):
+        alphabet = '0123456789*+ x٠١٢٣'
+        return ''.join(self.rng.choice(alphabet) for _ in range(self.rng.randint(0, 8)))
+
+    def test_parse_matches_legacy_parser(self):
+        for _ in range(self.EXAMPLES):
+            for text in (self.random_system(), self.random_garbage()):
+                expected = _legacy_parse(text)
+                if isinstance(expected, list) and len(expected) > MAX_INSTALLMENTS:
+                    continue
+                self.assertEqual(parse_installment_string(text), expected, text)
+
+    def test_parse_matches_app_functions_for_amount_times_count(self):
+        # صيغة 'مبلغ*عدد' (المبلغ 20 أو أكثر والعدد أقل من 20) هي التي كانت شاشة الإضافة تفهمها بنفس الشكل
+        for _ in range(self.EXAMPLES):
+            parts = [f"{self.rng.randint(20, 5000)}*{self.rng.randint(1, 19)}" if self.rng.random() < 0.8
+                     else str(self.rng.randint(1, 5000)) for _ in range(self.rng.randint(1, 3))]
+            text = ' + '.join(parts)
+            self.assertEqual(parse_installment_string(text), _legacy_app_functions_parse(text), text)
+
+    def test_total_matches_app_functions(self):
+        # في كل الحالات المقبولة من الاثنين يبقى إجمالي الأقساط كما هو (قد يختلف فقط عدد الشهور)
+        for _ in range(self.EXAMPLES):
+            text = f"{self.rng.randint(1, 300)}*{self.rng.randint(1, 300)}"
+            self.assertEqual(sum(parse_installment_string(text)), sum(_legacy_app_functions_parse(text)), text)
+
+    def test_errors(self):
+        self.assertEqual(parse_installment_system(''), ())
+        self.assertEqual(parse_installment_system(None), ())
+        for text in ('12*', '12*100+', 'abc', '12x100', '  ', '999999*20'):
+            with self.assertRaises(InstallmentSystemError):
+                parse_installment_system(text)
+        with self.assertRaises(ValueError):
+            installment_schedule(2025, 13, [100])
+
+    def test_schedule_matches_relativedelta(self):
+        for _ in range(self.EXAMPLES):
+            year, month = self.rng.randint(2000, 2040), self.rng.randint(1, 12)
+            amounts = [self.rng.choice([0, 100, 250, self.rng.randint(1, 999)]) for _ in range(self.rng.randint(0, 30))]
+            self.assertEqual(installment_schedule(year, month, amounts), _legacy_schedule(year, month, amounts))
+
+    def test_schedule_from_text(self):
+        self.assertEqual(installment_schedule(2025, 11, '2*250 + 130'), [
+            (date(2025, 12, 15), 250), (date(2026, 1, 15), 250), (date(2026, 2, 15), 130),
+        ])
+
+    def test_expand_schedules_matches_per_receipt_schedules(self):
+        receipts = [
+            (number, self.rng.randint(2020, 2030), self.rng.randint(1, 12), self.random_system())
+            for number in range(200)
+        ]
+        receipts = [
+            receipt for receipt in receipts
+            if isinstance(_legacy_parse(receipt[3]), list) and len(_legacy_parse(receipt[3])) <= MAX_INSTALLMENTS
+        ]
+        expected = [
+            (number, due, amount)
+            for number, year, month, text in receipts for due, amount in _legacy_schedule(year, month, _legacy_parse(text))
+        ]
+        self.assertEqual(expand_schedules(receipts), expected)
+
+    def test_get_paydL_matches_legacy(self):
+        for _ in range(self.EXAMPLES):
+            sold = date(self.rng.randint(2000, 2040), self.rng.randint(1, 12), self.rng.randint(1, 28))
+            months = self.rng.randint(0, 30)
+            self.assertEqual(get_paydL(sold.strftime(r"%d/%m/%Y"), months), _legacy_get_paydL(sold, months))
+        # يوم 31: آخر يوم في الشهور الأقصر (التطبيق القديم كان يتوقف بخطأ)
+        self.assertEqual(get_paydL('31/01/2025', 2), ['28/02/2025', '31/03/2025'])
+
+    def test_repeated_systems_are_memoized(self):
+        parse_installment_system('12*250')
+        hits = _parse.cache_info().hits
+        self.assertIs(parse_installment_system('12*250'), parse_installment_system(' 12*250 '))
+        self.assertEqual(_parse.cache_info().hits, hits + 2)
+        self.assertIs(due_dates(2025, 1, 12), due_dates(2025, 1, 12))
+
+
+# =======================================
+# تنسيق صفحات الطباعة (salesapp.formatting)
+# =======================================
+# نسخ من utils.py قبل نقل التنسيق إلى formatting.py، للمقارنة معها
+_LEGACY_NUMERALS = {
+    '0': '٠', '1': '١', '2': '٢', '3': '٣', '4': '٤',
+    '5': '٥', '6': '٦', '7': '٧', '8': '٨', '9': '٩',
+    '.': '٫',
+}
+
+
+def _legacy_ed2ad(number_string):
+    return "".join(_LEGACY_NUMERALS.get(digit, digit) for digit in str(number_string))
+
+
+def _legacy_num_to_words_ar(number):
+    try:
+        return num2words(int(number), lang='ar')
+    except Exception:
+        return ""
+
+
+class FormattingTests(SimpleTestCase):
+    """الأرقام الهندية والمبالغ بالحروف مطابقة لـ ed2ad و get_num_to_words_ar القديمة."""
+
+    VALUES = [
+        0, '0', 7, 250, 1234567890, 10 ** 15, -300, 12.5, Decimal('99.50'), '15/1/2025', '12*250+1*100',
+        'عميل 17', 'شارع 5, القاهرة', '', None, True,
+    ]
+    AMOUNTS = [
+        0, 1, 2, 11, 100, 250, 300, 1000, 2500, 12345, 1000000, 10 ** 9, 10 ** 12, -50,
+        '300', 300.75, Decimal('250.00'), '300.5', '', None, 'abc',
+    ]
+
+    def test_digits_match_legacy(self):
+        for value in self.VALUES:
+            with self.subTest(value=value):
+                self.assertEqual(ed2ad(value), _legacy_ed2ad(value))
+                self.assertEqual(format_value(value), _legacy_ed2ad(value))
+        self.assertEqual(ed2ad(1234567890), '١٢٣٤٥٦٧٨٩٠')
+        self.assertEqual(ed2ad(None), 'None')
+
+    def test_dates_match_legacy(self):
+        for value in (date(2025, 1, 1), date(2025, 12, 31), date(1999, 2, 28)):
+            with self.subTest(value=value):
+                self.assertEqual(format_value(value), _legacy_ed2ad(value.strftime(r"%d/%m/%Y")))
+        self.assertEqual(format_value(date(2025, 3, 1)), '٠١/٠٣/٢٠٢٥')
+
+    def test_words_match_legacy(self):
+        # مرتين: النتيجة من lru_cache مطابقة للنتيجة الأولى
+        for _ in range(2):
+            for amount in self.AMOUNTS:
+                with self.subTest(amount=amount):
+                    self.assertEqual(amount_to_words_ar(amount), _legacy_num_to_words_ar(amount))
+        self.assertEqual(amount_to_words_ar(0), 'صفر')
+        self.assertEqual(amount_to_words_ar(None), '')
+        self.assertEqual(amount_to_words_ar(''), '')
+
+    def test_format_fields_matches_legacy_page(self):
+        values = {
+            'id': 1017, 'CName': 'عميل 17', 'phnum': '', 'CAddress': None, 'to': 3600, 're': 0,
+            'i': 3, 'payd': date(2025, 4, 1), 'evm': 300,
+        }
+        expected = {key: _legacy_ed2ad(value) for key, value in values.items()}
+        expected['payd'] = _legacy_ed2ad(values['payd'].strftime(r"%d/%m/%Y"))
+        expected['evmar'] = _legacy_num_to_words_ar(300)
+        self.assertEqual(format_fields(values, words={'evmar': 300}), expected)
+        self.assertEqual(format_fields({}), {})
+
+
+# =======================================
+# بيانات صفحات الطباعة (salesapp.printing)
+# =======================================
+class PageContextTests(BranchDataTestCase):
+    """بيانات كل صفحة طباعة بالضبط: صفحة لكل قسط (مدفوع أو لا) بترتيب التاريخ، أو صفحة واحدة للكاش."""
+
+    RECEIPT_FIELDS = {
+        'id': '١٠١٧', 'CName': 'أحمد علي', 'phnum': '٠١٠١٢٣٤٥٦٧٨', 'CAddress': 'شارع ٥', 'pro': '١ x ثلاجة',
+        'area': 'القاهرة', 'empl': 'مندوب ١', 'to': '١٠٠٠', 're': '١٠٠', 'ins': '٣٠٠*٣', 'seld': '١٥/١/٢٠٢٥', 't': '٣',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.salesperson = Salesperson.objects.create(name='مندوب 1', branch=cls.branch)
+        common = dict(
+            branch=cls.branch, salesperson=cls.salesperson, sale_year=2025, sale_month=1, total_amount=1000,
+            customer_name='أحمد علي', phone_number='01012345678', address='شارع 5', area='القاهرة',
+            products_text='1 x ثلاجة',
+        )
+        cls.receipt = Receipt.objects.create(receipt_number=1017, down_payment=100, installment_system='300*3', **common)
+        # تضاف بغير ترتيب التاريخ، والقسط الأول والثاني مدفوعان
+        for month, is_paid in ((4, False), (2, True), (3, True)):
+            InstallmentPayment.objects.create(
+                receipt=cls.receipt, payment_date=date(2025, month, 1), amount=300, is_paid=is_paid,
+                collector=cls.salesperson if is_paid else None,
+            )
+        cls.cash = Receipt.objects.create(receipt_number=1018, down_payment=1000, is_cash_sale=True, **common)
+
+    def printable(self, receipt):
+        return printable_receipts(Receipt.objects.select_related('salesperson')).get(pk=receipt.pk)
+
+    def test_installment_receipt_pages(self):
+        receipt = self.printable(self.receipt)
+        installments = list(receipt.payments.all())
+        self.assertEqual(receipt_page_fields(receipt, installments), self.RECEIPT_FIELDS)
+        pages = [
+            {'i': '١', 'ga': '٦٠٠', 'payd': '٠١/٠٢/٢٠٢٥', 'evm': '٣٠٠', 'evmar': 'ثلاثمائة'},
+            {'i': '٢', 'ga': '٣٠٠', 'payd': '٠١/٠٣/٢٠٢٥', 'evm': '٣٠٠', 'evmar': 'ثلاثمائة'},
+            {'i': '٣', 'ga': 'خالص', 'payd': '٠١/٠٤/٢٠٢٥', 'evm': '٣٠٠', 'evmar': 'ثلاثمائة'},
+        ]
+        self.assertEqual(list(iter_installment_page_fields(receipt, installments)), pages)
+        self.assertEqual(list(iter_receipt_page_contexts(receipt)), [{**self.RECEIPT_FIELDS, **page} for page in pages])
+
+    def test_cash_receipt_page(self):
+        self.assertEqual(list(iter_receipt_page_contexts(self.printable(self.cash))), [{
+            **self.RECEIPT_FIELDS, 'id': '١٠١٨', 're': '١٠٠٠', 'ins': 'كاش', 'seld': '١/٢٠٢٥', 't': '١',
+            'i': '١', 'ga': 'خالص', 'payd': '١/٢٠٢٥', 'evm': '١٠٠٠', 'evmar': 'ألف',
+        }])
+
+    def test_batch_pages_follow_receipt_order(self):
+        receipts = printable_receipts(Receipt.objects.select_related('salesperson').order_by('-receipt_number'))
+        with self.assertNumQueries(2):
+            contexts = list(iter_batch_page_contexts(receipts))
+        self.assertEqual([(context['id'], context['i']) for context in contexts], [
+            ('١٠١٨', '١'), ('١٠١٧', '١'), ('١٠١٧', '٢'), ('١٠١٧', '٣'),
+        ])
+        self.assertEqual(contexts[1:], list(iter_receipt_page_contexts(self.printable(self.receipt))))
+
+
+# =======================================
+# الطباعة المجمعة بالتوازي (Process Pool)
+# =======================================
+_HYPERLINK_REL = (
+    b'<Relationship Id="rId900" TargetMode="External" Target="https://example.com" '
+    b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"/>'
+)
+
+
+def _invoice_variant(directory, body_xml=b'', replacements=()):
+    """
+    نسخة من invoice.docx مع body_xml مضافاً في بداية الـ body (مثل صورة أو رابط أو bookmark)،
+    و replacements أزواج (قديم، جديد) تستبدل في document.xml.
+    العلاقة rId900 (رابط خارجي) موجودة في النسخة حتى يمكن استخدامها في body_xml.
+    """
+    path = os.path.join(directory, 'invoice.docx')
+    with zipfile.ZipFile(INVOICE_TEMPLATE_PATH) as source, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item)
+            if item.filename == 'word/document.xml':
+                data = re.sub(rb'(<w:body[^>]*>)', lambda match: match.group(1) + body_xml, data, count=1)
+                for old, new in replacements:
+                    data = data.replace(old, new)
+            elif item.filename == 'word/_rels/document.xml.rels':
+                data = data.replace(b'</Relationships>', _HYPERLINK_REL + b'</Relationships>')
+            target.writestr(item, data)
+    return path
+
+
+class InvoiceTemplateTests(SimpleTestCase):
+    """القالب المترجم: يعاد تحميله عند تغير الملف، ويرفض القوالب التي لا تطابق حقول الطباعة."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_reloads_after_mtime_change(self):
+        path = _invoice_variant(self.directory)
+        invoice_template = get_invoice_template(path)
+        self.assertIs(get_invoice_template(path), invoice_template)
+
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        reloaded = get_invoice_template(path)
+        self.assertIsNot(reloaded, invoice_template)
+        self.assertEqual(reloaded.mtime, mtime)
+
+        # تعديل الملف نفسه يظهر بعد تغير الـ mtime (هنا قالب غير صالح)
+        _invoice_variant(self.directory, replacements=[(b'{{evmar}}', b'')])
+        os.utime(path, (mtime + 10, mtime + 10))
+        with self.assertRaisesMessage(InvoiceTemplateError, 'evmar'):
+            get_invoice_template(path)
+
+    def test_rejects_unknown_placeholder(self):
+        path = _invoice_variant(self.directory, b'<w:p><w:r><w:t>{{ discount }}</w:t></w:r></w:p>')
+        with self.assertRaisesMessage(InvoiceTemplateError, 'discount'):
+            CompiledInvoiceTemplate(path)
+
+    def test_rejects_missing_placeholder(self):
+        path = _invoice_variant(self.directory, replacements=[(b'{{payd}}', b'')])
+        with self.assertRaisesMessage(InvoiceTemplateError, 'payd'):
+            CompiledInvoiceTemplate(path)
+
+    def test_pages_do_not_share_the_parsed_document(self):
+        invoice_template = get_invoice_template()
+        first, second = (invoice_template.render({**{name: '' for name in INVOICE_PLACEHOLDERS}, 'id': number})
+                         for number in ('1001', '1002'))
+        self.assertIsNot(first.element, invoice_template.document.element)
+        self.assertIn('1001', first.element.xml)
+        self.assertNotIn('1002', first.element.xml)
+        self.assertIn('1002', second.element.xml)
+        self.assertNotIn('1001', invoice_template.document.element.xml)
+
+
+class ParallelPrintTests(SimpleTestCase):
+    """الرسم في عمليات منفصلة يعطي نفس ملف الرسم العادي، والقوالب التي تحتاج إعادة ترقيم لا تستخدمه."""
+
+    def contexts(self, count):
+        return [format_fields({name: f"{name} {number}" for name in INVOICE_PLACEHOLDERS}) for number in range(count)]
+
+    def test_parallel_output_is_byte_identical(self):
+        invoice_template = get_invoice_template()
+        contexts = self.contexts(7)
+        serial = b''.join(iter_print_docx(invoice_template, contexts, workers=0))
+        self.assertEqual(b''.join(iter_print_docx(invoice_template, contexts, workers=2)), serial)
+        # دفعات صغيرة: الترتيب بين الدفعات محفوظ
+        self.assertEqual(b''.join(iter_composed_docx_parallel(invoice_template, contexts, 2, chunk_size=3)), serial)
+        self.assertEqual(
+            b''.join(iter_composed_docx((invoice_template.render(context) for context in contexts), chunk_size=3)), serial,
+        )
+
+    def test_templates_needing_renumbering_fall_back_to_serial(self):
+        # (العنصر في الـ body، نص يظهر مرة في كل صفحة)
+        variants = {
+            'bookmark': (b'<w:p><w:bookmarkStart w:id="0" w:name="mark"/><w:bookmarkEnd w:id="0"/></w:p>', b'w:name="mark"'),
+            'r:id': (b'<w:p><w:hyperlink r:id="rId900"><w:r><w:t>link</w:t></w:r></w:hyperlink></w:p>', b'r:id="rId900"'),
+            'docPr': (
+                b'<w:p><w:r><w:drawing><wp:inline><wp:docPr id="1" name="shape"/></wp:inline></w:drawing></w:r></w:p>',
+                b'name="shape"',
+            ),
+        }
+        for name, (body_xml, marker) in variants.items():
+            with self.subTest(name), tempfile.TemporaryDirectory() as directory:
+                invoice_template = CompiledInvoiceTemplate(_invoice_variant(directory, body_xml))
+                self.assertFalse(invoice_template.supports_parallel)
+                with mock.patch('salesapp.printing.iter_composed_docx_parallel') as parallel:
+                    output = b''.join(iter_print_docx(invoice_template, self.contexts(2), workers=2))
+                parallel.assert_not_called()
+                with zipfile.ZipFile(io.BytesIO(output)) as docx:
+                    self.assertEqual(docx.read('word/document.xml').count(marker), 2)
+        self.assertTrue(get_invoice_template().supports_parallel)
+
+
+# =======================================
+# الطباعة المجمعة المتدفقة (StreamingHttpResponse)
+# =======================================
+class StreamingBatchPrintTests(BranchDataTestCase):
+    """الملف يرسل على دفعات، والناتج مستند وورد صالح فيه صفحة لكل قسط بترتيب الوصلات."""
+
+    def print_batch(self):
+        response = self.client.get(reverse('print_batch_receipts'))
+        self.assertTrue(response.streaming)
+        chunks = [chunk for chunk in response.streaming_content if chunk]
+        return chunks, Document(io.BytesIO(b''.join(chunks)))
+
+    def assertPagesInOrder(self, document, receipts):
+        expected = [
+            f"رقم الوصل: {format_fields({'id': receipt.receipt_number})['id']} "
+            for receipt in receipts for _ in range(3)
+        ]
+        # كل صفحة هي جدول القالب، ورقم الوصل (بالأرقام العربية) يظهر فيه
+        self.assertEqual(len(document.tables), len(expected))
+        for table, label in zip(document.tables, expected):
+            self.assertIn(label, ' '.join(cell.text for row in table.rows for cell in row.cells))
+
+    @override_settings(SALES_PRINT_CACHE_MAX_BYTES=0)
+    def test_composed_batch_is_streamed_in_chunks(self):
+        # 18 وصل × 3 أقساط = 54 صفحة > PRINT_CHUNK_PAGES
+        self.add_receipts(18)
+        chunks, document = self.print_batch()
+        self.assertGreater(len(chunks), 1)
+        self.assertPagesInOrder(document, Receipt.objects.order_by('-receipt_number'))
+
+    def test_cached_bodies_are_streamed_per_receipt(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(SALES_PRINT_CACHE_DIR=cache_dir.name))
+        self.add_receipts(4)
+        chunks, document = self.print_batch()
+        self.assertGreater(len(chunks), 1)
+        self.assertPagesInOrder(document, Receipt.objects.order_by('-receipt_number'))
+
+
+# =======================================
+# الطباعة بصيغة PDF (salesapp.pdf_printing)
+# =======================================
+_PDF_AVAILABLE = not missing_pdf_requirements()
+
+
+def _read_pdf(test, data):
+    """
+    يتحقق من بنية الملف (البداية، جدول xref، الـ trailer) ويعيد {رقم الـ object: محتواه}.
+    كل مكان في xref يجب أن يشير إلى بداية الـ object بنفس الرقم.
+    """
+    test.assertTrue(data.startswith(b'%PDF-1.'))
+    test.assertTrue(data.endswith(b'%%EOF\n'))
+    startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    xref, trailer = data[startxref:].split(b'trailer\n')
+    lines = xref.split(b'\n')
+    test.assertEqual(lines[0], b'xref')
+    first, size = map(int, lines[1].split())
+    test.assertEqual((first, int(re.search(rb'/Size (\d+)', trailer).group(1))), (0, size))
+    offsets = [int(line[:10]) for line in lines[3:3 + size - 1]]
+    # الـ objects لا تكتب بترتيب أرقامها: نهاية كل object هي بداية الـ object التالي في الملف
+    ends = dict(zip(sorted(offsets), sorted(offsets)[1:] + [startxref]))
+    objects = {}
+    for number, offset in enumerate(offsets, 1):
+        test.assertTrue(data.startswith(b'%d 0 obj\n' % number, offset), number)
+        objects[number] = data[offset:ends[offset]]
+    root = int(re.search(rb'/Root (\d+) 0 R', trailer).group(1))
+    test.assertIn(b'/Type /Catalog', objects[root])
+    return objects
+
+
+def _stream(obj):
+    return zlib.decompress(obj[obj.index(b'stream\n') + 7:obj.rindex(b'\nendstream')])
+
+
+@skipUnless(_PDF_AVAILABLE, f"PDF printing needs {', '.join(missing_pdf_requirements())}")
+class PdfPrintingTests(BranchDataTestCase):
+    """ملف PDF صالح: صفحة لكل قسط، الخطوط مضمنة، ونفس الناتج من الصفحات المحفوظة في الكاش."""
+
+    def assertValidPdf(self, data, pages):
+        objects = _read_pdf(self, data)
+        page_objects = [obj for obj in objects.values() if re.search(rb'/Type /Page\b(?!s)', obj)]
+        self.assertEqual(len(page_objects), pages)
+        (page_tree,) = [obj for obj in objects.values() if b'/Type /Pages' in obj]
+        self.assertIn(b'/Count %d ' % pages, page_tree)
+        # الخطان (عادي وعريض) مضمنان كـ TrueType بالحروف المستخدمة فقط
+        font_files = [
+            _stream(objects[int(number)])
+            for number in re.findall(rb'/FontFile2 (\d+) 0 R', b''.join(objects.values()))
+        ]
+        self.assertEqual(len(font_files), 2)
+        from fontTools.ttLib import TTFont  # مع باقي مكتبات PDF الاختيارية
+        for data in font_files:
+            font = TTFont(io.BytesIO(data))
+            self.assertIn('glyf', font)
+            self.assertGreater(len([name for name in font.getGlyphOrder() if font['glyf'][name].numberOfContours]), 10)
+        return objects
+
+    def contexts(self, count):
+        return [
+            format_fields({**{name: f"{name} {number}" for name in INVOICE_PLACEHOLDERS}, 'i': number})
+            for number in range(count)
+        ]
+
+    def test_iter_print_pdf(self):
+        chunks = list(iter_print_pdf(self.contexts(7), chunk_size=3))
+        self.assertGreater(len(chunks), 1)
+        self.assertValidPdf(b''.join(chunks), 7)
+        self.assertEqual(list(iter_print_pdf([])), [])
+
+    def test_render_and_pack_pages(self):
+        fonts = get_pdf_fonts()
+        pages, glyphs = render_pdf_pages(fonts, self.contexts(3))
+        self.assertEqual(len(pages), 3)
+        self.assertIn(b'/Tpl Do', zlib.decompress(pages[0]))
+        self.assertEqual(set(glyphs), {'regular'})
+        self.assertEqual(unpack_pdf_pages(pack_pdf_pages(pages, glyphs)), (pages, glyphs))
+
+    @override_settings(SALES_PRINT_CACHE_MAX_BYTES=0)
+    def test_print_receipt_pdf(self):
+        receipt = self.add_receipts(1)
+        response = self.client.get(reverse('print_receipt', args=[receipt.id]), {'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertValidPdf(response.content, receipt.payments.count())
+
+    @override_settings(SALES_PRINT_CACHE_MAX_BYTES=0)
+    def test_print_batch_receipts_pdf(self):
+        # 18 وصل × 3 أقساط = 54 صفحة > PRINT_CHUNK_PAGES
+        self.add_receipts(18)
+        response = self.client.get(reverse('print_batch_receipts'), {'format': 'pdf'})
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertValidPdf(b''.join(chunks), InstallmentPayment.objects.count())
+
+    def test_cached_pages_give_the_same_file(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(SALES_PRINT_CACHE_DIR=cache_dir.name))
+        self.add_receipts(3)
+        receipts = lambda: printable_receipts(Receipt.objects.select_related('salesperson').order_by('-receipt_number'))
+        rendered = b''.join(iter_print_pdf_receipts(receipts()))
+        with mock.patch('salesapp.pdf_printing.render_pdf_pages') as render:
+            cached = b''.join(iter_print_pdf_receipts(receipts()))
+        render.assert_not_called()
+        self.assertEqual(cached, rendered)
+        self.assertValidPdf(cached, 9)
+
+
+class PdfRequirementsTests(BranchDataTestCase):
+    """بدون مكتبات PDF: تحذير في فحص النظام، ورسالة خطأ بدلاً من الملف."""
+
+    def test_missing_requirements(self):
+        real_find_spec = importlib.util.find_spec
+        find_spec = lambda name, *args: None if name == 'uharfbuzz' else real_find_spec(name, *args)
+        receipt = self.add_receipts(1)
+        with mock.patch('importlib.util.find_spec', find_spec):
+            self.assertEqual(missing_pdf_requirements(), ['uharfbuzz'])
+            self.assertEqual([message.id for message in checks.run_checks()], ['salesapp.W001'])
+            with self.assertRaisesMessage(PdfPrintError, 'uharfbuzz'):
+                get_pdf_fonts()
+            response = self.client.get(reverse('print_receipt', args=[receipt.id]), {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('uharfbuzz', response.content.decode())
+        self.assertNotEqual(response['Content-Type'], 'application/pdf')
+
+
+# =======================================
+# كاش صفحات الطباعة (salesapp.print_cache)
+# =======================================
+class PrintCacheTests(BranchDataTestCase):
+    """المفتاح يتغير مع أي تغيير يظهر في الطباعة، وإعادة الطباعة من الكاش بدون رسم، وحذف الأقدم استخداماً."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.enterContext(override_settings(SALES_PRINT_CACHE_DIR=self.cache_dir))
+
+    def printable(self):
+        return printable_receipts(Receipt.objects.select_related('salesperson').order_by('-receipt_number'))
+
+    def test_key_follows_receipt_payments_and_template(self):
+        self.add_receipts(1)
+        version = docx_cache_version(get_invoice_template())
+        receipt = self.printable().get()
+        key = receipt_cache_key(receipt, version)
+        self.assertEqual(receipt_cache_key(self.printable().get(), version), key)
+
+        changes = {
+            'customer_name': lambda receipt: setattr(receipt, 'customer_name', 'عميل آخر'),
+            'down_payment': lambda receipt: setattr(receipt, 'down_payment', 200),
+            'salesperson': lambda receipt: setattr(receipt.salesperson, 'name', 'مندوب آخر'),
+            'amount': lambda receipt: setattr(receipt.payments.all()[0], 'amount', 250),
+            'payment_date': lambda receipt: setattr(receipt.payments.all()[1], 'payment_date', date(2025, 3, 15)),
+            'is_paid': lambda receipt: setattr(receipt.payments.all()[2], 'is_paid', True),
+        }
+        for name, change in changes.items():
+            with self.subTest(name):
+                receipt = self.printable().get()
+                change(receipt)
+                self.assertNotEqual(receipt_cache_key(receipt, version), key)
+
+        # تعديل القالب (mtime) يغير نسخة القالب في المفتاح
+        receipt = self.printable().get()
+        path = _invoice_variant(self.cache_dir)
+        first_version = docx_cache_version(get_invoice_template(path))
+        os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+        second_version = docx_cache_version(get_invoice_template(path))
+        self.assertNotEqual(second_version, first_version)
+        self.assertNotEqual(receipt_cache_key(receipt, first_version), receipt_cache_key(receipt, second_version))
+
+    def test_second_batch_print_is_served_from_cache(self):
+        self.add_receipts(3)
+        first = b''.join(self.client.get(reverse('print_batch_receipts')).streaming_content)
+        self.assertEqual(len(get_print_cache().entries()), 3)
+        with mock.patch('salesapp.printing._render_chunk_body') as render, \
+                mock.patch('salesapp.printing.iter_receipt_page_contexts') as contexts:
+            second = b''.join(self.client.get(reverse('print_batch_receipts')).streaming_content)
+        render.assert_not_called()
+        contexts.assert_not_called()
+        self.assertEqual(second, first)
+
+        # وصل تغير بعد الطباعة: يرسم وحده من جديد
+        InstallmentPayment.objects.filter(receipt=Receipt.objects.earliest('receipt_number')).update(amount=250)
+        with mock.patch('salesapp.printing._render_chunk_body', wraps=_render_chunk_body) as render:
+            b''.join(self.client.get(reverse('print_batch_receipts')).streaming_content)
+        self.assertEqual(render.call_count, 1)
+
+    def test_set_past_max_bytes_evicts_least_recently_used(self):
+        cache = PrintCache(self.cache_dir, max_bytes=300)
+        keys = [f"{letter}{letter}{number}" for number, letter in enumerate('abc')]
+        for age, key in zip((300, 200, 100), keys):
+            cache.set(key, b'x' * 100)
+            old = os.path.getmtime(cache._path(key)) - age
+            os.utime(cache._path(key), (old, old))
+        # قراءة أقدم ملف تجعله الأحدث استخداماً
+        self.assertEqual(cache.get(keys[0]), b'x' * 100)
+
+        cache.set('dd3', b'x' * 100)
+        # 400 > 300: الحذف حتى 90% من الحد (270) يبدأ بالأقدم استخداماً (b ثم c)
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNone(cache.get(keys[2]))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get('dd3'))
+        self.assertEqual(cache.total_size(), 200)
+
+    def test_warm_and_purge_commands(self):
+        self.add_receipts(2)
+        out = io.StringIO()
+        call_command('print_cache', 'warm', '--format', 'docx', stdout=out, no_color=True)
+        self.assertIn(f"{self.branch.name} (docx): 2 وصل في كاش الطباعة.", out.getvalue())
+        self.assertEqual(len(get_print_cache().entries()), 2)
+
+        # بعد التسخين الطباعة لا ترسم أي صفحة
+        with mock.patch('salesapp.printing._render_chunk_body') as render:
+            self.assertEqual(self.client.get(reverse('print_batch_receipts')).status_code, 200)
+        render.assert_not_called()
+
+        if _PDF_AVAILABLE:
+            out = io.StringIO()
+            call_command('print_cache', 'warm', '--format', 'pdf', stdout=out, no_color=True)
+            self.assertIn(f"{self.branch.name} (pdf): 2 وصل في كاش الطباعة.", out.getvalue())
+            self.assertEqual(len(get_print_cache().entries()), 4)
+
+        out = io.StringIO()
+        call_command('print_cache', 'purge', stdout=out, no_color=True)
+        self.assertIn(f"تم حذف {4 if _PDF_AVAILABLE else 2} ملف من كاش الطباعة.", out.getvalue())
+        self.assertEqual(get_print_cache().entries(), [])
+
+    @override_settings(SALES_PRINT_CACHE_MAX_BYTES=0)
+    def test_disabled_cache(self):
+        self.assertIsNone(get_print_cache())
+        out = io.StringIO()
+        call_command('print_cache', 'warm', stdout=out, no_color=True)
+        self.assertIn('معطل', out.getvalue())
+
+
+# =======================================
+# كشف خط سير المحصل (salesapp.route_sheets)
+# =======================================
+_XLSX_NS = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+def _xlsx_rows(test, data):
+    """صفوف ورقة العمل كقوائم [(القيمة، رقم التنسيق)]، النصوص من جدول shared strings."""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        test.assertIsNone(archive.testzip())
+        test.assertIn('/xl/sharedStrings.xml', archive.read('[Content_Types].xml').decode())
+        test.assertIn('Target="sharedStrings.xml"', archive.read('xl/_rels/workbook.xml.rels').decode())
+        styles = ElementTree.fromstring(archive.read('xl/styles.xml'))
+        strings = ElementTree.fromstring(archive.read('xl/sharedStrings.xml'))
+        worksheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+    test.assertEqual(styles.find('x:numFmts/x:numFmt', _XLSX_NS).get('formatCode'), 'dd/mm/yyyy')
+    date_style = styles.findall('x:cellXfs/x:xf', _XLSX_NS)[1]
+    test.assertEqual((date_style.get('numFmtId'), date_style.get('applyNumberFormat')), ('164', '1'))
+    texts = [item.find('x:t', _XLSX_NS).text or '' for item in strings.findall('x:si', _XLSX_NS)]
+    test.assertEqual(int(strings.get('uniqueCount')), len(texts))
+    test.assertEqual(len(set(texts)), len(texts))
+    rows, references = [], 0
+    for row in worksheet.findall('x:sheetData/x:row', _XLSX_NS):
+        values = []
+        for cell in row.findall('x:c', _XLSX_NS):
+            value = cell.find('x:v', _XLSX_NS).text
+            if cell.get('t') == 's':
+                value, references = texts[int(value)], references + 1
+            else:
+                test.assertIsNone(cell.get('t'))
+                value = int(value)
+            values.append((value, int(cell.get('s', 0))))
+        rows.append(values)
+    test.assertEqual(int(strings.get('count')), references)
+    return rows, texts
+
+
+class RouteSheetContentTests(BranchDataTestCase):
+    """محتوى الكشف بكل صيغة: الترتيب بالمنطقة ثم العنوان، رقم المحطة لكل عنوان، وإجماليات كل منطقة."""
+
+    def setUp(self):
+        super().setUp()
+        self.collector = Salesperson.objects.create(name='محصل', branch=self.branch)
+        other = Salesperson.objects.create(name='محصل آخر', branch=self.branch)
+        # الإنشاء بترتيب مختلف عن ترتيب الكشف
+        self.add_route_receipt(40, 'العجوزة', 'شارع النيل 1', (date(2025, 2, 20), 400))
+        self.add_route_receipt(12, 'الدقي', 'شارع التحرير 5', (date(2025, 2, 10), 300))
+        self.add_route_receipt(30, 'الدقي', 'شارع مصدق 2', (date(2025, 2, 5), 200))
+        self.add_route_receipt(11, 'الدقي', 'شارع التحرير 5', (date(2025, 2, 15), 250))
+        self.add_route_receipt(50, '', 'شارع الهرم 9', (date(2025, 2, 1), 150))
+        # خارج الكشف: قسط مدفوع، قسط في الشهر التالي، وقسط لمحصل آخر
+        receipt = self.add_route_receipt(60, 'العجوزة', 'شارع النيل 1', (date(2025, 2, 3), 500), (date(2025, 3, 3), 500))
+        receipt.payments.filter(payment_date__month=2).update(is_paid=True)
+        self.add_route_receipt(70, 'الدقي', 'شارع مصدق 2', (date(2025, 2, 7), 700)).payments.update(collector=other)
+        self.sheet = RouteSheet(self.branch, self.collector, 2025, 2)
+
+    def add_route_receipt(self, number, area, address, *installments):
+        receipt = Receipt.objects.create(
+            receipt_number=number, customer_name=f'عميل {number}', phone_number=f'0100{number}',
+            area=area, address=address, branch=self.branch, sale_year=2025, sale_month=1,
+        )
+        InstallmentPayment.objects.bulk_create(
+            InstallmentPayment(receipt=receipt, payment_date=due, amount=amount, collector=self.collector)
+            for due, amount in installments
+        )
+        return receipt
+
+    # (المحطة، المنطقة، العنوان، رقم الوصل، تاريخ الاستحقاق، المبلغ) بترتيب الكشف
+    expected = [
+        (1, '', 'شارع الهرم 9', 50, date(2025, 2, 1), 150),
+        (2, 'الدقي', 'شارع التحرير 5', 11, date(2025, 2, 15), 250),
+        (2, 'الدقي', 'شارع التحرير 5', 12, date(2025, 2, 10), 300),
+        (3, 'الدقي', 'شارع مصدق 2', 30, date(2025, 2, 5), 200),
+        (4, 'العجوزة', 'شارع النيل 1', 40, date(2025, 2, 20), 400),
+    ]
+
+    def render(self, output_format):
+        content_type, stream = iter_route_sheet(self.sheet, output_format, chunk_size=2)
+        return b''.join(stream)
+
+    def test_stops_grouped_by_area_then_address(self):
+        stops = list(iter_sheet_stops(self.sheet, chunk_size=2))
+        self.assertEqual(
+            [(stop.number, stop.area, stop.address, [i.receipt_number for i in stop.installments]) for stop in stops],
+            [(1, '', 'شارع الهرم 9', [50]), (2, 'الدقي', 'شارع التحرير 5', [11, 12]),
+             (3, 'الدقي', 'شارع مصدق 2', [30]), (4, 'العجوزة', 'شارع النيل 1', [40])],
+        )
+
+    def test_csv_rows(self):
+        data = self.render('csv')
+        self.assertTrue(data.startswith(codecs.BOM_UTF8))
+        header, *rows = csv.reader(io.StringIO(data.decode('utf-8-sig')))
+        self.assertEqual(header, [title for title, _ in ROUTE_COLUMNS])
+        ids = dict(InstallmentPayment.objects.filter(receipt__receipt_number__in=[11, 12, 30, 40, 50])
+                   .values_list('receipt__receipt_number', 'id'))
+        self.assertEqual(rows, [
+            [str(stop), area, address, str(number), f'عميل {number}', f'0100{number}', due.isoformat(), str(amount),
+             str(ids[number])]
+            for stop, area, address, number, due, amount in self.expected
+        ])
+
+    def test_xlsx_cells_and_shared_strings(self):
+        rows, texts = _xlsx_rows(self, self.render('xlsx'))
+        header, *rows = rows
+        self.assertEqual(header, [(title, 2) for title, _ in ROUTE_COLUMNS])
+        self.assertEqual([[value for value, _ in row[:8]] for row in rows], [
+            [stop, area, address, number, f'عميل {number}', f'0100{number}', (due - date(1899, 12, 30)).days, amount]
+            for stop, area, address, number, due, amount in self.expected
+        ])
+        # التاريخ فقط بتنسيق التاريخ، وباقي الخلايا بدون تنسيق
+        self.assertEqual({tuple(style for _, style in row) for row in rows}, {(0, 0, 0, 0, 0, 0, 1, 0, 0)})
+        # كل نص يحفظ مرة واحدة مهما تكرر
+        self.assertEqual(texts.count('الدقي'), 1)
+        self.assertEqual(texts.count('شارع التحرير 5'), 1)
+
+    def test_pdf_lines_and_area_totals(self):
+        lines = [line for line, _ in iter_route_pdf_lines(iter_sheet_stops(self.sheet))]
+        self.assertEqual(
+            [(line.get('stop'), line.get('area'), line.get('address'), line.get('number'), line['name'], line['amount'])
+             for line in lines],
+            [
+                (format_value(1), 'بدون منطقة', 'شارع الهرم 9', format_value(50), 'عميل 50', format_value(150)),
+                (None, None, None, None, f"إجمالي المنطقة ({format_value(1)} محطة)", format_value(150)),
+                (format_value(2), 'الدقي', 'شارع التحرير 5', format_value(11), 'عميل 11', format_value(250)),
+                # نفس المحطة: الرقم والعنوان في أول سطر فقط
+                (None, None, None, format_value(12), 'عميل 12', format_value(300)),
+                # محطة جديدة في نفس المنطقة: المنطقة لا تتكرر
+                (format_value(3), None, 'شارع مصدق 2', format_value(30), 'عميل 30', format_value(200)),
+                (None, None, None, None, f"إجمالي المنطقة ({format_value(2)} محطة)", format_value(750)),
+                (format_value(4), 'العجوزة', 'شارع النيل 1', format_value(40), 'عميل 40', format_value(400)),
+                (None, None, None, None, f"إجمالي المنطقة ({format_value(1)} محطة)", format_value(400)),
+                (None, None, None, None, f"الإجمالي: {format_value(4)} محطة، {format_value(5)} قسط", format_value(1300)),
+            ],
+        )
+
+    @mock.patch('salesapp.route_sheets.ROUTE_ROWS_PER_PAGE', 3)
+    def test_pdf_page_repeats_continued_stop(self):
+        contexts = list(iter_route_pdf_contexts(self.sheet, iter_sheet_stops(self.sheet)))
+        self.assertEqual([context['page'] for context in contexts], [format_value(page) for page in range(1, 4)])
+        # محطة 2 تبدأ في آخر سطر من الصفحة الأولى: أول سطر في الصفحة الثانية يكرر رقمها ومنطقتها وعنوانها
+        self.assertEqual((contexts[0]['stop2'], contexts[0]['number2']), (format_value(2), format_value(11)))
+        self.assertEqual(
+            (contexts[1]['stop0'], contexts[1]['area0'], contexts[1]['address0'], contexts[1]['number0']),
+            (format_value(2), 'الدقي', 'شارع التحرير 5', format_value(12)),
+        )
+        # سطرا الإجمالي في آخر صفحة لا يأخذان بيانات محطة
+        self.assertEqual({field for field in contexts[2] if field[-1] in '12'}, {'name1', 'amount1', 'name2', 'amount2'})
+
+    @skipUnless(_PDF_AVAILABLE, f"PDF printing needs {', '.join(missing_pdf_requirements())}")
+    def test_pdf_pages(self):
+        objects = _read_pdf(self, self.render('pdf'))
+        # 5 أقساط + 3 إجماليات مناطق + الإجمالي في صفحة واحدة
+        self.assertEqual(len([obj for obj in objects.values() if re.search(rb'/Type /Page\b(?!s)', obj)]), 1)
+
+
+# =======================================
+# مهام الطباعة في الخلفية (salesapp.print_jobs)
+# =======================================
+@override_settings(SALES_PRINT_CACHE_MAX_BYTES=0)
+class PrintJobTests(BranchDataTestCase):
+    """إنشاء المهمة من الواجهة، حجزها وتنفيذها بالعامل، ثم متابعة التقدم وتحميل الملف."""
+
+    def setUp(self):
+        super().setUp()
+        self.jobs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.jobs_dir.cleanup)
+        self.enterContext(override_settings(SALES_PRINT_JOBS_DIR=self.jobs_dir.name))
+
+    def test_create_claim_run_progress_download(self):
+        self.add_receipts(2)
+        self.client.post(reverse('create_print_job') + '?year=2025')
+        job = PrintJob.objects.get()
+        self.assertEqual((job.status, job.branch, job.filters), (PrintJob.STATUS_PENDING, self.branch, {'year': '2025'}))
+
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status), (job.pk, PrintJob.STATUS_RUNNING))
+        self.assertIsNotNone(claimed.heartbeat_at)
+        self.assertIsNone(claim_next_job())
+
+        run_print_job(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PrintJob.STATUS_DONE, job.error_message)
+        # وصلين تقسيط بثلاثة أقساط لكل منهما
+        self.assertEqual((job.total_pages, job.pages_done), (6, 6))
+
+        progress = self.client.get(reverse('print_job_progress', args=[job.id])).json()
+        self.assertEqual(progress['percent'], 100)
+        self.assertEqual(progress['download_url'], reverse('download_print_job', args=[job.id]))
+        response = self.client.get(progress['download_url'])
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as docx:
+            self.assertIn('word/document.xml', docx.namelist())
+
+    def test_job_without_pages_fails(self):
+        PrintJob.objects.create(branch=self.branch)
+        job = run_print_job(claim_next_job())
+        self.assertEqual(job.status, PrintJob.STATUS_FAILED)
+        self.assertEqual(self.client.get(reverse('download_print_job', args=[job.id])).status_code, 404)
+
+    def test_stale_running_job_is_requeued(self):
+        job = PrintJob.objects.create(branch=self.branch)
+        claim_next_job()
+        # العامل مازال يعمل: لا تعاد المهمة
+        self.assertEqual(requeue_stale_jobs(), 0)
+        PrintJob.objects.filter(pk=job.pk).update(
+            pages_done=3, heartbeat_at=timezone.now() - timedelta(seconds=settings.SALES_PRINT_JOB_STALE_SECONDS + 1),
+        )
+        # العامل توقف: الحجز التالي يأخذ نفس المهمة من البداية
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status, claimed.pages_done), (job.pk, PrintJob.STATUS_RUNNING, 0))
+
+    def test_wipe_with_print_jobs(self):
+        self.add_receipts(1)
+        PrintJob.objects.create(branch=self.branch)
+        self.assertTrue(PopulateDataCommand(stdout=io.StringIO()).wipe_data())
+        self.assertFalse(Branch.objects.exists())
+        self.assertFalse(PrintJob.objects.exists())
+
+
+# =======================================
+# قياس أداء الطلبات (salesapp.profiling)
+# =======================================
+class RequestProfilingTests(BranchDataTestCase):
+
+    def test_disabled_by_default(self):
+        self.assertEqual(settings.SALES_PROFILING_SAMPLE_RATE, 0)
+        response = self.client.get(reverse('dashboard'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_slow_requests_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('slow_requests')).status_code, 302)
+        self.client.force_login(User.objects.create_user('clerk', password='x'))
+        self.assertEqual(self.client.get(reverse('slow_requests')).status_code, 302)
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(SALES_SLOW_REQUEST_LOG=os.path.join(directory, 'slow.log')):
+                response = self.client.get(reverse('slow_requests'), {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['views'], {})
+
+    @override_settings(SALES_PROFILING_SAMPLE_RATE=1, SALES_SLOW_REQUEST_MS=0)
+    def test_streaming_profile_ends_on_close(self):
+        collector = Salesperson.objects.create(name='محصل', branch=self.branch)
+        self.add_receipts(3)
+        InstallmentPayment.objects.update(collector=collector)
+        response = self.client.get(reverse('collector_route_sheet'), {
+            'collector_id': collector.id, 'month': '2025-02', 'format': 'csv',
+        })
+        self.assertTrue(response.streaming)
+        # الاتصال انقطع بعد أول جزء: القياس ينتهي مع close() بدون قراءة باقي المحتوى
+        next(iter(response.streaming_content))
+        self.assertTrue(connection.execute_wrappers)
+        with self.assertLogs('salesapp.slow_requests', 'WARNING') as logs:
+            response.close()
+        self.assertEqual(connection.execute_wrappers, [])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['streaming']), ('collector_route_sheet', True))
+        self.assertGreater(record['query_count'], 0)
+
+
+# =======================================
+# الإدخال الجماعي للوصلات (salesapp.ingestion)
+# =======================================
+class ReceiptIngestionTests(BranchDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.salesperson = Salesperson.objects.create(name='مندوب', branch=self.branch)
+        self.other_branch = Branch.objects.create(name='فرع آخر')
+        self.enterContext(override_settings(SALES_INGEST_API_TOKENS={
+            'branch-token': self.branch.id, 'other-token': self.other_branch.id,
+        }))
+
+    def receipt(self, product=None, **fields):
+        product = product or self.products[0]
+        return {
+            'salesperson_id': self.salesperson.pk, 'sale_year': 2025, 'sale_month': 1, 'customer_name': 'عميل',
+            'down_payment': 100, 'installment_system': '300*3',
+            'sale_items': [{'id': product.pk, 'quantity': 1, 'price': 1000}], **fields,
+        }
+
+    def ingest(self, receipts, key='key-1', token='branch-token', **payload):
+        headers = {'Idempotency-Key': key}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return self.client.post(
+            reverse('ingest_receipts'), json.dumps({'receipts': receipts, **payload}),
+            content_type='application/json', headers=headers,
+        )
+
+    def test_requires_token_for_the_branch(self):
+        receipts = [self.receipt()]
+        self.assertEqual(self.ingest(receipts, token=None).status_code, 401)
+        self.assertEqual(self.ingest(receipts, token='wrong').status_code, 401)
+        self.assertEqual(self.ingest(receipts, token='other-token', branch_id=self.branch.id).status_code, 403)
+        with override_settings(SALES_INGEST_API_TOKENS={}):
+            self.assertEqual(self.ingest(receipts).status_code, 401)
+        self.assertFalse(Receipt.objects.exists())
+        # بدون branch_id: الفرع من التوكن
+        response = self.ingest(receipts)
+        self.assertEqual((response.status_code, response.json()['branch_id']), (200, self.branch.id))
+
+    def test_replay_returns_saved_results(self):
+        receipts = [self.receipt(), self.receipt(self.products[1], customer_name='عميل 2')]
+        first = self.ingest(receipts).json()
+        self.assertEqual((first['created'], first['replayed']), (2, False))
+        replay = self.ingest(receipts).json()
+        self.assertEqual((replay['results'], replay['replayed']), (first['results'], True))
+        self.assertEqual(Receipt.objects.count(), 2)
+        self.assertEqual(InventoryItem.objects.get(pk=self.products[0].pk).quantity, 99)
+
+    def test_same_key_with_other_payload_conflicts(self):
+        self.ingest([self.receipt()])
+        response = self.ingest([self.receipt(customer_name='عميل آخر')])
+        self.assertEqual(response.status_code, 409)
+        # نفس المفتاح من فرع آخر بنفس البيانات
+        other = self.ingest([self.receipt()], token='other-token')
+        self.assertEqual(other.status_code, 409)
+        self.assertEqual(Receipt.objects.count(), 1)
+
+    def test_partial_results_per_receipt(self):
+        scarce = InventoryItem.objects.create(name='صنف نادر', quantity=1, branch=self.branch)
+        response = self.ingest([
+            self.receipt(),
+            self.receipt(installment_system='300*2'),
+            self.receipt(scarce),
+            self.receipt(scarce, customer_name='عميل 2'),
+            self.receipt(salesperson_id=999999),
+        ]).json()
+        self.assertEqual([result['status'] for result in response['results']], ['created', 'error', 'created', 'error', 'error'])
+        self.assertEqual([result['index'] for result in response['results']], [0, 1, 2, 3, 4])
+        self.assertIn('غير كاف', response['results'][3]['error'])
+        self.assertEqual((response['created'], response['failed']), (2, 3))
+        self.assertEqual(
+            sorted(Receipt.objects.values_list('receipt_number', flat=True)),
+            sorted(result['receipt_number'] for result in response['results'] if result['status'] == 'created'),
+        )
+        self.assertEqual(InventoryItem.objects.get(pk=scarce.pk).quantity, 0)
+
+    def test_interrupted_ingestion_resumes(self):
+        receipts = [self.receipt(customer_name=f'عميل {number}') for number in range(5)]
+        calls = []
+
+        def failing_save_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("انقطاع")
+            return _save_batch(*args)
+
+        with mock.patch('salesapp.ingestion._save_batch', failing_save_batch):
+            with self.assertRaises(RuntimeError):
+                ingest_receipts(self.branch, 'resume', receipts, batch_size=2)
+        self.assertEqual(Receipt.objects.count(), 2)
+        ingestion, replayed = ingest_receipts(self.branch, 'resume', receipts, batch_size=2)
+        self.assertTrue(replayed)
+        self.assertEqual(len(ingestion.results), 5)
+        self.assertEqual(Receipt.objects.count(), 5)
+
+    def test_wipe_with_ingestions(self):
+        self.ingest([self.receipt()])
+        self.assertTrue(PopulateDataCommand(stdout=io.StringIO()).wipe_data())
+        self.assertFalse(Branch.objects.exists())
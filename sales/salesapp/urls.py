@@ -13,7 +13,13 @@ urlpatterns = [
     path('receipts/edit/<int:receipt_id>/', views.edit_receipt, name='edit_receipt'),
     path('receipts/print/<int:receipt_id>/', views.print_receipt, name='print_receipt'),
     path('receipts/print_batch/', views.print_batch_receipts, name='print_batch_receipts'),
+    path('receipts/print_jobs/', views.print_jobs, name='print_jobs'),
+    path('receipts/print_jobs/create/', views.create_print_job, name='create_print_job'),
+    path('receipts/print_jobs/<int:job_id>/progress/', views.print_job_progress, name='print_job_progress'),
+    path('receipts/print_jobs/<int:job_id>/download/', views.download_print_job, name='download_print_job'),
+    path('profiling/slow_requests/', views.slow_requests, name='slow_requests'),
     path('installments/', views.manage_installments, name='manage_installments'),
+    path('installments/route_sheet/', views.collector_route_sheet, name='collector_route_sheet'),
     path('reports/', views.reports_view, name='reports'), # <--- أضف هذا السطر
     # --- (هذه هي الروابط التي كانت ناقصة) ---
     # روابط الحذف الجديدة
@@ -22,4 +28,6 @@ urlpatterns = [
     path('settings/products/delete/<int:pk>/', views.delete_product, name='delete_product'),
 path('settings/inventory/', views.manage_inventory_movements, name='manage_inventory_movements'),
 path('receipts/add/', views.add_receipt, name='add_receipt'),
-path('receipts/search/', views.search_receipts, name='search_receipts'),]
\ No newline at end of file
+path('receipts/ingest/', views.ingest_receipts_api, name='ingest_receipts'),
+path('receipts/search/', views.search_receipts, name='search_receipts'),
+path('receipts/search/suggest/', views.search_suggestions, name='search_suggestions'),]
\ No newline at end of file
@@ -1,17 +1,9 @@
 import re
 import datetime as dt
-from num2words import num2words
 
-def ed2ad(number_string):
-    """
-    Converts English digits (str) to Arabic-Indic digits (str).
-    """
-    numerals = {
-        '0': '٠', '1': '١', '2': '٢', '3': '٣', '4': '٤',
-        '5': '٥', '6': '٦', '7': '٧', '8': '٨', '9': '٩',
-        '.': '٫', # (اختياري) الفاصلة العشرية
-    }
-    return "".join(numerals.get(digit, digit) for digit in str(number_string))
+# تنسيق الأرقام العربية انتقل إلى salesapp.formatting (الأسماء القديمة باقية هنا)
+from .formatting import ed2ad, amount_to_words_ar as get_num_to_words_ar  # noqa: F401
+from .schedule import due_dates
 
 def get_paydL(selds, nofm):
     """
@@ -29,31 +21,34 @@ def get_paydL(selds, nofm):
         # إذا فشل، استخدم تاريخ اليوم كقاعدة
         seld = dt.date.today()
 
-    paydL = []
-    
-    # نفترض أن أول قسط يبدأ بعد شهر من تاريخ البيع
-    # (تعديل: الكود الأصلي الخاص بك يبدأ القسط التالي مباشرة)
-    current_date = seld
+    # نفس يوم البيع في كل شهر تالي (محرك الأقساط في salesapp.schedule)
+    return [due.strftime(r"%d/%m/%Y") for due in due_dates(seld.year, seld.month, nofm, day=seld.day)]
 
-    for i in range(nofm):
-        # إضافة شهر واحد
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year + 1, month=1)
-        else:    
-            current_date = current_date.replace(month=current_date.month + 1)
-        
-        # (اختياري) تثبيت يوم الدفع (مثلاً يوم 15)
-        # current_date = current_date.replace(day=15)
-            
-        paydL.append(str(current_date.strftime(r"%d/%m/%Y")))
-        
-    return paydL
 
-def get_num_to_words_ar(number):
+def month_date_range(year, month):
     """
-    Converts an integer number to Arabic words.
+    Returns (first_day, first_day_of_next_month) for filtering a DateField
+    with __gte/__lt, so the database can use the index on the date column
+    (unlike __year/__month which wrap the column in a function).
     """
-    try:
-        return num2words(int(number), lang='ar')
-    except Exception:
-        return ""
\ No newline at end of file
+    first_day = dt.date(year, month, 1)
+    if month == 12:
+        return first_day, dt.date(year + 1, 1, 1)
+    return first_day, dt.date(year, month + 1, 1)
+
+# التشكيل والتطويل (ـ) يتم حذفهم عند البحث
+_ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{arabic: str(digit) for digit, arabic in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    **{persian: str(digit) for digit, persian in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+})
+
+def normalize_arabic(text):
+    """
+    Normalizes text for searching: removes diacritics/tatweel, folds alef/yaa/taa-marbuta forms,
+    converts Arabic-Indic digits to English digits, lowercases and collapses spaces.
+    """
+    text = _ARABIC_MARKS.sub('', str(text or '')).translate(_ARABIC_FOLDING).lower()
+    return ' '.join(text.split())
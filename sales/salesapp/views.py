@@ -1,61 +1,57 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import Http404, JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
+from django.urls import reverse
 from django.db import IntegrityError, transaction
-from django.db.models import ProtectedError, F, Sum, Count, Value, Max
+from django.db.models import ProtectedError, F, Q, Sum, Count, Value, Max, Prefetch
 from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import json
 import re
 import io
+import itertools
+from collections import Counter
 from datetime import date
-from dateutil.relativedelta import relativedelta
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
 # --- imports الطباعة ---
-from docxtpl import DocxTemplate
-from docxcompose.composer import Composer
 from docx import Document
 from django.conf import settings 
 import os
 
 # --- استيراد الدوال المساعدة ---
-from .utils import ed2ad, get_paydL, get_num_to_words_ar
-from .models import Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment
-
-# --- (دوال مساعدة: إنشاء الرقم وتحليل القسط) ---
+from .utils import month_date_range
+from .printing import (
+    get_invoice_template, iter_print_docx_receipts, InvoiceTemplateError, DOCX_CONTENT_TYPE, PRINT_CHUNK_RECEIPTS,
+)
+from .pdf_printing import iter_print_pdf_receipts, PDF_CONTENT_TYPE, PDF_FORMAT
+from .route_sheets import iter_route_sheet, RouteSheet, ROUTE_SHEET_FORMATS
+from .models import (
+    Branch, Salesperson, InventoryItem, Receipt, SaleItem, InstallmentPayment, PrintJob, ReceiptNumberSequence,
+    BranchMonthStats,
+)
+from .stats import record_new_receipt, update_installments
+from .profiling import read_slow_requests
+from .pagination import KeysetPaginator, cached_count
+from .filter_options import get_filter_options
+from .search_index import receipt_search_q
+from .inventory import reserve_stock
+from .schedule import parse_installment_string, installment_schedule
+from .ingestion import (
+    ingest_receipts, token_branch_id, IngestionError,
+    STATUS_CREATED as INGEST_STATUS_CREATED, STATUS_ERROR as INGEST_STATUS_ERROR,
+)
+from .suggestions import suggest, is_superseded, DEFAULT_LIMIT as DEFAULT_SUGGESTIONS_LIMIT
+
+# --- (دوال مساعدة: إنشاء رقم الوصل، وتحليل القسط في salesapp.schedule) ---
 def generate_receipt_number():
-    last_receipt = Receipt.objects.order_by('-receipt_number').first()
-    if last_receipt:
-        return last_receipt.receipt_number + 1
-    return 1
+    # يحجز الرقم من العداد (يستدعى داخل transaction الحفظ)
+    return ReceiptNumberSequence.allocate(1)[0]
 
-def parse_installment_string(ps_string):
-    if not ps_string: return []
-    try:
-        ps_list1 = re.split("\+", ps_string.strip())
-        ps_list = []
-        for m_part in ps_list1:
-            m = m_part.strip();
-            if not m: raise ValueError("يوجد جزء فارغ (علامة + زائدة؟)")
-            parts = m.split("*")
-            if len(parts) < 2:
-                 if len(parts) == 1 and parts[0].isdigit():
-                     count = 1; amount_str = parts[0].strip()
-                 else: raise ValueError(f"الصيغة '{m_part}' خاطئة.")
-            else:
-                part1 = parts[0].strip(); part2 = parts[1].strip()
-                if not part1.isdigit() or not part2.isdigit(): raise ValueError(f"الأرقام غير صحيحة في '{m_part}'.")
-                num1 = int(part1); num2 = int(part2)
-                if num2 < 20 and num1 >= 20: count = num2; amount_str = part1
-                elif num1 < 20 and num2 >= 20: count = num1; amount_str = part2
-                else: count = num1; amount_str = part2
-            if not amount_str: raise ValueError(f"المبلغ فارغ في '{m_part}'.")
-            if not amount_str.isdigit(): raise ValueError(f"المبلغ '{amount_str}' ليس رقماً.")
-            amount = int(amount_str)
-            for _ in range(count): ps_list.append(amount)
-        return ps_list
-    except ValueError as e: return f"خطأ في تحليل نظام القسط: {e}"
-    except Exception as e: return f"خطأ غير متوقع في تحليل نظام القسط: {e}"
+def peek_receipt_number():
+    # الرقم المتوقع للعرض فقط في شاشة الإضافة
+    return ReceiptNumberSequence.peek_next()
 
 # =======================================
 # (Middleware) فلتر الفرع الشامل
@@ -97,32 +93,31 @@ def dashboard(request):
         if not (1 <= selected_month <= 12): selected_month = now.month
     except (ValueError, TypeError): selected_year = now.year; selected_month = now.month
 
-    sales_by_salesperson = Salesperson.objects.filter(
-        branch=current_branch, receipt__sale_year=selected_year, receipt__sale_month=selected_month
-    ).annotate(total_sales=Coalesce(Sum('receipt__total_amount'), 0), receipt_count=Count('receipt')
-    ).filter(receipt_count__gt=0).order_by('-total_sales')
-    total_sales_all = sum(s.total_sales for s in sales_by_salesperson)
-    downpayments_and_cash = Receipt.objects.filter(
-        branch=current_branch, sale_year=selected_year, sale_month=selected_month
-    ).aggregate(total_downpayments=Coalesce(Sum('down_payment'), 0))['total_downpayments']
+    # القراءة من الملخصات الشهرية (BranchMonthStats) بدلاً من تجميع الوصلات والأقساط في كل طلب
+    month_stats = BranchMonthStats.objects.filter(branch=current_branch, year=selected_year, month=selected_month)
+    sales_by_salesperson = month_stats.filter(salesperson__isnull=False, sales_count__gt=0).values(
+        name=F('salesperson__name'), total_sales=F('sales_total'), receipt_count=F('sales_count')
+    ).order_by('-total_sales')
+    total_sales_all = sum(s['total_sales'] for s in sales_by_salesperson)
+    downpayments_and_cash = month_stats.aggregate(total_downpayments=Coalesce(Sum('down_payments'), 0))['total_downpayments']
     
-    collected_installments_by_collector = Salesperson.objects.filter(
-        branch=current_branch, installmentpayment__is_paid=True,
-        installmentpayment__payment_date__year=selected_year, 
-        installmentpayment__payment_date__month=selected_month
-    ).annotate(
-        total_collected=Coalesce(Sum('installmentpayment__amount'), 0),
-        installments_count=Count('installmentpayment')
-    ).filter(installments_count__gt=0).order_by('-total_collected')
-    total_collected_all = sum(c.total_collected for c in collected_installments_by_collector)
+    collected_installments_by_collector = month_stats.filter(salesperson__isnull=False, collected_count__gt=0).values(
+        name=F('salesperson__name'), total_collected=F('collected_total'), installments_count=F('collected_count')
+    ).order_by('-total_collected')
+    total_collected_all = sum(c['total_collected'] for c in collected_installments_by_collector)
     total_cash_in = downpayments_and_cash + total_collected_all
 
-    last_day_of_selected_month = (date(selected_year, selected_month, 1) + relativedelta(months=1)) - relativedelta(days=1)
-    remaining_installments = InstallmentPayment.objects.filter(
-        receipt__branch=current_branch, payment_date__lte=last_day_of_selected_month, is_paid=False
+    # الأقساط غير المدفوعة المستحقة حتى نهاية الشهر المختار
+    remaining = BranchMonthStats.objects.filter(branch=current_branch).filter(
+        Q(year__lt=selected_year) | Q(year=selected_year, month__lte=selected_month)
+    ).aggregate(
+        unassigned_count=Coalesce(Sum('unpaid_count', filter=Q(salesperson__isnull=True)), 0),
+        unassigned_total=Coalesce(Sum('unpaid_total', filter=Q(salesperson__isnull=True)), 0),
+        assigned_count=Coalesce(Sum('unpaid_count', filter=Q(salesperson__isnull=False)), 0),
+        assigned_total=Coalesce(Sum('unpaid_total', filter=Q(salesperson__isnull=False)), 0),
     )
-    remaining_unassigned = remaining_installments.filter(collector__isnull=True).aggregate(count=Count('id'), total=Coalesce(Sum('amount'), 0))
-    remaining_assigned_not_paid = remaining_installments.filter(collector__isnull=False).aggregate(count=Count('id'), total=Coalesce(Sum('amount'), 0))
+    remaining_unassigned = {'count': remaining['unassigned_count'], 'total': remaining['unassigned_total']}
+    remaining_assigned_not_paid = {'count': remaining['assigned_count'], 'total': remaining['assigned_total']}
     
     available_years = range(now.year - 2, now.year + 2)
     available_months = range(1, 13)
@@ -264,7 +259,7 @@ def add_receipt(request):
         'retained_is_cash': False, 'retained_sale_items_json': '[]',
         'highlight_installment_system': False,
     }
-    context['next_receipt_number'] = generate_receipt_number()
+    context['next_receipt_number'] = peek_receipt_number()
     if request.method == 'POST':
         salesperson_id = request.POST.get('salesperson_id')
         sale_year = request.POST.get('sale_year'); sale_month = request.POST.get('sale_month')
@@ -292,18 +287,18 @@ def add_receipt(request):
         if not error_message:
             try:
                 with transaction.atomic():
+                    for item_data in sale_items_data:
+                        if not item_data.get('id') or not item_data.get('quantity') or item_data.get('price') is None or not item_data.get('name'):
+                            raise ValueError("بيانات منتج غير مكتملة.")
+                    # قفل كل الأصناف باستعلام واحد، التحقق من المخزون، والخصم بـ UPDATE واحد
+                    products = reserve_stock(current_branch, [(item_data['id'], item_data['quantity']) for item_data in sale_items_data])
                     product_strings = []
-                    total_amount_calculated = 0; items_to_save = []; product_updates = {}
+                    total_amount_calculated = 0; items_to_save = []
                     for item_data in sale_items_data:
-                        product_id = item_data.get('id'); quantity = item_data.get('quantity'); unit_price = item_data.get('price')
-                        product_name = item_data.get('name')
-                        if not product_id or not quantity or unit_price is None or not product_name: raise ValueError("بيانات منتج غير مكتملة.")
-                        product = InventoryItem.objects.select_for_update().get(pk=product_id, branch=current_branch)
-                        if product.quantity < quantity: raise IntegrityError(f"مخزون '{product.name}' غير كاف ({product.quantity} متاح).")
-                        items_to_save.append(SaleItem(inventory_item=product, quantity=quantity, unit_price=unit_price))
+                        quantity = item_data['quantity']; unit_price = item_data['price']
+                        items_to_save.append(SaleItem(inventory_item=products[int(item_data['id'])], quantity=quantity, unit_price=unit_price))
                         total_amount_calculated += quantity * unit_price
-                        product_updates[product_id] = quantity
-                        product_strings.append(f"{quantity} x {product_name}")
+                        product_strings.append(f"{quantity} x {item_data['name']}")
                     products_text_to_save = " + ".join(product_strings)
                     if not is_cash_sale:
                          total_installments_value = sum(installment_amounts)
@@ -322,20 +317,16 @@ def add_receipt(request):
                     )
                     for sale_item in items_to_save: sale_item.receipt = receipt
                     SaleItem.objects.bulk_create(items_to_save)
-                    for product_id, quantity_sold in product_updates.items():
-                        InventoryItem.objects.filter(pk=product_id).update(quantity=F('quantity') - quantity_sold)
                     if not is_cash_sale and installment_amounts:
-                        installments_to_create = []
-                        try: start_date = date(int(sale_year), int(sale_month), 15)
+                        try: schedule = installment_schedule(int(sale_year), int(sale_month), installment_amounts)
                         except ValueError: raise ValueError("سنة أو شهر البيع غير صحيح.")
-                        for i, amount in enumerate(installment_amounts):
-                            if amount > 0:
-                                payment_due_date = start_date + relativedelta(months=i + 1)
-                                installments_to_create.append(InstallmentPayment(
-                                    receipt=receipt, payment_date=payment_due_date, amount=amount
-                                ))
+                        installments_to_create = [
+                            InstallmentPayment(receipt=receipt, payment_date=payment_due_date, amount=amount)
+                            for payment_due_date, amount in schedule
+                        ]
                         if installments_to_create:
                             InstallmentPayment.objects.bulk_create(installments_to_create)
+                    record_new_receipt(receipt, installments_to_create if not is_cash_sale else ())
                     request.session['retained_salesperson_id'] = salesperson_id
                     request.session['retained_area'] = area
                     request.session['success_message'] = f"تم حفظ الوصل رقم {receipt_number_to_save} بنجاح."
@@ -359,27 +350,75 @@ def add_receipt(request):
         context['retained_sale_items_json'] = sale_items_json
         context['default_year'] = int(sale_year) if sale_year and sale_year.isdigit() else now.year
         context['default_month'] = int(sale_month) if sale_month and sale_month.isdigit() else now.month
-        context['next_receipt_number'] = generate_receipt_number() 
+        context['next_receipt_number'] = peek_receipt_number() 
         if "الإجمالي" in str(error_message): context['highlight_installment_system'] = True
         return render(request, 'salesapp/add_receipt.html', context)
 
     return render(request, 'salesapp/add_receipt.html', context)
 
 
+# =======================================
+# (جديد) الإدخال الجماعي للوصلات بـ JSON (salesapp.ingestion)
+# =======================================
+@csrf_exempt
+@require_POST
+def ingest_receipts_api(request):
+    """
+    يستقبل {"branch_id", "receipts": [...]} ومفتاح الطلب في header ‏Idempotency-Key (أو الحقل idempotency_key).
+    يرجع نتيجة كل وصل بنفس الترتيب؛ إعادة إرسال نفس الطلب بنفس المفتاح ترجع نفس النتائج بدون تكرار الوصلات.
+    التوكن (Authorization: Bearer) يحدد الفرع المسموح، و branch_id اختياري ويجب أن يطابقه.
+    """
+    allowed_branch_id = token_branch_id(request.headers.get('Authorization'))
+    if allowed_branch_id is None:
+        return JsonResponse({'error': "توكن الإدخال غير صحيح أو غير موجود."}, status=401, json_dumps_params={'ensure_ascii': False})
+    try:
+        payload = json.loads(request.body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return JsonResponse({'error': "خطأ في صيغة JSON."}, status=400, json_dumps_params={'ensure_ascii': False})
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': "الطلب يجب أن يكون object."}, status=400, json_dumps_params={'ensure_ascii': False})
+
+    branch_id = payload.get('branch_id') or allowed_branch_id
+    if str(branch_id) != str(allowed_branch_id):
+        return JsonResponse({'error': "التوكن غير مسموح له بهذا الفرع."}, status=403, json_dumps_params={'ensure_ascii': False})
+    branch = Branch.objects.filter(pk=branch_id).first() if str(branch_id or '').isdigit() else None
+    if branch is None:
+        return JsonResponse({'error': "الفرع غير موجود."}, status=400, json_dumps_params={'ensure_ascii': False})
+
+    key = request.headers.get('Idempotency-Key') or payload.get('idempotency_key')
+    try:
+        ingestion, replayed = ingest_receipts(branch, key, payload.get('receipts'))
+    except IngestionError as e:
+        return JsonResponse({'error': str(e)}, status=e.status, json_dumps_params={'ensure_ascii': False})
+
+    statuses = Counter(result['status'] for result in ingestion.results)
+    return JsonResponse({
+        'idempotency_key': ingestion.key,
+        'branch_id': branch.id,
+        'replayed': replayed,
+        'created': statuses[INGEST_STATUS_CREATED],
+        'failed': statuses[INGEST_STATUS_ERROR],
+        'results': ingestion.results,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
 # =======================================
 # (جديد) دالة مساعدة لفلترة الوصلات
 # =======================================
-def _get_filtered_receipts(request):
-    current_branch = request.branch
-    receipts_list = Receipt.objects.filter(branch=current_branch).order_by('-receipt_number')
+# مفاتيح GET التي تستخدم في فلترة الوصلات (تحفظ أيضاً مع مهام الطباعة)
+RECEIPT_FILTER_PARAMS = ('salesperson', 'year', 'month', 'receipt_from', 'receipt_to', 'customer')
 
-    # قراءة الفلاتر من GET
-    salesperson_id = request.GET.get('salesperson')
-    search_year = request.GET.get('year')
-    search_month = request.GET.get('month')
-    receipt_from = request.GET.get('receipt_from')
-    receipt_to = request.GET.get('receipt_to')
-    customer_name = request.GET.get('customer')
+def filter_receipts(branch, params):
+    # select_related: اسم المندوب يظهر في كل صف بحث وكل صفحة طباعة (بدون استعلام لكل وصل)
+    receipts_list = Receipt.objects.filter(branch=branch).select_related('salesperson').order_by('-receipt_number')
+
+    # قراءة الفلاتر (من GET أو من الفلاتر المحفوظة في مهمة طباعة)
+    salesperson_id = params.get('salesperson')
+    search_year = params.get('year')
+    search_month = params.get('month')
+    receipt_from = params.get('receipt_from')
+    receipt_to = params.get('receipt_to')
+    customer_name = params.get('customer')
 
     # تطبيق الفلاتر
     if salesperson_id: receipts_list = receipts_list.filter(salesperson_id=salesperson_id)
@@ -391,10 +430,19 @@ def _get_filtered_receipts(request):
     try:
         if receipt_to: receipts_list = receipts_list.filter(receipt_number__lte=int(receipt_to))
     except (ValueError, TypeError): pass
-    if customer_name: receipts_list = receipts_list.filter(customer_name__icontains=customer_name)
+    if customer_name: receipts_list = receipts_list.filter(receipt_search_q(customer_name, columns=('customer_name',)))
     
     return receipts_list
 
+def _get_filtered_receipts(request):
+    return filter_receipts(request.branch, request.GET)
+
+def printable_receipts(receipts_list):
+    """يجهز الوصلات للطباعة: الأقساط محملة مسبقاً ومرتبة حسب تاريخ الاستحقاق."""
+    return receipts_list.prefetch_related(
+        Prefetch('payments', queryset=InstallmentPayment.objects.order_by('payment_date'))
+    )
+
 # =======================================
 # (تم التعديل) قسم بحث الوصلات
 # =======================================
@@ -404,11 +452,9 @@ def search_receipts(request):
     # استخدام الدالة المساعدة لجلب الوصلات المفلترة
     receipts_list = _get_filtered_receipts(request)
     
-    paginator = Paginator(receipts_list, 25)
-    page_number = request.GET.get('page')
-    try: receipts_page = paginator.page(page_number)
-    except PageNotAnInteger: receipts_page = paginator.page(1)
-    except EmptyPage: receipts_page = paginator.page(paginator.num_pages)
+    # ترقيم بالمؤشر على رقم الوصل (الصفحات البعيدة بنفس تكلفة الأولى) والعدد الكلي من الكاش
+    paginator = KeysetPaginator(receipts_list, ('-receipt_number',), 25)
+    receipts_page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
 
     salespersons_in_branch = Salesperson.objects.filter(branch=current_branch)
     
@@ -416,6 +462,7 @@ def search_receipts(request):
     context = {
         'page_title': 'بحث / طباعة الوصلات', 
         'receipts': receipts_page,
+        'receipts_total': cached_count(receipts_list),
         'salespersons': salespersons_in_branch,
         'current_salesperson': request.GET.get('salesperson'),
         'current_year': request.GET.get('year'),
@@ -427,6 +474,37 @@ def search_receipts(request):
     return render(request, 'salesapp/search_receipts.html', context)
 
 
+@branch_required
+def search_suggestions(request):
+    """
+    اقتراحات البحث أثناء الكتابة (JSON) لحقل العميل في صفحة البحث.
+    ?q=جزء من الاسم/الهاتف/رقم الوصل &limit=10 &seq=رقم تسلسل الطلب (يرجع كما هو، والطلب الأقدم يتم تجاهله).
+    """
+    query = request.GET.get('q', '')
+    try: seq = int(request.GET.get('seq'))
+    except (TypeError, ValueError): seq = None
+    try: limit = int(request.GET.get('limit', DEFAULT_SUGGESTIONS_LIMIT))
+    except ValueError: limit = DEFAULT_SUGGESTIONS_LIMIT
+
+    if is_superseded(request.session.session_key, seq):
+        return JsonResponse({'q': query, 'seq': seq, 'superseded': True, 'receipts': [], 'customers': []})
+
+    result, cached = suggest(request.branch, query, limit)
+    receipts = []
+    for row in result['receipts']:
+        row = dict(row)  # الصفوف مشتركة مع الكاش
+        row['salesperson'] = row.pop('salesperson__name') or ''
+        row['edit_url'] = reverse('edit_receipt', args=[row['id']])
+        row['print_url'] = reverse('print_receipt', args=[row['id']])
+        receipts.append(row)
+    response = JsonResponse({
+        'q': query, 'seq': seq, 'superseded': False, 'cached': cached,
+        'receipts': receipts, 'customers': result['customers'],
+    }, json_dumps_params={'ensure_ascii': False})
+    response['Cache-Control'] = 'private, max-age=30'
+    return response
+
+
 # =======================================
 # قسم تعديل الوصل
 # =======================================
@@ -434,7 +512,7 @@ def search_receipts(request):
 def edit_receipt(request, receipt_id):
     # ... (الكود كما هو) ...
     current_branch = request.branch
-    try: receipt = Receipt.objects.prefetch_related('items', 'payments').get(pk=receipt_id, branch=current_branch)
+    try: receipt = Receipt.objects.prefetch_related('items__inventory_item', 'payments').get(pk=receipt_id, branch=current_branch)
     except Receipt.DoesNotExist: return redirect('search_receipts') 
     error_message = None; success_message = None; highlight_installment_system = False
     
@@ -487,86 +565,26 @@ def edit_receipt(request, receipt_id):
 @branch_required
 def print_receipt(request, receipt_id):
     try:
-        receipt = Receipt.objects.prefetch_related('payments').get(pk=receipt_id, branch=request.branch)
+        receipt = printable_receipts(Receipt.objects.select_related('salesperson')).get(pk=receipt_id, branch=request.branch)
     except Receipt.DoesNotExist:
         return redirect('search_receipts')
 
-    template_path = os.path.join(settings.BASE_DIR, 'salesapp', 'static', 'salesapp', 'invoice.docx')
-    if not os.path.exists(template_path):
-        return HttpResponse("خطأ: قالب 'invoice.docx' غير موجود.")
-        
-    installments_from_db = list(receipt.payments.all().order_by('payment_date'))
-    nom = len(installments_from_db)
-    
-    # (جديد) قائمة بكل صفحات الوورد لهذا الوصل
-    doc_pages = []
-    paid_so_far = receipt.down_payment 
-
-    if receipt.is_cash_sale:
-        doc = DocxTemplate(template_path)
-        context = {
-            'id': ed2ad(receipt.receipt_number), 'CName': ed2ad(receipt.customer_name),
-            'phnum': ed2ad(receipt.phone_number), 'CAddress': ed2ad(receipt.address),
-            'pro': ed2ad(receipt.products_text), 'area': ed2ad(receipt.area),
-            'empl': ed2ad(receipt.salesperson.name), 'ins': ed2ad("كاش"),
-            'seld': ed2ad(f"{receipt.sale_month}/{receipt.sale_year}"),
-            't': ed2ad("1"), 'i': ed2ad("1"), 'to': ed2ad(receipt.total_amount),
-            're': ed2ad(receipt.down_payment), 'ga': "خالص",
-            'payd': ed2ad(f"{receipt.sale_month}/{receipt.sale_year}"),
-            'evm': ed2ad(receipt.total_amount),
-            'evmar': get_num_to_words_ar(receipt.total_amount)
-        }
-        doc.render(context)
-        # --- (تم الإصلاح) ---
-        doc_pages.append(doc.docx) # استخدام .docx بدلاً من .doc
-    
-    else: # حالة التقسيط
-        for month_index, inst in enumerate(installments_from_db):
-            doc = DocxTemplate(template_path)
-            
-            paid_so_far += inst.amount
-            remaining_after_this = receipt.total_amount - paid_so_far
-            remaining_text = ed2ad(remaining_after_this) if remaining_after_this > 0 else "خالص"
-
-            context = {
-                'id': ed2ad(receipt.receipt_number), 'CName': ed2ad(receipt.customer_name),
-                'phnum': ed2ad(receipt.phone_number), 'CAddress': ed2ad(receipt.address),
-                'pro': ed2ad(receipt.products_text), 'area': ed2ad(receipt.area),
-                'empl': ed2ad(receipt.salesperson.name), 'ins': ed2ad(receipt.installment_system),
-                'seld': ed2ad(f"15/{receipt.sale_month}/{receipt.sale_year}"), # تاريخ بيع افتراضي
-                't': ed2ad(nom), 'i': ed2ad(month_index + 1),
-                'to': ed2ad(receipt.total_amount), 're': ed2ad(receipt.down_payment),
-                'ga': remaining_text, 
-                'payd': ed2ad(inst.payment_date.strftime(r"%d/%m/%Y")),
-                'evm': ed2ad(inst.amount),
-                'evmar': get_num_to_words_ar(inst.amount)
-            }
-            
-            doc.render(context)
-            # --- (تم الإصلاح) ---
-            doc_pages.append(doc.docx) # استخدام .docx بدلاً من .doc
-
-    # --- دمج كل الصفحات ---
-    if not doc_pages:
+    # كل صفحات الوصل (الأقساط مرتبة حسب التاريخ من printable_receipts)، من كاش الطباعة إذا لم يتغير الوصل.
+    # ?format=pdf: ملف PDF يفتح في المتصفح للطباعة مباشرة (بدون Word)
+    try:
+        if request.GET.get('format') == PDF_FORMAT:
+            content = b''.join(iter_print_pdf_receipts([receipt]))
+            content_type, disposition = PDF_CONTENT_TYPE, f'inline; filename="receipt_{receipt.receipt_number}_Full.pdf"'
+        else:
+            content = b''.join(iter_print_docx_receipts(get_invoice_template(), [receipt]))
+            content_type, disposition = DOCX_CONTENT_TYPE, f'attachment; filename="receipt_{receipt.receipt_number}_Full.docx"'
+    except InvoiceTemplateError as e:
+        return HttpResponse(str(e))
+    if not content:
         return HttpResponse("خطأ: لم يتم إنشاء أي صفحات للطباعة.")
 
-    # استخدام أول مستند كقاعدة
-    final_doc_composer = Composer(doc_pages[0])
-    
-    if len(doc_pages) > 1:
-        for doc_page in doc_pages[1:]:
-            final_doc_composer.append(doc_page) # دمج باقي الصفحات
-
-    # --- حفظ الملف المدمج في الذاكرة ---
-    f = io.BytesIO()
-    final_doc_composer.save(f)
-    f.seek(0)
-
-    response = HttpResponse(
-        f.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    )
-    response['Content-Disposition'] = f'attachment; filename="receipt_{receipt.receipt_number}_Full.docx"'
+    response = HttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = disposition
     return response
 
 
@@ -576,111 +594,109 @@ def print_receipt(request, receipt_id):
 @branch_required
 def print_batch_receipts(request):
     # 1. جلب الوصلات المفلترة (بدون تقسيم صفحات)
-    receipts_list = _get_filtered_receipts(request).prefetch_related('payments')
+    receipts_list = printable_receipts(_get_filtered_receipts(request))
     
-    if not receipts_list:
+    if not receipts_list.exists():
         # (يمكن إضافة رسالة خطأ أجمل)
         return HttpResponse("لا توجد وصلات تطابق البحث للطباعة.")
 
-    template_path = os.path.join(settings.BASE_DIR, 'salesapp', 'static', 'salesapp', 'invoice.docx')
-    if not os.path.exists(template_path):
-        return HttpResponse("خطأ: قالب 'invoice.docx' غير موجود.")
+    # 2. رسم الصفحات على دفعات وإرسال الملف للمتصفح أثناء إنشائه (الذاكرة لا تكبر مع عدد الوصلات).
+    # صفحات الوصلات التي لم تتغير منذ آخر طباعة تؤخذ جاهزة من كاش الطباعة
+    receipts_iterator = receipts_list.iterator(chunk_size=PRINT_CHUNK_RECEIPTS)
+    try:
+        if request.GET.get('format') == PDF_FORMAT:
+            # ?format=pdf: صفحات PDF مباشرة بدلاً من دمج مستندات الوورد
+            print_stream = iter_print_pdf_receipts(receipts_iterator)
+            content_type, disposition = PDF_CONTENT_TYPE, 'inline; filename="Batch_Receipts.pdf"'
+        else:
+            # دمج الوورد بالتوازي إذا تم ضبط SALES_PRINT_WORKERS
+            print_stream = iter_print_docx_receipts(get_invoice_template(), receipts_iterator)
+            content_type, disposition = DOCX_CONTENT_TYPE, 'attachment; filename="Batch_Receipts.docx"'
+        first_chunk = next(print_stream, None)
+    except InvoiceTemplateError as e:
+        return HttpResponse(str(e))
+    if first_chunk is None:
+        return HttpResponse("لم يتم العثور على أي أقساط أو وصلات كاش للطباعة.")
 
-    # --- (جديد) تجهيز الملف المدمج الرئيسي ---
-    master_doc_for_composer = None
-    all_other_pages = [] # قائمة بكل الصفحات الأخرى
-    
-    # 2. حلقة على كل وصل في نتائج البحث
-    for receipt in receipts_list:
-        
-        installments_from_db = list(receipt.payments.all().order_by('payment_date'))
-        nom = len(installments_from_db)
-        paid_so_far = receipt.down_payment 
-
-        if receipt.is_cash_sale:
-            doc = DocxTemplate(template_path)
-            context = {
-                'id': ed2ad(receipt.receipt_number), 'CName': ed2ad(receipt.customer_name),
-                'phnum': ed2ad(receipt.phone_number), 'CAddress': ed2ad(receipt.address),
-                'pro': ed2ad(receipt.products_text), 'area': ed2ad(receipt.area),
-                'empl': ed2ad(receipt.salesperson.name), 'ins': ed2ad("كاش"),
-                'seld': ed2ad(f"{receipt.sale_month}/{receipt.sale_year}"),
-                't': ed2ad("1"), 'i': ed2ad("1"), 'to': ed2ad(receipt.total_amount),
-                're': ed2ad(receipt.down_payment), 'ga': "خالص",
-                'payd': ed2ad(f"{receipt.sale_month}/{receipt.sale_year}"),
-                'evm': ed2ad(receipt.total_amount),
-                'evmar': get_num_to_words_ar(receipt.total_amount)
-            }
-            doc.render(context)
-            
-            if master_doc_for_composer is None:
-                master_doc_for_composer = doc.docx # أول صفحة في الملف كله
-            else:
-                all_other_pages.append(doc.docx)
-        
-        else: # حالة التقسيط
-            for month_index, inst in enumerate(installments_from_db):
-                doc = DocxTemplate(template_path)
-                paid_so_far += inst.amount
-                remaining_after_this = receipt.total_amount - paid_so_far
-                remaining_text = ed2ad(remaining_after_this) if remaining_after_this > 0 else "خالص"
-                context = {
-                    'id': ed2ad(receipt.receipt_number), 'CName': ed2ad(receipt.customer_name),
-                    'phnum': ed2ad(receipt.phone_number), 'CAddress': ed2ad(receipt.address),
-                    'pro': ed2ad(receipt.products_text), 'area': ed2ad(receipt.area),
-                    'empl': ed2ad(receipt.salesperson.name), 'ins': ed2ad(receipt.installment_system),
-                    'seld': ed2ad(f"15/{receipt.sale_month}/{receipt.sale_year}"),
-                    't': ed2ad(nom), 'i': ed2ad(month_index + 1),
-                    'to': ed2ad(receipt.total_amount), 're': ed2ad(receipt.down_payment),
-                    'ga': remaining_text, 
-                    'payd': ed2ad(inst.payment_date.strftime(r"%d/%m/%Y")),
-                    'evm': ed2ad(inst.amount),
-                    'evmar': get_num_to_words_ar(inst.amount)
-                }
-                doc.render(context)
-                
-                if master_doc_for_composer is None:
-                    master_doc_for_composer = doc.docx # أول صفحة في الملف كله
-                else:
-                    all_other_pages.append(doc.docx)
+    response = StreamingHttpResponse(itertools.chain([first_chunk], print_stream), content_type=content_type)
+    # اسم ملف عام للطباعة المجمعة
+    response['Content-Disposition'] = disposition
+    return response
 
-    # --- دمج كل الصفحات ---
-    if master_doc_for_composer is None:
-        return HttpResponse("لم يتم العثور على أي أقساط أو وصلات كاش للطباعة.")
 
-    # إنشاء الملف المدمج
-    final_composer = Composer(master_doc_for_composer)
-    for page in all_other_pages:
-        final_composer.append(page) # دمج باقي الصفحات
+# =======================================
+# (جديد) مهام الطباعة المجمعة في الخلفية
+# =======================================
+@branch_required
+def create_print_job(request):
+    """ينشئ مهمة طباعة بفلاتر البحث الحالية، ويتم تجهيز الملف بأمر run_print_jobs."""
+    if request.method != 'POST':
+        return redirect('print_jobs')
+    filters = {key: request.GET.get(key) for key in RECEIPT_FILTER_PARAMS if request.GET.get(key)}
+    PrintJob.objects.create(branch=request.branch, filters=filters)
+    return redirect('print_jobs')
 
-    # --- حفظ الملف المدمج في الذاكرة ---
-    f = io.BytesIO()
-    final_composer.save(f)
-    f.seek(0)
+@branch_required
+def print_jobs(request):
+    jobs = PrintJob.objects.filter(branch=request.branch).order_by('-created_at')[:50]
+    context = {'jobs': jobs, 'page_title': 'مهام الطباعة المجمعة'}
+    return render(request, 'salesapp/print_jobs.html', context)
 
-    response = HttpResponse(
-        f.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    )
-    # اسم ملف عام للطباعة المجمعة
-    response['Content-Disposition'] = 'attachment; filename="Batch_Receipts.docx"'
-    return response
+@branch_required
+def print_job_progress(request, job_id):
+    job = get_object_or_404(PrintJob, pk=job_id, branch=request.branch)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'pages_done': job.pages_done,
+        'total_pages': job.total_pages,
+        'percent': job.progress_percent,
+        'error_message': job.error_message,
+        'download_url': reverse('download_print_job', args=[job.id]) if job.status == PrintJob.STATUS_DONE else None,
+    })
+
+@branch_required
+def download_print_job(request, job_id):
+    job = get_object_or_404(PrintJob, pk=job_id, branch=request.branch, status=PrintJob.STATUS_DONE)
+    if not job.output_path or not os.path.exists(job.output_path):
+        raise Http404("ملف مهمة الطباعة غير موجود.")
+    return FileResponse(open(job.output_path, 'rb'), as_attachment=True,
+                        filename=f"Batch_Receipts_{job.id}.docx", content_type=DOCX_CONTENT_TYPE)
+
+# =======================================
+# (جديد) سجل الطلبات البطيئة (salesapp.profiling)
+# =======================================
+@staff_member_required
+def slow_requests(request):
+    """
+    عرض الطلبات البطيئة مجمعة حسب الشاشة (?format=json للحصول على البيانات فقط).
+    السجل فيه نص استعلامات SQL، فالعرض لحسابات الإدارة فقط.
+    """
+    summary = read_slow_requests()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'views': summary, 'sample_rate': settings.SALES_PROFILING_SAMPLE_RATE,
+                             'slow_request_ms': settings.SALES_SLOW_REQUEST_MS},
+                            json_dumps_params={'ensure_ascii': False})
+    context = {
+        'summary': summary,
+        'sample_rate_percent': round(settings.SALES_PROFILING_SAMPLE_RATE * 100, 1),
+        'slow_request_ms': settings.SALES_SLOW_REQUEST_MS,
+        'page_title': 'الطلبات البطيئة',
+    }
+    return render(request, 'salesapp/slow_requests.html', context)
 # salesapp/views.py
 
 import json
 from datetime import date
-from dateutil.relativedelta import relativedelta
 from django.shortcuts import render, redirect, get_object_or_404
 from django.db import transaction
 from django.db.models import F, Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db import IntegrityError
 from django.utils import timezone
-from django.db.models.functions import TruncMonth 
 
 # تأكد من استيراد هذه الدوال والنماذج
 from .models import Receipt, InventoryItem, Salesperson, SaleItem, InstallmentPayment
-from .app_functions import parse_installment_string 
 
 
 # =======================================
@@ -691,6 +707,7 @@ def manage_installments(request):
     current_branch = request.branch
     error_message = None
     success_message = None
+    route_sheet_collector_id = None
     
     # ------------------------------------------------
     # 1. جلب بيانات البحث والفلترة (المدخلات الجديدة)
@@ -729,8 +746,10 @@ def manage_installments(request):
                     # يتم الإسناد لأي قسط (مسند أو غير مسند) طالما تم اختياره
                     bulk_qs = InstallmentPayment.objects.filter(pk__in=selected_ids, receipt__branch=current_branch, is_paid=False)
                     
-                    count = bulk_qs.update(collector=new_collector)
+                    count = update_installments(bulk_qs, collector=new_collector)
                     success_message = f"تم إسناد **{count} قسط** للمحصل {new_collector.name} بنجاح."
+                    # كشف خط السير يفتح على المحصل الذي تم الإسناد له
+                    route_sheet_collector_id = str(new_collector.pk)
                     
                 except Salesperson.DoesNotExist:
                     error_message = "المحصل غير موجود."
@@ -747,8 +766,7 @@ def manage_installments(request):
                     collector__isnull=False
                 )
                 
-                # استخدام datetime.date لتجنب مشاكل timezone مع التحديث الجماعي
-                count = bulk_qs.update(is_paid=True, collection_date=date.today()) 
+                count = update_installments(bulk_qs, is_paid=True)
                 
                 if count > 0:
                     success_message = f"تم تأكيد تحصيل **{count} قسط** بنجاح."
@@ -775,7 +793,10 @@ def manage_installments(request):
     
     # فلتر الاسم
     if search_name:
-        due_installments_qs = due_installments_qs.filter(Q(receipt__customer_name__icontains=search_name) | Q(receipt__customer_phone__icontains=search_name))
+        # فهرس البحث (salesapp.search_index): جزء من الاسم أو الهاتف بدون مسح كل الوصلات
+        due_installments_qs = due_installments_qs.filter(
+            receipt_search_q(search_name, columns=('customer_name', 'phone_number'), receipt_path='receipt__')
+        )
     
     # مدى رقم الوصل
     if search_receipt_num_from and search_receipt_num_from.isdigit():
@@ -798,7 +819,8 @@ def manage_installments(request):
     if search_payment_month:
         try:
             year, month = map(int, search_payment_month.split('-'))
-            due_installments_qs = due_installments_qs.filter(payment_date__year=year, payment_date__month=month)
+            month_start, next_month_start = month_date_range(year, month)
+            due_installments_qs = due_installments_qs.filter(payment_date__gte=month_start, payment_date__lt=next_month_start)
         except ValueError:
             pass 
 
@@ -821,32 +843,9 @@ def manage_installments(request):
     # 2. أقساط مسندة وجاهزة للتحصيل (Confirmation View)
     qs_for_confirmation = due_installments_qs.filter(collector__isnull=False)
 
-    # ... (جلب المناطق والأشهر المتاحة كما في الكود السابق) ...
-    # جلب قائمة المناطق المتاحة
-    available_areas = Receipt.objects.filter(branch=current_branch).values_list('area', flat=True).distinct().exclude(area__exact='').order_by('area')
-    
-    # جلب قائمة الأشهر المتاحة للدفع (الاستحقاق)
-    unique_payment_months_dates = InstallmentPayment.objects.filter(
-        receipt__branch=current_branch
-    ).annotate(
-        month_year=TruncMonth('payment_date')
-    ).values_list('month_year', flat=True).distinct().order_by('-month_year')
-    available_payment_months = [d.strftime('%Y-%m') for d in unique_payment_months_dates if d is not None]
+    # قوائم خيارات الفلاتر (المناطق، أشهر الدفع، أشهر البيع) من الكاش لكل فرع
+    filter_options = get_filter_options(current_branch)
 
-    # *******************************************************
-    # جلب قائمة الأشهر المتاحة للبيع (التعديل لمعالجة sale_year و sale_month)
-    # *******************************************************
-    unique_sale_months_pairs = Receipt.objects.filter(branch=current_branch).values(
-        'sale_year', 'sale_month'
-    ).distinct().order_by('-sale_year', '-sale_month')
-
-    available_sale_months = [
-        # يتم دمج السنة والشهر مع التأكد من وجود قيمة وإضافة صفر في بداية الشهر إذا لزم الأمر
-        f"{p['sale_year']}-{p['sale_month']:02d}" 
-        for p in unique_sale_months_pairs if p['sale_year'] and p['sale_month']
-    ]
-    
-    
     # ------------------------------------------------
     # 4. ترقيم الصفحات لكل جدول على حدة (الجدول مرئي واحد فقط في كل مرة)
     # ------------------------------------------------
@@ -858,27 +857,25 @@ def manage_installments(request):
     else:
         current_qs = qs_for_confirmation
 
-    paginator = Paginator(current_qs, 50) 
-    page_number = request.GET.get('page')
-    try:
-        installments_page = paginator.page(page_number)
-    except PageNotAnInteger:
-        installments_page = paginator.page(1)
-    except EmptyPage:
-        installments_page = paginator.page(paginator.num_pages)
-        
+    # ترقيم بالمؤشر على (تاريخ الاستحقاق، رقم القسط) والأعداد الكلية من الكاش
+    paginator = KeysetPaginator(current_qs, ('payment_date', 'id'), 50)
+    installments_page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    installments_for_assignment = cached_count(qs_for_assignment)
+    installments_for_confirmation = cached_count(qs_for_confirmation)
+
     context = {
         'page_title': 'تنظيم وتحصيل الأقساط',
         'view_mode': view_mode, # لتحديد الجدول الذي يجب إظهاره
         
         'installments': installments_page,
-        'installments_for_assignment': qs_for_assignment.count(), # العدد الكلي لخانة الإسناد
-        'installments_for_confirmation': qs_for_confirmation.count(), # العدد الكلي لخانة التأكيد
+        'installments_for_assignment': installments_for_assignment, # العدد الكلي لخانة الإسناد
+        'installments_for_confirmation': installments_for_confirmation, # العدد الكلي لخانة التأكيد
+        'installments_total': installments_for_assignment if view_mode == 'assignment' else installments_for_confirmation,
         
         'salespersons': salespersons_in_branch,
-        'available_areas': available_areas, 
-        'available_payment_months': available_payment_months, 
-        'available_sale_months': available_sale_months, 
+        'available_areas': filter_options['areas'], 
+        'available_payment_months': filter_options['payment_months'], 
+        'available_sale_months': filter_options['sale_months'], 
         
         # إرسال قيم البحث مرة أخرى للقالب للحفاظ عليها في حقول البحث
         'search_name': search_name,
@@ -889,10 +886,52 @@ def manage_installments(request):
         'search_payment_month': search_payment_month, 
         'search_sale_month': search_sale_month, 
         
+        # كشف خط سير المحصل (collector_route_sheet)
+        'route_sheet_collector_id': route_sheet_collector_id or search_collector_id,
+        
         'error_message': error_message,
         'success_message': success_message,
     }
     return render(request, 'salesapp/manage_installments.html', context)
+
+
+# =======================================
+# (جديد) كشف خط سير المحصل
+# =======================================
+@branch_required
+def collector_route_sheet(request):
+    """
+    الأقساط غير المدفوعة المسندة لمحصل في شهر استحقاق، مجمعة بالمنطقة والعنوان (salesapp.route_sheets).
+    ?collector_id=&month=YYYY-MM&format=pdf|csv|xlsx
+    """
+    collector_id = request.GET.get('collector_id', '').strip()
+    collector = None
+    if collector_id.isdigit():
+        collector = Salesperson.objects.filter(pk=collector_id, branch=request.branch).first()
+    if collector is None:
+        return HttpResponse("يجب اختيار محصل من هذا الفرع.")
+    try:
+        year, month = map(int, request.GET.get('month', '').split('-'))
+        month_date_range(year, month)
+    except ValueError:
+        return HttpResponse("يجب اختيار شهر الاستحقاق (YYYY-MM).")
+    output_format = request.GET.get('format', PDF_FORMAT)
+    if output_format not in ROUTE_SHEET_FORMATS:
+        return HttpResponse("صيغة الملف غير مدعومة.")
+
+    # الملف يرسل أثناء قراءة الأقساط من قاعدة البيانات (استعلام واحد على دفعات)
+    try:
+        content_type, sheet_stream = iter_route_sheet(RouteSheet(request.branch, collector, year, month), output_format)
+        first_chunk = next(sheet_stream, None)
+    except InvoiceTemplateError as e:
+        return HttpResponse(str(e))
+    if first_chunk is None:
+        return HttpResponse("لا توجد أقساط غير مدفوعة مسندة لهذا المحصل في هذا الشهر.")
+
+    response = StreamingHttpResponse(itertools.chain([first_chunk], sheet_stream), content_type=content_type)
+    disposition = 'inline' if output_format == PDF_FORMAT else 'attachment'
+    response['Content-Disposition'] = f'{disposition}; filename="Route_Sheet_{collector.pk}_{year}-{month:02d}.{output_format}"'
+    return response
 # =======================================
 # salesapp/views.py
 # salesapp/views.py